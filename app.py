@@ -1,20 +1,39 @@
 import os
+import math
 import json
-import re
+import base64
+import hmac
 import datetime
+import time
 import numpy as np
-import threading
 import uuid
-from flask import Flask, request, jsonify
+import queue
+import threading
+from collections import Counter
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager, jwt_required, get_jwt_identity
 import google.generativeai as genai
 from dotenv import load_dotenv
-from models import db, bcrypt, User, Analysis, AnalysisJob
+from sqlalchemy import inspect
+from sqlalchemy.orm import undefer
+from sqlalchemy.orm.attributes import flag_modified
+from models import db, bcrypt, ensure_schema, User, Analysis, AnalysisJob, BulkJob, ApiUsage
 from auth import auth_bp
-from colab_analyzer import create_colab_analyzer
-import requests
-from bs4 import BeautifulSoup
+from job_queue import JobQueue
+from fetcher import get_fetcher, FetchError
+import page_cache
+from sitemap import resolve_sitemap
+from progress_events import progress_broker, format_sse, ProgressReporter, TERMINAL_EVENTS
+from job_state import job_states
+from retention import RetentionJanitor, RETENTION_ENABLED
+from metrics import metrics, StageSpans
+from usage import UsageMeter, metering, api_call
+from colab_analyzer import get_analyzer, get_generative_model, warm_up, embed_texts, SimilarityEngine
+from embedding_cache import get_embedding_cache
+from fanout_cache import get_fanout_cache
+from chunk_dedup import get_chunk_index
+from html_extract import StreamingExtractor, extract_text_soup, HTML_CONTENT_TYPES, MAX_TEXT_CHARS
 
 # Load environment variables
 load_dotenv()
@@ -67,9 +86,51 @@ jwt = JWTManager(app)
 # Register blueprints
 app.register_blueprint(auth_bp)
 
-# In-memory storage for job results
-job_results = {}
-job_status = {}
+# Bounded worker pool for analysis jobs
+ANALYSIS_WORKERS = int(os.getenv('ANALYSIS_WORKERS', '2'))
+ANALYSIS_QUEUE_SIZE = int(os.getenv('ANALYSIS_QUEUE_SIZE', '20'))
+ANALYSIS_RETRY_AFTER = int(os.getenv('ANALYSIS_RETRY_AFTER', '30'))  # Seconds suggested to clients on 429
+analysis_queue = JobQueue(workers=ANALYSIS_WORKERS, max_size=ANALYSIS_QUEUE_SIZE, name='analysis')
+
+# Bulk jobs: one dispatcher feeds pages into the analysis pool, leaving headroom for single analyses
+BULK_MAX_URLS = int(os.getenv('BULK_MAX_URLS', '500'))
+BULK_QUEUE_SIZE = int(os.getenv('BULK_QUEUE_SIZE', '5'))
+BULK_QUEUE_HEADROOM = int(os.getenv('BULK_QUEUE_HEADROOM', str(max(1, ANALYSIS_QUEUE_SIZE // 4))))
+bulk_queue = JobQueue(workers=1, max_size=BULK_QUEUE_SIZE, name='bulk')
+
+# Progress streams (SSE): each open stream holds one server thread, so they are capped
+SSE_MAX_STREAMS = int(os.getenv('SSE_MAX_STREAMS', '8'))
+SSE_HEARTBEAT_SECONDS = float(os.getenv('SSE_HEARTBEAT_SECONDS', '15'))
+SSE_MAX_SECONDS = int(os.getenv('SSE_MAX_SECONDS', '300'))
+sse_slots = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+
+# Retention: expired job rows are purged in the background; deleted jobs leave the status cache
+def forget_jobs(job_ids):
+    for job_id in job_ids:
+        job_states.discard(job_id)
+
+
+janitor = RetentionJanitor(app, on_delete=forget_jobs)
+
+
+@app.before_request
+def start_background_tasks():
+    if RETENTION_ENABLED:
+        janitor.ensure_running()
+    metrics.ensure_exporting()
+
+# History listing
+HISTORY_MAX_PER_PAGE = 100
+HISTORY_COUNT_CAP = int(os.getenv('HISTORY_COUNT_CAP', '1000'))  # ?total=approx counts at most this many rows
+COMPACT_BATCH_SIZE = 200  # Rows per transaction in the compact-results command
+
+# API usage reports
+USAGE_MAX_DAYS = 366
+USAGE_MAX_GROUPS = 100
+USAGE_GROUPS = ('day', 'url', 'user')
+
+# Prometheus scrape endpoint: disabled until METRICS_TOKEN is set, then it needs "Authorization: Bearer <token>"
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
 
 # API Keys - NEVER hardcode, always use environment variables
 # Gemini configuration - MUST be set in environment variables
@@ -80,6 +141,9 @@ if not GEMINI_API_KEY:
 genai.configure(api_key=GEMINI_API_KEY)
 print(f"[INFO] Gemini API configured")
 
+HTML_EXTRACTOR = os.getenv('HTML_EXTRACTOR', 'stream')  # stream | soup
+CONTENT_EXTRACTION = os.getenv('CONTENT_EXTRACTION', 'full')  # full | main (boilerplate removed; scores differ from full)
+
 MODEL_FOR_URL_CONTEXT = "gemini-2.0-flash"
 MODEL_FOR_QUERY_GEN = "gemini-2.0-flash-exp"
 GEMINI_EMBEDDING_MODEL = "models/text-embedding-004"
@@ -99,7 +163,7 @@ def get_url_insights_and_content(url: str) -> dict:
     """Extract entity, content, and language from URL using Gemini"""
     try:
         # Use Gemini to extract content from URL
-        model = genai.GenerativeModel(MODEL_FOR_URL_CONTEXT)
+        model = get_generative_model(MODEL_FOR_URL_CONTEXT)
         
         prompt = f"""Analyze the webpage at {url}.
         
@@ -114,7 +178,9 @@ Respond in JSON format:
   "content_chunks": ["chunk1", "chunk2", ...]
 }}"""
         
-        response = model.generate_content(prompt)
+        with api_call('generate', input_chars=len(prompt)) as call:
+            response = model.generate_content(prompt)
+            call.generated(response)
         text = response.text.strip()
         
         # Clean markdown code blocks
@@ -151,11 +217,12 @@ Respond in JSON format:
 def get_embedding(text: str) -> np.ndarray:
     """Generate embedding using Gemini"""
     try:
-        result = genai.embed_content(
-            model=EMBEDDING_MODEL,
-            content=text.strip(),
-            task_type="retrieval_document"
-        )
+        with api_call('embed', input_chars=len(text.strip()), texts=1):
+            result = genai.embed_content(
+                model=GEMINI_EMBEDDING_MODEL,
+                content=text.strip(),
+                task_type="retrieval_document"
+            )
         
         if 'embedding' in result:
             return np.array(result['embedding']).astype('float32')
@@ -165,17 +232,6 @@ def get_embedding(text: str) -> np.ndarray:
         print(f"Error in get_embedding: {e}")
         return np.array([])
 
-def cosine_similarity(vec1, vec2):
-    """Calculate cosine similarity between two vectors"""
-    if not isinstance(vec1, np.ndarray) or not isinstance(vec2, np.ndarray) or vec1.size == 0 or vec2.size == 0:
-        return 0.0
-    dot_product = np.dot(vec1, vec2)
-    norm_vec1 = np.linalg.norm(vec1)
-    norm_vec2 = np.linalg.norm(vec2)
-    if norm_vec1 == 0 or norm_vec2 == 0:
-        return 0.0
-    return float(dot_product / (norm_vec1 * norm_vec2))
-
 def generate_query_fanout_prompt(entity: str, language: str = "en", mode: str = "complex") -> str:
     """Generate prompt for query fan-out with routing in target language"""
     min_queries = 20 if mode == "complex" else 10
@@ -268,10 +324,12 @@ Return only a valid JSON object in this exact schema:
 def generate_synthetic_queries(entity: str, language: str = "en", mode: str = "complex") -> dict:
     """Generate synthetic queries with routing using Gemini, translated to target language"""
     try:
-        model = genai.GenerativeModel(MODEL_FOR_QUERY_GEN)
+        model = get_generative_model(MODEL_FOR_QUERY_GEN)
         prompt = generate_query_fanout_prompt(entity, language, mode)
         
-        response = model.generate_content(prompt)
+        with api_call('generate', input_chars=len(prompt)) as call:
+            response = model.generate_content(prompt)
+            call.generated(response)
         json_text = response.text.strip()
         
         # Clean markdown code blocks
@@ -308,11 +366,22 @@ def calculate_coverage(queries: list, content_chunks: list, threshold: float = 0
     covered_count = 0
     query_details = []
     
-    for query_obj in queries:
-        query_text = query_obj.get("query", "")
-        query_embedding = get_embedding(query_text)
+    # Embed every chunk and query once, then score them all with one matrix multiply
+    query_texts = [query_obj.get("query", "") for query_obj in queries]
+    scored = [i for i, text in enumerate(query_texts) if text.strip()]
+    row_for = {qi: row for row, qi in enumerate(scored)}
+    try:
+        chunk_emb = embed_texts([chunk.strip() for chunk in content_chunks])
+        query_emb = embed_texts([query_texts[i].strip() for i in scored])
+        top_idx, top_scores = SimilarityEngine(chunk_emb).top_k(query_emb, 1)
+    except Exception as e:
+        print(f"Error in calculate_coverage embeddings: {e}")
+        row_for = {}
+    
+    for i, query_obj in enumerate(queries):
+        query_text = query_texts[i]
         
-        if query_embedding.size == 0:
+        if i not in row_for:
             query_details.append({
                 "query": query_text,
                 "type": query_obj.get("type", ""),
@@ -326,15 +395,9 @@ def calculate_coverage(queries: list, content_chunks: list, threshold: float = 0
             })
             continue
         
-        max_similarity = 0.0
-        best_chunk = ""
-        for chunk in content_chunks:
-            chunk_embedding = get_embedding(chunk)
-            if chunk_embedding.size > 0:
-                sim = cosine_similarity(query_embedding, chunk_embedding)
-                if sim > max_similarity:
-                    max_similarity = sim
-                    best_chunk = chunk
+        row = row_for[i]
+        max_similarity = max(float(top_scores[row, 0]), 0.0)
+        best_chunk = content_chunks[int(top_idx[row, 0])] if max_similarity > 0 else ""
         
         is_covered = max_similarity >= threshold
         if is_covered:
@@ -446,84 +509,99 @@ def index():
             'auth': '/api/auth',
             'analyze': '/api/analyze',
             'status': '/api/status/<job_id>',
+            'queue': '/api/queue',
+            'bulk_analyze': '/api/bulk-analyze',
+            'bulk': '/api/bulk/<bulk_id>',
             'history': '/api/history'
         }
     })
 
-def extract_content_from_url(url):
+def extract_content_from_url(url, headers=None, spans=None):
     """
-    Extract content from URL using BeautifulSoup with retry logic
+    Extract content from URL, fetched through the shared pooled fetcher and parsed with the
+    streaming lxml extractor (HTML_EXTRACTOR=soup switches back to BeautifulSoup)
+    
+    Conditional request headers may be passed; a 304 reply returns not_modified=True without content.
+    With CONTENT_EXTRACTION=main only the main content (no menus, banners, sidebars) is kept.
+    Download and parse time are recorded on spans as the 'fetch' and 'parse' stages.
     """
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
+    spans = spans or StageSpans()
+    main_content = CONTENT_EXTRACTION == 'main'
+    stream = HTML_EXTRACTOR != 'soup' or main_content
+    extractors = []
     
-    # Retry logic - try 3 times with increasing timeout
-    max_retries = 3
-    timeouts = [15, 30, 45]  # Progressive timeout
+    def make_extractor(response_headers):
+        extractors.append(StreamingExtractor(content_type=response_headers.get('Content-Type'),
+                                             main_content=main_content))
+        return extractors[-1]
     
-    for attempt in range(max_retries):
+    fetch_started = time.perf_counter()
+    try:
         try:
-            timeout = timeouts[attempt]
-            print(f"[Content Extraction] Attempt {attempt + 1}/{max_retries} with {timeout}s timeout...")
-            
-            r = requests.get(url, headers=headers, timeout=timeout, allow_redirects=True)
-            r.raise_for_status()
-            s = BeautifulSoup(r.content, 'lxml')
-            
-            # If we get here, request succeeded
-            break
-            
-        except requests.exceptions.Timeout:
-            if attempt < max_retries - 1:
-                print(f"[Content Extraction] Timeout on attempt {attempt + 1}, retrying...")
-                continue
-            else:
-                # Final attempt failed
-                return {
-                    'success': False, 
-                    'error': f'Connection timeout after {max_retries} attempts - the website is too slow or unreachable.',
-                    'url': url
-                }
-        except requests.exceptions.ConnectionError as e:
-            if attempt < max_retries - 1:
-                print(f"[Content Extraction] Connection error on attempt {attempt + 1}, retrying...")
-                continue
-            else:
-                return {
-                    'success': False,
-                    'error': f'Connection failed after {max_retries} attempts - unable to reach the website.',
-                    'url': url
-                }
-        except requests.exceptions.HTTPError as e:
-            # Don't retry on HTTP errors (404, 500, etc.)
-            return {
-                'success': False,
-                'error': f'HTTP error {e.response.status_code} - the website returned an error.',
-                'url': url
-            }
-        except Exception as e:
-            return {
-                'success': False, 
-                'error': f'Failed to extract content: {str(e)[:200]}',
-                'url': url
-            }
+            page = get_fetcher().fetch(
+                url,
+                headers=headers,
+                allowed_types=HTML_CONTENT_TYPES,
+                sink_factory=make_extractor if stream else None
+            )
+        finally:
+            # Streaming parses while downloading; its share is reported as 'parse'
+            parse_seconds = sum(e.parse_seconds for e in extractors)
+            spans.add('fetch', time.perf_counter() - fetch_started - parse_seconds)
+            if parse_seconds:
+                spans.add('parse', parse_seconds)
+        validators = {
+            'etag': page['headers'].get('ETag'),
+            'last_modified': page['headers'].get('Last-Modified')
+        }
+        if page['status_code'] == 304:
+            print(f"[Content Extraction] Not modified: {url}")
+            return {'success': True, 'not_modified': True, 'url': url, **validators}
+    except FetchError as e:
+        if e.kind == 'timeout':
+            error = f'Connection timeout after {e.attempts} attempts - the website is too slow or unreachable.'
+        elif e.kind == 'connection':
+            error = f'Connection failed after {e.attempts} attempts - unable to reach the website.'
+        elif e.kind == 'http':
+            error = f'HTTP error {e.status_code} - the website returned an error.'
+        elif e.kind == 'content_type':
+            error = f'{e} - only HTML pages can be analyzed.'
+        else:
+            error = f'Failed to extract content: {str(e)[:200]}'
+        return {
+            'success': False,
+            'error': error,
+            'url': url
+        }
+    except Exception as e:
+        return {
+            'success': False, 
+            'error': f'Failed to extract content: {str(e)[:200]}',
+            'url': url
+        }
     
     # Continue with parsing if request succeeded
     try:
         
-        # Remove unwanted tags (same as notebook)
-        for t in s(['script', 'style', 'noscript', 'iframe', 'svg', 'nav', 'footer', 'aside']):
-            t.decompose()
-        
-        title = s.find('title')
-        title_text = title.get_text(strip=True) if title else 'Untitled'
+        # Extract text minus script/style/nav/footer/aside subtrees (same as notebook);
+        # the streaming extractor already parsed the body while it downloaded
+        main_content_stats = None
+        if stream:
+            title_text, content = page['sink_result']
+            main_content_stats = extractors[-1].main_content_stats
+        else:
+            with spans.span('parse'):
+                title_text, content = extract_text_soup(page['content'])
+            content = content[:MAX_TEXT_CHARS]
         
-        # Extract ALL text - simple and effective like the notebook
-        content = s.get_text(separator=' ', strip=True)
-        
-        # Clean up whitespace
-        content = re.sub(r'\s+', ' ', content).strip()
+        truncated = page['truncated']
+        if truncated:
+            print(f"[Content Extraction] Truncated after {page['bytes_read']} bytes / {len(content)} chars")
+        if main_content_stats:
+            print(f"[Content Extraction] Main content: kept {main_content_stats['chars_kept']}/"
+                  f"{main_content_stats['chars_total']} chars, {main_content_stats['blocks_kept']}/"
+                  f"{main_content_stats['blocks_total']} blocks"
+                  f"{' (fallback to full text)' if main_content_stats['fallback'] else ''}")
         
         # Log content length for debugging
         print(f"[Content Extraction] Title: {title_text}")
@@ -534,7 +612,11 @@ def extract_content_from_url(url):
             'title': title_text,
             'content': content,
             'word_count': len(content.split()),
-            'url': url
+            'url': url,
+            'truncated': truncated,
+            'bytes_read': page['bytes_read'],
+            'main_content': main_content_stats,
+            **validators
         }
     except Exception as e:
         # Catch any parsing errors
@@ -545,58 +627,246 @@ def extract_content_from_url(url):
         }
 
 
-def process_analysis(job_id, url, user_id):
+def update_job(job_id, job, status=None, progress=None, error=None, result_data=None, store_result=True,
+               stage_timings=None):
+    """Persist a job state change and publish it to the job's progress streams
+    
+    store_result=False publishes result_data without saving it on the job row.
+    """
+    if job:
+        if status:
+            job.status = status
+        if progress:
+            job.progress = progress
+        if error:
+            job.error = error
+        if result_data is not None and store_result:
+            job.result_data = result_data
+        if stage_timings is not None:
+            job.stage_timings = stage_timings
+        db.session.commit()
+        status = job.status
+        job_states.put(job_id, job_snapshot(job))  # Write-through: status reads skip the DB
+    
+    event = status if status in TERMINAL_EVENTS else 'status'
+    data = {'job_id': job_id, 'status': status}
+    if progress:
+        data['progress'] = progress
+    if error:
+        data['error'] = error
+    if result_data is not None:
+        data['result'] = result_data
+    progress_broker.publish(job_id, event, data)
+
+
+def persist_progress(job_id, progress):
+    """Progress-only write used by ProgressReporter flushes (may run on a stage thread)"""
+    with app.app_context():
+        AnalysisJob.query.filter_by(job_id=job_id).update({'progress': progress})
+        db.session.commit()
+
+
+def history_entry(job, result_data):
+    """History row for a completed job"""
+    return Analysis(
+        job_id=job.job_id,
+        user_id=job.user_id,
+        url=result_data['url'],
+        entity=result_data['entity'],
+        language=result_data.get('language', 'en'),
+        ai_visibility_score=result_data['ai_visibility_score'],
+        total_queries=result_data['coverage_details']['total_queries'],
+        covered_queries=result_data['coverage_details']['covered_queries'],
+        result_data=result_data
+    )
+
+
+def record_usage(job_id, meter, outcome, content_data=None, result=None):
+    """Store the job's API usage in its own transaction, so usage already spent is kept
+    even when the job's final write fails"""
+    try:
+        db.session.rollback()  # Nothing left over from a failed job write rides along
+        job = AnalysisJob.query.get(job_id)
+        if not job:
+            return
+        db.session.add(usage_row(job, meter, outcome, content_data, result))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"[Job {job_id}] Usage not recorded: {e}")
+
+
+def usage_row(job, meter, outcome, content_data=None, result=None):
+    """ApiUsage row for a job from its meter, page size and settings"""
+    usage = meter.as_dict()
+    content_data = content_data or {}
+    result = result or {}
+    return ApiUsage(
+        job_id=job.job_id,
+        user_id=job.user_id,
+        bulk_id=job.bulk_id,
+        url=job.url,
+        outcome=outcome,
+        calls=usage['calls'],
+        errors=usage['errors'],
+        retries=usage['retries'],
+        embedded_texts=usage['texts'],
+        input_chars=usage['input_chars'],
+        output_chars=usage['output_chars'],
+        input_tokens=usage['input_tokens'],
+        output_tokens=usage['output_tokens'],
+        api_seconds=usage['seconds'],
+        word_count=content_data.get('word_count'),
+        chunks=result.get('content', {}).get('chunks_count'),
+        queries=result.get('total_queries_count'),
+        settings={
+            'content_extraction': CONTENT_EXTRACTION,
+            'html_extractor': HTML_EXTRACTOR,
+            'content_truncated': content_data.get('truncated', False),
+            'fanout_cache_hit': result.get('query_fanout', {}).get('cache_hit', False)
+        },
+        by_kind=usage['by_kind']
+    )
+
+
+def result_summary(result_data):
+    """Summary columns of a completed job, so bulk listings never load full results"""
+    return {
+        'ai_visibility_score': result_data.get('ai_visibility_score'),
+        'entity': (result_data.get('entity') or '')[:200] or None,
+        'from_cache': bool(result_data.get('cache', {}).get('hit')),
+        'content_gaps': dict(Counter(
+            qd.get('routing', 'unknown') for qd in result_data.get('query_details', []) if not qd.get('covered')
+        ))
+    }
+
+
+def page_summary(job):
+    """Summary of a completed job; jobs completed before the summary columns existed are read from their result"""
+    if job.ai_visibility_score is None and job.result_data:
+        return result_summary(job.result_data)
+    return {
+        'ai_visibility_score': job.ai_visibility_score,
+        'entity': job.entity,
+        'from_cache': bool(job.from_cache),
+        'content_gaps': job.content_gaps or {}
+    }
+
+
+def complete_job(job_id, job, result_data, stage_timings=None):
+    """Mark a job completed and write its history row in the same transaction
+    
+    The result is stored once: on the history row for single analyses (found again through
+    Analysis.job_id), on the job itself for bulk pages, which stay out of history. Its
+    summary fields are copied to columns of the job.
+    """
+    in_history = bool(job and not job.bulk_id)
+    if in_history:
+        db.session.add(history_entry(job, result_data))
+    if job:
+        for name, value in result_summary(result_data).items():
+            setattr(job, name, value)
+    update_job(job_id, job, status="completed", progress="Analysis completed", result_data=result_data,
+               store_result=not in_history, stage_timings=stage_timings)
+
+
+def reuse_cached_result(job_id, job, cached, cached_result, reason, stage_timings=None):
+    """Complete a job with the result of the last analysis of an unchanged page"""
+    response_data = dict(cached_result)
+    response_data['cache'] = {
+        'hit': True,
+        'reason': reason,
+        'analyzed_at': cached.analyzed_at.isoformat() if cached.analyzed_at else None
+    }
+    complete_job(job_id, job, response_data, stage_timings)
+    print(f"[Job {job_id}] Page unchanged ({reason}), reused previous analysis")
+
+
+def process_analysis(job_id, url, user_id, force=False):
     """
     Background task for AI Visibility Analysis
+    
+    Unchanged pages (HTTP 304 or identical extracted content) reuse the cached result unless force=True.
+    Stage durations are stored on the job as stage_timings, Gemini usage as an ApiUsage row
+    written last, in its own transaction, whatever the outcome.
     """
-    with app.app_context():
+    spans = StageSpans()
+    meter = UsageMeter()
+    content_data = result = reporter = None
+    with app.app_context(), metering(meter):
         try:
             print(f"[Job {job_id}] Starting AI Visibility analysis for: {url}")
             
             # Update job in database
             job = AnalysisJob.query.get(job_id)
-            if job:
-                job.status = "processing"
-                job.progress = "Extracting content..."
-                db.session.commit()
+            update_job(job_id, job, status="processing", progress="Extracting content...")
             
-            # Step 1: Extract content
-            content_data = extract_content_from_url(url)
+            # Step 1: Extract content, revalidating against the page cache
+            cached = None if force else page_cache.lookup(url)
+            if cached and cached.content_extraction != CONTENT_EXTRACTION:
+                cached = None  # Scored on differently extracted text
+            cached_result = job_result(cached.job_id) if cached else None
+            if cached_result is None:
+                cached = None  # The result was deleted or purged since
+            content_data = extract_content_from_url(url, headers=page_cache.conditional_headers(cached), spans=spans)
+            
+            if content_data.get('not_modified') and cached:
+                page_cache.touch(cached, content_data.get('etag'), content_data.get('last_modified'))
+                reuse_cached_result(job_id, job, cached, cached_result, 'not_modified', spans.finish('reused'))
+                return
+            
+            if content_data['success'] and cached and \
+                    cached.content_hash == page_cache.content_hash(content_data['title'], content_data['content']):
+                page_cache.touch(cached, content_data.get('etag'), content_data.get('last_modified'))
+                reuse_cached_result(job_id, job, cached, cached_result, 'content_unchanged', spans.finish('reused'))
+                return
             
             if not content_data['success']:
-                if job:
-                    job.status = "error"
-                    job.error = f"Failed to extract content: {content_data.get('error', 'Unknown error')}"
-                    db.session.commit()
+                update_job(job_id, job, status="error",
+                           error=f"Failed to extract content: {content_data.get('error', 'Unknown error')}",
+                           stage_timings=spans.finish('error'))
                 return
             
             print(f"[Job {job_id}] Content extracted: {content_data['word_count']} words")
-            if job:
-                job.progress = "Analyzing with RankSimulator AI..."
-                db.session.commit()
+            progress_broker.publish(job_id, 'partial', {
+                'stage': 'content',
+                'title': content_data['title'],
+                'word_count': content_data['word_count']
+            })
+            # Stage progress is streamed as it happens and written to the DB at most every few seconds
+            reporter = ProgressReporter(job_id, persist=lambda text: persist_progress(job_id, text))
+            reporter.stage('analysis', 'Analyzing with RankSimulator AI')
             
             # Step 2: Use RankSimulator Analyzer (DSPy + Facets + Chunk Usage)
-            analyzer = create_colab_analyzer(GEMINI_API_KEY)
+            analyzer = get_analyzer(GEMINI_API_KEY)
             result = analyzer.analyze(
                 url=url,
                 content_data=content_data,
-                threshold=0.75
+                threshold=0.75,
+                progress=reporter,
+                spans=spans
             )
+            reporter.finish('analysis')
             
             if not result['success']:
-                if job:
-                    job.status = "error"
-                    job.error = result.get('error', 'Analysis failed')
-                    db.session.commit()
+                reporter.close()
+                update_job(job_id, job, status="error", error=result.get('error', 'Analysis failed'),
+                           stage_timings=spans.finish('error'))
                 return
             
             print(f"[Job {job_id}] Analysis completed: {result['ai_visibility_score']:.2f}%")
-            if job:
-                job.progress = "Generating recommendations..."
-                db.session.commit()
+            progress_broker.publish(job_id, 'partial', {
+                'stage': 'analysis',
+                'entity': result['entity']['entity_name'],
+                'ai_visibility_score': result['ai_visibility_score'],
+                'covered_queries': result['covered_queries_count'],
+                'total_queries': result['total_queries_count']
+            })
+            reporter.stage('recommendations', 'Generating recommendations')
             
             # Step 3: Generate recommendations
-            recommendations = generate_recommendations_from_colab_result(result)
+            with spans.span('recommendations'):
+                recommendations = generate_recommendations_from_colab_result(result)
             
             # Prepare response
             response_data = {
@@ -629,25 +899,38 @@ def process_analysis(job_id, url, user_id):
                 ],
                 "chunk_usage": result['chunk_usage'],
                 "unused_chunks": result['unused_chunks'],
+                "content_truncated": content_data.get('truncated', False),
+                "content_extraction": {
+                    "mode": CONTENT_EXTRACTION,
+                    **(content_data.get('main_content') or {})
+                },
                 "recommendations": recommendations,
                 "timestamp": result['timestamp']
             }
             
-            if job:
-                job.status = "completed"
-                job.result_data = response_data
-                db.session.commit()
+            reporter.finish('recommendations')
+            reporter.close()
+            complete_job(job_id, job, response_data, spans.finish('completed'))
+            
+            try:
+                page_cache.store(url, content_data, job_id, CONTENT_EXTRACTION)
+            except Exception as e:
+                db.session.rollback()
+                print(f"[Job {job_id}] Page cache update failed: {e}")
             print(f"[Job {job_id}] Analysis completed successfully")
             
         except Exception as e:
             print(f"[Job {job_id}] Error: {str(e)}")
             import traceback
             traceback.print_exc()
+            if reporter is not None:
+                reporter.close()  # Stage threads may still report; their progress must not land after the error
+            db.session.rollback()
             job = AnalysisJob.query.get(job_id)
-            if job:
-                job.status = "error"
-                job.error = str(e)
-                db.session.commit()
+            update_job(job_id, job, status="error", error=str(e), stage_timings=spans.finish('error'))
+        finally:
+            record_usage(job_id, meter, spans.outcome or 'error', content_data, result)
+            finalize_bulk(job_id)
 
 
 def generate_recommendations_from_colab_result(result):
@@ -690,6 +973,154 @@ def generate_recommendations_from_colab_result(result):
     
     return recommendations
 
+def dispatch_bulk(bulk_id, force=False):
+    """
+    Background task: resolve a bulk job's URLs, create one AnalysisJob per page and feed the worker pool
+    
+    Pages share the process-wide fetcher, page cache, fan-out and embedding caches.
+    """
+    with app.app_context():
+        bulk = BulkJob.query.get(bulk_id)
+        if not bulk:
+            return
+        try:
+            # Read before committing: expired attributes would reopen a transaction that then
+            # stays idle through the sitemap fetch and the dispatch loop
+            user_id = bulk.user_id
+            source_type, source, submitted_urls = bulk.source_type, bulk.source, bulk.urls
+            bulk.status = "dispatching"
+            db.session.commit()
+            
+            if source_type == 'sitemap':
+                urls = resolve_sitemap(source, BULK_MAX_URLS)
+            else:
+                urls = submitted_urls or []
+            
+            # One page per canonical URL
+            seen = set()
+            pages = []
+            for url in urls[:BULK_MAX_URLS]:
+                canonical = page_cache.canonicalize_url(url)
+                if canonical not in seen:
+                    seen.add(canonical)
+                    pages.append(url[:500])
+            
+            if not pages:
+                bulk.status = "error"
+                bulk.error = "No URLs found"
+                db.session.commit()
+                return
+            
+            jobs = [(str(uuid.uuid4()), url) for url in pages]
+            db.session.add_all([
+                AnalysisJob(job_id=job_id, user_id=user_id, url=url, status="queued", bulk_id=bulk_id)
+                for job_id, url in jobs
+            ])
+            bulk.total_urls = len(jobs)
+            bulk.status = "processing"
+            db.session.commit()
+            db.session.remove()  # Return the connection; the loop below can wait for hours
+            print(f"[Bulk {bulk_id}] Dispatching {len(jobs)} pages")
+            
+            for job_id, url in jobs:
+                # Blocks until a worker frees a slot; BULK_QUEUE_HEADROOM slots stay free for single analyses
+                analysis_queue.submit_when_room(process_analysis, job_id, url, user_id, force,
+                                                reserve=BULK_QUEUE_HEADROOM)
+            
+            print(f"[Bulk {bulk_id}] All pages queued")
+        except Exception as e:
+            print(f"[Bulk {bulk_id}] Error: {str(e)}")
+            db.session.rollback()
+            bulk = BulkJob.query.get(bulk_id)
+            if bulk:
+                bulk.status = "error"
+                bulk.error = str(e)[:500]
+                db.session.commit()
+
+
+def finalize_bulk(job_id):
+    """Mark the job's bulk job completed once its last page has finished (no-op for single jobs)
+    
+    One conditional UPDATE, so concurrent last pages complete the bulk exactly once.
+    """
+    try:
+        bulk_id = db.session.query(AnalysisJob.bulk_id).filter_by(job_id=job_id).scalar()
+        if not bulk_id:
+            return
+        done = db.session.query(db.func.count(AnalysisJob.job_id))\
+            .filter(AnalysisJob.bulk_id == bulk_id, AnalysisJob.status.in_(('completed', 'error')))\
+            .scalar_subquery()
+        finished = BulkJob.query\
+            .filter(BulkJob.bulk_id == bulk_id, BulkJob.status == 'processing', BulkJob.total_urls <= done)\
+            .update({'status': 'completed'}, synchronize_session=False)
+        db.session.commit()
+        if finished:
+            print(f"[Bulk {bulk_id}] All pages done")
+    except Exception as e:
+        db.session.rollback()
+        print(f"[Job {job_id}] Bulk completion check failed: {e}")
+
+
+def bulk_progress(bulk):
+    """Aggregate page counts by status"""
+    counts = dict(
+        db.session.query(AnalysisJob.status, db.func.count(AnalysisJob.job_id))
+        .filter(AnalysisJob.bulk_id == bulk.bulk_id)
+        .group_by(AnalysisJob.status)
+        .all()
+    )
+    done = counts.get('completed', 0) + counts.get('error', 0)
+    
+    return {
+        'total': bulk.total_urls or 0,
+        'queued': counts.get('queued', 0),
+        'processing': counts.get('processing', 0),
+        'completed': counts.get('completed', 0),
+        'failed': counts.get('error', 0),
+        'percent': round(done / bulk.total_urls * 100, 1) if bulk.total_urls else 0.0
+    }
+
+
+def summarize_bulk(jobs):
+    """Site-level summary across the completed pages of a bulk job, from their summary columns"""
+    pages = [(j, page_summary(j)) for j in jobs if j.status == 'completed']
+    pages = [(j, summary) for j, summary in pages if summary['ai_visibility_score'] is not None]
+    scores = [summary['ai_visibility_score'] for _, summary in pages]
+    
+    buckets = {'0-25': 0, '25-50': 0, '50-75': 0, '75-100': 0}
+    for score in scores:
+        if score < 25:
+            buckets['0-25'] += 1
+        elif score < 50:
+            buckets['25-50'] += 1
+        elif score < 75:
+            buckets['50-75'] += 1
+        else:
+            buckets['75-100'] += 1
+    
+    entities = Counter(summary['entity'] for _, summary in pages if summary['entity'])
+    gaps = Counter()
+    for _, summary in pages:
+        gaps.update(summary['content_gaps'])
+    scored_pages = sorted((summary['ai_visibility_score'], j.url, j.job_id) for j, summary in pages)
+    
+    return {
+        'pages_total': len(jobs),
+        'pages_completed': len(pages),
+        'pages_failed': sum(1 for j in jobs if j.status == 'error'),
+        'pages_from_cache': sum(1 for _, summary in pages if summary['from_cache']),
+        'average_score': round(sum(scores) / len(scores), 2) if scores else 0.0,
+        'min_score': min(scores) if scores else 0.0,
+        'max_score': max(scores) if scores else 0.0,
+        'score_distribution': buckets,
+        'top_entities': entities.most_common(10),
+        'top_content_gaps': gaps.most_common(10),
+        'lowest_scoring_pages': [
+            {'job_id': job_id, 'url': url, 'ai_visibility_score': score}
+            for score, url, job_id in scored_pages[:10]
+        ]
+    }
+
 @app.route('/api/analyze', methods=['POST'])
 @jwt_required()
 def analyze():
@@ -704,10 +1135,14 @@ def analyze():
             return jsonify({"error": "No JSON data provided"}), 400
         
         url = data.get('url')
+        force = bool(data.get('force', False))  # Skip the unchanged-page cache
         
         if not url:
             return jsonify({"error": "URL is required"}), 400
         
+        if analysis_queue.full():
+            return queue_full_response()
+        
         # Generate unique job ID
         job_id = str(uuid.uuid4())
         user_id = int(get_jwt_identity())
@@ -721,13 +1156,14 @@ def analyze():
         )
         db.session.add(job)
         db.session.commit()
+        job_states.put(job_id, job_snapshot(job))
         
-        # Start background thread
-        thread = threading.Thread(target=process_analysis, args=(job_id, url, user_id))
-        thread.daemon = True
-        thread.start()
+        # Hand off to the worker pool
+        if not analysis_queue.submit(process_analysis, job_id, url, user_id, force):
+            update_job(job_id, job, status="error", error="Analysis queue is full, please retry later")
+            return queue_full_response()
         
-        print(f"Started analysis job {job_id} for URL: {url}")
+        print(f"Queued analysis job {job_id} for URL: {url}")
         
         return jsonify({
             "job_id": job_id,
@@ -738,17 +1174,207 @@ def analyze():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/status/<job_id>', methods=['GET'])
+def queue_full_response():
+    """429 with Retry-After when the analysis queue has no room"""
+    response = jsonify({
+        "error": "Too many analyses in progress, please retry later",
+        "queue": analysis_queue.stats()
+    })
+    response.headers['Retry-After'] = str(ANALYSIS_RETRY_AFTER)
+    return response, 429
+
+@app.route('/api/queue', methods=['GET'])
 @jwt_required()
-def check_status(job_id):
-    """Check the status of an analysis job"""
-    job = AnalysisJob.query.get(job_id)
+def queue_status():
+    """Analysis queue depth and worker metrics"""
+    return jsonify({
+        **analysis_queue.stats(),
+        'progress_streams': progress_broker.stats(),
+        'job_state_cache': job_states.stats(),
+        'retention': janitor.stats()
+    })
+
+def queue_metric(key):
+    return lambda: {(q.name,): q.stats()[key] for q in (analysis_queue, bulk_queue)}
+
+def cache_stats():
+    """(hits, misses) of the process-wide caches"""
+    embedding = get_embedding_cache().stats()
+    fanout = get_fanout_cache().stats()
+    states = job_states.stats()
+    stats = {
+        'embedding': (embedding['memory_hits'] + embedding['disk_hits'], embedding['misses']),
+        'fanout': (fanout['hits'], fanout['misses']),
+        'job_state': (states['hits'], states['misses'])
+    }
+    chunk_index = get_chunk_index()
+    if chunk_index is not None:
+        chunks = chunk_index.stats()
+        stats['chunk_dedup'] = (chunks['exact_hits'] + chunks['near_hits'], chunks['misses'])
+    return stats
+
+def cache_lookups():
+    lookups = {}
+    for cache, (hits, misses) in cache_stats().items():
+        lookups[(cache, 'hit')] = hits
+        lookups[(cache, 'miss')] = misses
+    return lookups
+
+metrics.callback('ranksimulator_queue_depth', 'Jobs waiting in a worker queue', queue_metric('queue_depth'), ('queue',))
+metrics.callback('ranksimulator_queue_active_jobs', 'Jobs running on queue workers', queue_metric('active'), ('queue',))
+metrics.callback('ranksimulator_queue_capacity', 'Maximum jobs a queue holds', queue_metric('max_size'), ('queue',))
+metrics.callback('ranksimulator_queue_rejected', 'Submissions rejected because the queue was full',
+                 queue_metric('rejected'), ('queue',), kind='counter')
+metrics.callback('ranksimulator_cache_lookups', 'Cache lookups by result', cache_lookups, ('cache', 'result'),
+                 kind='counter')
+metrics.callback('ranksimulator_progress_streams', 'Open progress streams', lambda: progress_broker.stats()['streams'])
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus text exposition of the metrics of all gunicorn workers"""
+    if not METRICS_TOKEN:
+        return jsonify({"error": "Set METRICS_TOKEN to enable /metrics"}), 403
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}'):
+        return jsonify({"error": "Unauthorized"}), 401
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/bulk-analyze', methods=['POST'])
+@jwt_required()
+def bulk_analyze():
+    """Start a bulk analysis from a URL list or a sitemap and return its bulk ID"""
+    try:
+        if not request.is_json:
+            return jsonify({"error": "Content-Type must be application/json"}), 400
+        
+        data = request.get_json()
+        if not data:
+            return jsonify({"error": "No JSON data provided"}), 400
+        
+        urls = data.get('urls')
+        sitemap_url = data.get('sitemap_url')
+        force = bool(data.get('force', False))
+        
+        if not urls and not sitemap_url:
+            return jsonify({"error": "Either urls or sitemap_url is required"}), 400
+        if urls is not None and (not isinstance(urls, list) or not all(isinstance(u, str) and u for u in urls)):
+            return jsonify({"error": "urls must be a list of URL strings"}), 400
+        if sitemap_url is not None and not isinstance(sitemap_url, str):
+            return jsonify({"error": "sitemap_url must be a URL string"}), 400
+        if urls and len(urls) > BULK_MAX_URLS:
+            return jsonify({"error": f"At most {BULK_MAX_URLS} URLs per bulk job"}), 400
+        
+        if bulk_queue.full():
+            response = jsonify({"error": "Too many bulk jobs in progress, please retry later"})
+            response.headers['Retry-After'] = str(ANALYSIS_RETRY_AFTER)
+            return response, 429
+        
+        bulk_id = str(uuid.uuid4())
+        bulk = BulkJob(
+            bulk_id=bulk_id,
+            user_id=int(get_jwt_identity()),
+            source_type='urls' if urls else 'sitemap',
+            source=None if urls else sitemap_url[:500],
+            urls=urls or None,
+            status="queued"
+        )
+        db.session.add(bulk)
+        db.session.commit()
+        
+        if not bulk_queue.submit(dispatch_bulk, bulk_id, force):
+            bulk.status = "error"
+            bulk.error = "Bulk queue is full, please retry later"
+            db.session.commit()
+            response = jsonify({"error": "Too many bulk jobs in progress, please retry later"})
+            response.headers['Retry-After'] = str(ANALYSIS_RETRY_AFTER)
+            return response, 429
+        
+        print(f"Queued bulk job {bulk_id} ({bulk.source_type})")
+        
+        return jsonify({
+            "bulk_id": bulk_id,
+            "status": "queued",
+            "message": "Bulk analysis started. Use /api/bulk/<bulk_id> to check progress."
+        }), 202
+        
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/bulk/<bulk_id>', methods=['GET'])
+@jwt_required()
+def bulk_status(bulk_id):
+    """Aggregate progress of a bulk job"""
+    bulk = BulkJob.query.filter_by(bulk_id=bulk_id, user_id=int(get_jwt_identity())).first()
+    if not bulk:
+        return jsonify({"error": "Bulk job not found"}), 404
     
-    if not job:
-        return jsonify({"error": "Job not found"}), 404
+    progress = bulk_progress(bulk)
+    response = bulk.to_dict()
+    response['progress'] = progress
+    return jsonify(response)
+
+@app.route('/api/bulk/<bulk_id>/pages', methods=['GET'])
+@jwt_required()
+def bulk_pages(bulk_id):
+    """Page-by-page results of a bulk job; full page results are available at /api/status/<job_id>"""
+    bulk = BulkJob.query.filter_by(bulk_id=bulk_id, user_id=int(get_jwt_identity())).first()
+    if not bulk:
+        return jsonify({"error": "Bulk job not found"}), 404
+    
+    page = request.args.get('page', 1, type=int)
+    per_page = min(request.args.get('per_page', 50, type=int), 200)
+    jobs = AnalysisJob.query.filter_by(bulk_id=bulk_id)\
+        .order_by(AnalysisJob.created_at, AnalysisJob.job_id)\
+        .paginate(page=page, per_page=per_page, error_out=False, count=False)
+    # Counted separately: paginate's count wraps a SELECT of every column, deferred result_data included
+    total = db.session.query(db.func.count(AnalysisJob.job_id)).filter(AnalysisJob.bulk_id == bulk_id).scalar()
     
+    summaries = {j.job_id: page_summary(j) for j in jobs.items if j.status == 'completed'}
+    return jsonify({
+        'pages': [
+            {
+                'job_id': j.job_id,
+                'url': j.url,
+                'status': j.status,
+                'error': j.error,
+                'ai_visibility_score': summaries.get(j.job_id, {}).get('ai_visibility_score'),
+                'entity': summaries.get(j.job_id, {}).get('entity')
+            }
+            for j in jobs.items
+        ],
+        'total': total,
+        'page': page,
+        'per_page': per_page,
+        'pages_count': math.ceil(total / jobs.per_page)
+    })
+
+@app.route('/api/bulk/<bulk_id>/summary', methods=['GET'])
+@jwt_required()
+def bulk_summary(bulk_id):
+    """Site-level summary of a bulk job"""
+    bulk = BulkJob.query.filter_by(bulk_id=bulk_id, user_id=int(get_jwt_identity())).first()
+    if not bulk:
+        return jsonify({"error": "Bulk job not found"}), 404
+    
+    progress = bulk_progress(bulk)
+    response = bulk.to_dict()
+    response['progress'] = progress
+    response['summary'] = summarize_bulk(AnalysisJob.query.filter_by(bulk_id=bulk_id).all())
+    return jsonify(response)
+
+def job_result(job_id):
+    """A completed job's result, stored on the job (bulk pages) or on its history row; None once deleted"""
+    result_data = db.session.query(AnalysisJob.result_data).filter_by(job_id=job_id).scalar()
+    if result_data:
+        return result_data
+    analysis = Analysis.query.options(undefer(Analysis.result_data)).filter_by(job_id=job_id).first()
+    return analysis.result_data if analysis else None
+
+
+def job_snapshot(job):
+    """Cached status of a job: status, progress, error and stage timings (the result is read per request)"""
     response = {
         "job_id": job.job_id,
+        "user_id": job.user_id,
         "status": job.status
     }
     
@@ -758,68 +1384,190 @@ def check_status(job_id):
     if job.error:
         response["error"] = job.error
     
-    if job.status == "completed" and job.result_data:
-        response["result"] = job.result_data
-        
-        # Save to history table (only once)
+    if job.stage_timings:
+        response["stage_timings"] = job.stage_timings
+    
+    return response
+
+
+def get_job_snapshot(job_id, user_id):
+    """Status payload shared by /api/status and the first event of a progress stream
+    
+    Status comes from the in-memory cache (loaded from the database on a miss). A completed
+    job's result is read from where it is stored, so deleting its history row is seen at once:
+    the job then reports status "deleted" instead of a result. Jobs of other users are None.
+    """
+    snapshot = job_states.get(job_id)
+    if snapshot is None:
+        job = AnalysisJob.query.get(job_id)
+        if not job:
+            return None
+        snapshot = job_snapshot(job)
+        job_states.put(job_id, snapshot, owned=False)
+    if snapshot['user_id'] != user_id:
+        return None
+    if snapshot['status'] == 'completed':
+        result_data = job_result(job_id)
+        if result_data is None:
+            return {**snapshot, 'status': 'deleted', 'error': 'The analysis result was deleted'}
+        return {**snapshot, 'result': result_data}
+    return snapshot
+
+
+@app.route('/api/status/<job_id>', methods=['GET'])
+@jwt_required()
+def check_status(job_id):
+    """Check the status of an analysis job"""
+    snapshot = get_job_snapshot(job_id, int(get_jwt_identity()))
+    
+    if not snapshot:
+        return jsonify({"error": "Job not found"}), 404
+    
+    return jsonify(snapshot)
+
+
+@app.route('/api/status/<job_id>/stream', methods=['GET'])
+@jwt_required()
+def stream_status(job_id):
+    """
+    Server-sent events for one job: status, partial, then completed or error
+    
+    Events come from the in-process broker fed by the job runner. While no event arrives the
+    stream sends a heartbeat and re-reads the job, which also covers jobs run by another worker.
+    Streams end after SSE_MAX_SECONDS; clients reconnect (or fall back to /api/status).
+    """
+    user_id = int(get_jwt_identity())
+    snapshot = get_job_snapshot(job_id, user_id)
+    if not snapshot:
+        return jsonify({"error": "Job not found"}), 404
+    
+    if snapshot['status'] in TERMINAL_EVENTS:
+        return Response(format_sse(snapshot['status'], snapshot), mimetype='text/event-stream')
+    
+    if not sse_slots.acquire(blocking=False):
+        return jsonify({"error": "Too many open progress streams, poll /api/status instead"}), 429
+    db.session.remove()  # Don't hold a DB connection for the life of the stream
+    
+    def generate():
+        subscription = progress_broker.subscribe(job_id, replay=True)  # Covers events since the snapshot
         try:
-            # Check if already saved
-            existing = Analysis.query.filter_by(
-                user_id=job.user_id,
-                url=job.url,
-                created_at=job.created_at
-            ).first()
-            
-            if not existing:
-                result_data = job.result_data
-                analysis = Analysis(
-                    user_id=job.user_id,
-                    url=result_data['url'],
-                    entity=result_data['entity'],
-                    language=result_data.get('language', 'en'),
-                    ai_visibility_score=result_data['ai_visibility_score'],
-                    total_queries=result_data['coverage_details']['total_queries'],
-                    covered_queries=result_data['coverage_details']['covered_queries'],
-                    result_data=result_data
-                )
-                db.session.add(analysis)
-                db.session.commit()
-        except Exception as e:
-            print(f"Error saving analysis to history: {e}")
+            yield format_sse('status', snapshot)
+            last_state = (snapshot['status'], snapshot.get('progress'))
+            deadline = time.monotonic() + SSE_MAX_SECONDS
+            while time.monotonic() < deadline:
+                try:
+                    event, data = subscription.get(timeout=SSE_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    with app.app_context():
+                        current = get_job_snapshot(job_id, user_id)
+                    if current is None:
+                        yield format_sse('error', {'job_id': job_id, 'status': 'error', 'error': 'Job not found'})
+                        return
+                    if (current['status'], current.get('progress')) != last_state:
+                        event = current['status'] if current['status'] in TERMINAL_EVENTS else 'status'
+                        data = current
+                    else:
+                        yield ': keep-alive\n\n'
+                        continue
+                
+                if event != 'partial':
+                    last_state = (data['status'], data.get('progress'))
+                yield format_sse(event, data)
+                if event in TERMINAL_EVENTS:
+                    return
+        finally:
+            progress_broker.unsubscribe(job_id, subscription)
+            sse_slots.release()
     
-    return jsonify(response)
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 @app.route('/api/history', methods=['GET'])
 @jwt_required()
 def get_history():
-    """Get user's analysis history"""
+    """
+    Get user's analysis history, newest first
+    
+    Keyset pagination: pass the returned next_cursor as ?cursor= to get the next page.
+    ?total=approx adds a count capped at HISTORY_COUNT_CAP, ?total=exact a full count.
+    The legacy ?page= parameter (offset pagination with an exact total) still works.
+    """
     try:
         user_id = int(get_jwt_identity())
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 10, type=int)
+        per_page = max(1, min(request.args.get('per_page', 10, type=int), HISTORY_MAX_PER_PAGE))
+        cursor = request.args.get('cursor')
+        page = request.args.get('page', type=int)
+        total_mode = request.args.get('total', 'exact' if page and not cursor else 'none')
         
-        analyses = Analysis.query.filter_by(user_id=user_id)\
-            .order_by(Analysis.created_at.desc())\
-            .paginate(page=page, per_page=per_page, error_out=False)
+        query = Analysis.query.filter(Analysis.user_id == user_id)
+        listing = query.order_by(Analysis.created_at.desc(), Analysis.id.desc())
+        if cursor:
+            try:
+                created_at, last_id = decode_history_cursor(cursor)
+            except ValueError:
+                return jsonify({'error': 'Invalid cursor'}), 400
+            listing = listing.filter(db.or_(
+                Analysis.created_at < created_at,
+                db.and_(Analysis.created_at == created_at, Analysis.id < last_id)
+            ))
+        elif page and page > 1:
+            listing = listing.offset((page - 1) * per_page)
         
-        return jsonify({
-            'analyses': [a.to_dict() for a in analyses.items],
-            'total': analyses.total,
-            'page': page,
+        rows = listing.limit(per_page + 1).all()
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+        
+        response = {
+            'analyses': [a.to_dict() for a in rows],
             'per_page': per_page,
-            'pages': analyses.pages
-        }), 200
+            'has_more': has_more,
+            'next_cursor': encode_history_cursor(rows[-1]) if has_more else None
+        }
+        if page and not cursor:
+            response['page'] = page
+        
+        if total_mode == 'exact':
+            response['total'] = query.count()
+            response['total_is_exact'] = True
+        elif total_mode == 'approx':
+            capped = query.with_entities(Analysis.id).limit(HISTORY_COUNT_CAP + 1).subquery()
+            total = db.session.query(db.func.count()).select_from(capped).scalar()
+            response['total'] = min(total, HISTORY_COUNT_CAP)
+            response['total_is_exact'] = total <= HISTORY_COUNT_CAP
+        if 'total' in response and page and not cursor:
+            response['pages'] = -(-response['total'] // per_page)
+        
+        return jsonify(response), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+
+def encode_history_cursor(analysis):
+    """Opaque keyset cursor for the row after which the next page starts"""
+    raw = f"{analysis.created_at.isoformat()}|{analysis.id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_history_cursor(cursor):
+    """Inverse of encode_history_cursor; raises ValueError for malformed cursors"""
+    try:
+        created_at, last_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+        return datetime.datetime.fromisoformat(created_at), int(last_id)
+    except Exception as e:
+        raise ValueError(str(e))
+
 @app.route('/api/history/<int:analysis_id>', methods=['GET'])
 @jwt_required()
 def get_analysis(analysis_id):
     """Get specific analysis with full data"""
     try:
         user_id = int(get_jwt_identity())
-        analysis = Analysis.query.filter_by(id=analysis_id, user_id=user_id).first()
+        analysis = Analysis.query.options(undefer(Analysis.result_data))\
+            .filter_by(id=analysis_id, user_id=user_id).first()
         
         if not analysis:
             return jsonify({'error': 'Analysis not found'}), 404
@@ -842,6 +1590,8 @@ def delete_analysis(analysis_id):
         
         db.session.delete(analysis)
         db.session.commit()
+        if analysis.job_id:
+            job_states.discard(analysis.job_id)
         
         return jsonify({'message': 'Analysis deleted successfully'}), 200
         
@@ -849,11 +1599,85 @@ def delete_analysis(analysis_id):
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+USAGE_SUMS = (
+    ('jobs', db.func.count(ApiUsage.id)),
+    ('calls', db.func.sum(ApiUsage.calls)),
+    ('errors', db.func.sum(ApiUsage.errors)),
+    ('retries', db.func.sum(ApiUsage.retries)),
+    ('embedded_texts', db.func.sum(ApiUsage.embedded_texts)),
+    ('input_chars', db.func.sum(ApiUsage.input_chars)),
+    ('output_chars', db.func.sum(ApiUsage.output_chars)),
+    ('input_tokens', db.func.sum(ApiUsage.input_tokens)),
+    ('output_tokens', db.func.sum(ApiUsage.output_tokens)),
+    ('jobs_without_token_counts', db.func.count(ApiUsage.id) - db.func.count(ApiUsage.input_tokens)),
+    ('api_seconds', db.func.sum(ApiUsage.api_seconds))
+)
+
+def usage_totals(row):
+    """Aggregate row -> dict of plain numbers (SUM over no rows is NULL)
+    
+    Token sums cover only jobs with known counts; jobs_without_token_counts says how many are missing.
+    """
+    totals = {name: int(getattr(row, name) or 0) for name, _ in USAGE_SUMS if name != 'api_seconds'}
+    totals['api_seconds'] = round(float(row.api_seconds or 0), 3)
+    return totals
+
+@app.route('/api/usage', methods=['GET'])
+@jwt_required()
+def get_usage():
+    """
+    Gemini API usage over the last ?days= (default 30), in total and per ?group=day|url|user
+    
+    Users see their own jobs; admins see everyone's, can filter with ?user_id= and group by user.
+    ?job_id= returns the usage record of one job.
+    """
+    try:
+        user_id = int(get_jwt_identity())
+        current_user = User.query.get(user_id)
+        is_admin = bool(current_user and current_user.role == 'admin')
+        group = request.args.get('group', 'day')
+        if group not in USAGE_GROUPS:
+            return jsonify({'error': f"group must be one of {', '.join(USAGE_GROUPS)}"}), 400
+        if group == 'user' and not is_admin:
+            return jsonify({'error': 'Unauthorized'}), 403
+        
+        query = ApiUsage.query
+        if not is_admin:
+            query = query.filter(ApiUsage.user_id == user_id)
+        elif request.args.get('user_id', type=int):
+            query = query.filter(ApiUsage.user_id == request.args.get('user_id', type=int))
+        
+        job_id = request.args.get('job_id')
+        if job_id:
+            usage = query.filter(ApiUsage.job_id == job_id).first()
+            if not usage:
+                return jsonify({'error': 'Usage not found'}), 404
+            return jsonify(usage.to_dict()), 200
+        
+        days = max(1, min(request.args.get('days', 30, type=int), USAGE_MAX_DAYS))
+        query = query.filter(ApiUsage.created_at >= datetime.datetime.utcnow() - datetime.timedelta(days=days))
+        sums = [column.label(name) for name, column in USAGE_SUMS]
+        
+        key = {'day': db.func.date(ApiUsage.created_at), 'url': ApiUsage.url, 'user': ApiUsage.user_id}[group]
+        order = key.desc() if group == 'day' else db.func.sum(ApiUsage.calls).desc()
+        rows = query.with_entities(key.label('key'), *sums).group_by(key).order_by(order).limit(USAGE_MAX_GROUPS).all()
+        
+        return jsonify({
+            'days': days,
+            'group': group,
+            'totals': usage_totals(query.with_entities(*sums).one()),
+            'groups': [{group: str(row.key) if group == 'day' else row.key, **usage_totals(row)} for row in rows]
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # Database initialization
 @app.cli.command()
 def init_db():
     """Initialize the database"""
     db.create_all()
+    ensure_schema()
     print('Database initialized!')
 
 @app.cli.command()
@@ -873,6 +1697,34 @@ def seed_admin():
     else:
         print('Admin user already exists')
 
+@app.cli.command()
+def compact_results():
+    """Rewrite stored results written before the compact format"""
+    for model in (Analysis, AnalysisJob):
+        key = inspect(model).primary_key[0]
+        rewritten = 0
+        last = None
+        while True:
+            query = model.query.options(undefer(model.result_data)).filter(model.result_data.isnot(None))
+            if last is not None:
+                query = query.filter(key > last)
+            rows = query.order_by(key).limit(COMPACT_BATCH_SIZE).all()
+            if not rows:
+                break
+            for row in rows:
+                flag_modified(row, 'result_data')  # Re-encoded on write even though the value is unchanged
+            db.session.commit()
+            rewritten += len(rows)
+            last = getattr(rows[-1], key.key)
+        print(f'{model.__tablename__}: {rewritten} results rewritten')
+
+@app.cli.command()
+def purge_jobs():
+    """Run one retention pass now"""
+    deleted = janitor.run_once()
+    print(f'Deleted job rows: {deleted}')
+    print(json.dumps(janitor.stats(), indent=2))
+
 # Initialize database on startup
 def init_db_on_startup():
     """Initialize database tables and create admin user if needed"""
@@ -880,6 +1732,7 @@ def init_db_on_startup():
         try:
             print("Initializing database...")
             db.create_all()
+            ensure_schema()
             print("✅ Database tables created/verified!")
             
             # Create admin user if not exists
@@ -903,6 +1756,13 @@ def init_db_on_startup():
 # Run initialization on import (when gunicorn loads the app)
 init_db_on_startup()
 
+# Build the shared analyzer once per process instead of once per job
+if os.getenv('WARM_UP_ON_BOOT', 'true').lower() == 'true':
+    try:
+        warm_up(GEMINI_API_KEY)
+    except Exception as e:
+        print(f"⚠️  Analyzer warm-up failed, will build on first job: {e}")
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=False)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Benchmark: streaming lxml extraction vs the BeautifulSoup path
+
+Usage:
+    python benchmarks/bench_html_extract.py [page.html ...]
+
+Without arguments, synthetic pages of ~100 KB, 1 MB and 5 MB are generated.
+Reports wall time, peak Python heap (tracemalloc) and whether both paths agree.
+"""
+
+import os
+import sys
+import time
+import random
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from html_extract import extract_text_soup, extract_text_streaming, iter_chunks, detect_encoding
+
+WORDS = ['search', 'engine', 'optimization', 'content', 'ranking', 'café', '&amp;', 'audit', 'query', 'page']
+
+
+def synthetic_page(target_bytes):
+    """Realistic-ish markup: paragraphs plus scripts, navs and asides to strip"""
+    rng = random.Random(target_bytes)
+    blocks = []
+    size = 0
+    i = 0
+    while size < target_bytes:
+        text = ' '.join(rng.choice(WORDS) for _ in range(40))
+        block = (
+            f"<div class='block-{i}'><h2>Section {i}</h2><p>{text} <a href='/l{i}'>link</a> <b>{text[:40]}</b></p>"
+            f"<script>window.t{i}={{a:{i}}};</script><nav><ul><li>Menu {i}</li></ul></nav><aside>Related {i}</aside></div>\n"
+        )
+        blocks.append(block)
+        size += len(block)
+        i += 1
+    return f"<html><head><meta charset='utf-8'><title>Synthetic</title></head><body>{''.join(blocks)}</body></html>".encode('utf-8')
+
+
+def measure(fn):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def run(name, content):
+    encoding = detect_encoding(None, content)
+    soup, soup_time, soup_peak = measure(lambda: extract_text_soup(content))
+    stream, stream_time, stream_peak = measure(lambda: extract_text_streaming(iter_chunks(content), encoding))
+    print(f"{name:>14} {len(content) / 1e6:7.2f} MB | soup {soup_time:7.3f}s {soup_peak / 1e6:8.1f} MB peak"
+          f" | stream {stream_time:7.3f}s {stream_peak / 1e6:8.1f} MB peak"
+          f" | speedup {soup_time / stream_time:5.1f}x | same output: {soup == stream}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        for path in sys.argv[1:]:
+            with open(path, 'rb') as f:
+                run(os.path.basename(path)[:14], f.read())
+    else:
+        for label, size in [('100 KB', 100_000), ('1 MB', 1_000_000), ('5 MB', 5_000_000)]:
+            run(label, synthetic_page(size))
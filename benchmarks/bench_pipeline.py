@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+"""
+Benchmark: end-to-end analysis pipeline, fully offline
+
+Usage:
+    python benchmarks/bench_pipeline.py [--mode analyze|process|both] [--concurrency 1,2,4,8]
+                                        [--corpus DIR] [--latency-ms 150] [--jitter-ms 50]
+                                        [--chunker fallback|chonkie] [--rounds 1] [--warm]
+                                        [--tracemalloc] [--json results.json] [--verbose]
+
+Gemini (generate_content, embed_content) and the DSPy query generator are replaced by a
+deterministic stub with configurable latency and jitter, so runs are repeatable and need no
+network or API key. 'analyze' runs RankSimulatorAnalyzer.analyze on pre-extracted pages;
+'process' runs process_analysis end to end: the corpus is served by a local HTTP server and
+jobs are stored in a temporary SQLite database.
+
+Without --corpus, synthetic pages of 1 KB to 5 MB are generated. Reports throughput and job
+latency per concurrency level, per-stage timings, peak RSS (and Python heap with
+--tracemalloc) and how many stub calls were made. Caches start cold at every level unless
+--warm is given.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import types
+import random
+import hashlib
+import argparse
+import tempfile
+import threading
+import functools
+import contextlib
+import statistics
+import resource
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Must be set before the app modules read their configuration
+_workdir = tempfile.mkdtemp(prefix='ranksimulator_bench_')
+os.environ.setdefault('GEMINI_API_KEY', 'offline-benchmark')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_workdir, 'bench.db')}"
+os.environ['WARM_UP_ON_BOOT'] = 'false'
+os.environ['RETENTION_ENABLED'] = 'false'
+os.environ['EMBED_CACHE_PATH'] = ''
+os.environ['FANOUT_CACHE_PATH'] = ''
+os.environ.setdefault('HF_HUB_OFFLINE', '1')
+
+import app as app_module
+import colab_analyzer
+import embedding_cache
+import fanout_cache
+import chunk_dedup
+from html_extract import extract_text_streaming, iter_chunks, MAX_TEXT_CHARS
+
+CORPUS_SIZES = [('1 KB', 1_000), ('10 KB', 10_000), ('100 KB', 100_000), ('1 MB', 1_000_000), ('5 MB', 5_000_000)]
+EMBEDDING_DIM = 768
+
+
+# ============================================================================
+# DETERMINISTIC GEMINI STAND-IN
+# ============================================================================
+
+class GeminiStub:
+    """Deterministic replacement for the Gemini SDK calls used by the pipeline"""
+
+    def __init__(self, latency_ms=150.0, jitter_ms=50.0, seed=0):
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.seed = seed
+        self._lock = threading.Lock()
+        self.calls = {'embed_requests': 0, 'texts_embedded': 0, 'generate': 0, 'query_generator': 0}
+
+    def _sleep(self, key):
+        # Jitter derived from the request itself, so a rerun sleeps the same amounts
+        rng = random.Random(f'{self.seed}:{key}')
+        time.sleep(max(0.0, self.latency + rng.uniform(-self.jitter, self.jitter)))
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.calls[name] += n
+
+    @staticmethod
+    def vector(text):
+        digest = hashlib.sha256(text.encode('utf-8')).digest()
+        rng = np.random.default_rng(int.from_bytes(digest[:8], 'little'))
+        return rng.standard_normal(EMBEDDING_DIM).astype(np.float32).tolist()
+
+    def embed_content(self, model, content, task_type=None, **kwargs):
+        texts = [content] if isinstance(content, str) else list(content)
+        self._count('embed_requests')
+        self._count('texts_embedded', len(texts))
+        self._sleep(texts[0] if texts else '')
+        vectors = [self.vector(t) for t in texts]
+        return {'embedding': vectors[0] if isinstance(content, str) else vectors}
+
+    def queries_for(self, entity, num_queries):
+        templates = ['what is {e}', 'how to implement {e} step by step', '{e} vs alternatives comparison',
+                     'best {e} tools for small business', '{e} pricing and cost', 'how to automate {e} with python',
+                     'troubleshoot common {e} problems', '{e} checklist template', '{e} case study examples',
+                     'explain {e} for beginners']
+        return [templates[i % len(templates)].format(e=entity) + (f' {i // len(templates) + 1}' if i >= len(templates) else '')
+                for i in range(num_queries)]
+
+    def generate_content(self, prompt, **kwargs):
+        self._count('generate')
+        self._sleep(prompt[:200])
+        if 'MAIN TOPIC' in prompt:
+            title = prompt.split('TITLE:', 1)[-1].split('\n', 1)[0].strip()
+            return types.SimpleNamespace(text=title or 'Untitled')
+        entity = prompt.split('about:', 1)[-1].split('\n', 1)[0].strip() or 'topic'
+        return types.SimpleNamespace(text=json.dumps(self.queries_for(entity, 20)))
+
+    def generative_model(self, name):
+        stub = self
+        return types.SimpleNamespace(model_name=name, generate_content=stub.generate_content)
+
+    def query_generator(self, entity_name, current_date, num_queries):
+        """Stands in for the DSPy ChainOfThought(QueryFanOutWithFacets) predictor"""
+        self._count('query_generator')
+        self._sleep(entity_name)
+        return types.SimpleNamespace(
+            reasoning_about_facets=f'Facets for {entity_name}: basics, how-to, comparison, business',
+            synthetic_queries=json.dumps(self.queries_for(entity_name, int(num_queries)))
+        )
+
+
+# ============================================================================
+# CORPUS
+# ============================================================================
+
+def synthetic_page(target_bytes, seed):
+    """Article markup with a shared header/footer, nav and scripts; one distinct title per page"""
+    rng = random.Random(seed)
+    vocabulary = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(3, 10)))
+                  for _ in range(3000)]
+    title = f'{vocabulary[0].title()} {vocabulary[1].title()} guide {seed}'
+    header = ("<header><nav><ul>" + ''.join(f"<li><a href='/m{i}'>Menu {i}</a></li>" for i in range(8)) +
+              "</ul></nav><div class='cookie-banner'><p>We use cookies to improve your experience on this "
+              "site. By continuing you accept our cookie policy.</p></div></header>")
+    footer = "<footer><p>Copyright Example Corp. All rights reserved. Contact support for help.</p></footer>"
+    blocks = []
+    size = len(header) + len(footer)
+    i = 0
+    while size < target_bytes:
+        text = ' '.join(rng.choice(vocabulary) for _ in range(rng.randint(40, 120))) + '.'
+        block = (f"<h2>Section {i}</h2><p>{text}</p><p>{text[:200]} <a href='/l{i}'>read more</a>.</p>"
+                 f"<script>window.s{i}={{v:{i}}};</script>\n")
+        blocks.append(block)
+        size += len(block)
+        i += 1
+    return (f"<html><head><meta charset='utf-8'><title>{title}</title></head><body>{header}"
+            f"<article><h1>{title}</h1>{''.join(blocks)}</article>{footer}</body></html>").encode('utf-8')
+
+
+def build_corpus(corpus_dir=None):
+    """[(label, filename, bytes)] from a directory of saved .html pages, or generated"""
+    pages = []
+    if corpus_dir:
+        for name in sorted(os.listdir(corpus_dir)):
+            if name.lower().endswith(('.html', '.htm')):
+                with open(os.path.join(corpus_dir, name), 'rb') as f:
+                    pages.append((name[:14], name, f.read()))
+        return pages
+    for i, (label, size) in enumerate(CORPUS_SIZES):
+        pages.append((label, f'page-{i}.html', synthetic_page(size, seed=i)))
+    return pages
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def serve_corpus(pages):
+    """Write the corpus to disk and serve it on a local port; returns (server, base_url)"""
+    site = os.path.join(_workdir, 'site')
+    os.makedirs(site, exist_ok=True)
+    for _, name, content in pages:
+        with open(os.path.join(site, name), 'wb') as f:
+            f.write(content)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(_QuietHandler, directory=site))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+# ============================================================================
+# STAGE TIMING
+# ============================================================================
+
+class StageTimer:
+    """Wraps functions in place and records their durations per stage label"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+
+    def wrap(self, owner, attr, label):
+        original = getattr(owner, attr)
+
+        @functools.wraps(original)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.record(label, time.perf_counter() - started)
+
+        setattr(owner, attr, timed)
+
+    def record(self, label, seconds):
+        with self._lock:
+            self.samples.setdefault(label, []).append(seconds)
+
+    def reset(self):
+        with self._lock:
+            self.samples = {}
+
+    def summary(self):
+        with self._lock:
+            return {label: describe(values) for label, values in self.samples.items()}
+
+
+def describe(values):
+    ordered = sorted(values)
+    return {
+        'count': len(ordered),
+        'mean': round(statistics.fmean(ordered), 4) if ordered else 0.0,
+        'p50': round(ordered[len(ordered) // 2], 4) if ordered else 0.0,
+        'p95': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 4) if ordered else 0.0,
+        'total': round(sum(ordered), 4)
+    }
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == 'darwin' else rss / 1024  # bytes on macOS, KB elsewhere
+
+
+# ============================================================================
+# RUNNERS
+# ============================================================================
+
+def install(stub, chunker):
+    """Patch the SDK entry points and build the shared analyzer around the stub"""
+    colab_analyzer.genai.embed_content = stub.embed_content
+    colab_analyzer.genai.GenerativeModel = stub.generative_model
+    colab_analyzer._generative_models.clear()
+    if chunker == 'fallback':
+        colab_analyzer.semantic_chunk_text_chonkie = (
+            lambda text, gemini_key=None: colab_analyzer.chunk_text(text, colab_analyzer.CHUNK_SIZE,
+                                                                    colab_analyzer.CHUNK_OVERLAP)
+        )
+
+    key = os.environ['GEMINI_API_KEY']
+    colab_analyzer._analyzers.clear()
+    analyzer = colab_analyzer.get_analyzer(key)
+    analyzer.query_generator = stub.query_generator
+    return analyzer
+
+
+def instrument(timer):
+    cls = colab_analyzer.RankSimulatorAnalyzer
+    timer.wrap(cls, '_extract_entity', 'entity')
+    timer.wrap(cls, '_stage_queries', 'queries')
+    timer.wrap(cls, '_stage_query_embeddings', 'query_embeddings')
+    timer.wrap(colab_analyzer, 'semantic_chunk_text_chonkie', 'chunking')
+    timer.wrap(cls, '_stage_chunk_dedup', 'chunk_dedup')
+    timer.wrap(cls, '_stage_chunk_embeddings', 'chunk_embeddings')
+    timer.wrap(colab_analyzer.SimilarityEngine, 'top_k', 'scoring')
+    timer.wrap(cls, 'analyze', 'analyze_total')
+    timer.wrap(app_module, 'extract_content_from_url', 'fetch_extract')
+    timer.wrap(app_module, 'generate_recommendations_from_colab_result', 'recommendations')
+    timer.wrap(app_module, 'complete_job', 'persist_result')
+
+
+def reset_caches():
+    """Fresh process-wide caches so every level starts cold"""
+    embedding_cache._shared_cache = None
+    fanout_cache._shared_cache = None
+    chunk_dedup._shared_index = None
+
+
+def run_level(tasks, concurrency, rounds, timer, stub, trace_memory):
+    latencies = []
+    lock = threading.Lock()
+
+    def one(task):
+        started = time.perf_counter()
+        task()
+        with lock:
+            latencies.append(time.perf_counter() - started)
+
+    timer.reset()
+    calls_before = dict(stub.calls)
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, [t for _ in range(rounds) for t in tasks]))
+    wall = time.perf_counter() - started
+    heap_peak = tracemalloc.get_traced_memory()[1] / 1e6 if trace_memory else None
+    if trace_memory:
+        tracemalloc.stop()
+
+    return {
+        'concurrency': concurrency,
+        'jobs': len(latencies),
+        'wall_seconds': round(wall, 3),
+        'jobs_per_second': round(len(latencies) / wall, 3) if wall else 0.0,
+        'latency': describe(latencies),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'peak_heap_mb': round(heap_peak, 1) if heap_peak is not None else None,
+        'stub_calls': {k: stub.calls[k] - calls_before[k] for k in stub.calls},
+        'stages': timer.summary()
+    }
+
+
+def analyze_tasks(analyzer, pages):
+    """One task per page; content is extracted up front (capped as in process mode) so only the analyzer is measured"""
+    tasks = []
+    for _, name, content in pages:
+        title, text = extract_text_streaming(iter_chunks(content), max_chars=MAX_TEXT_CHARS,
+                                             main_content=app_module.CONTENT_EXTRACTION == 'main')
+        content_data = {'title': title, 'content': text, 'word_count': len(text.split())}
+        url = f'https://bench.example/{name}'
+        tasks.append(functools.partial(analyzer.analyze, url=url, content_data=content_data, threshold=0.75))
+    return tasks
+
+
+def process_tasks(pages, base_url):
+    """One task per page: create an AnalysisJob and run process_analysis on it (force=True)"""
+    from models import db, AnalysisJob, User
+    with app_module.app.app_context():
+        user_id = User.query.first().id
+
+    def task(url):
+        job_id = str(uuid.uuid4())
+        with app_module.app.app_context():
+            db.session.add(AnalysisJob(job_id=job_id, user_id=user_id, url=url, status='queued'))
+            db.session.commit()
+        app_module.process_analysis(job_id, url, user_id, force=True)
+
+    return [functools.partial(task, f'{base_url}/{name}') for _, name, _ in pages]
+
+
+def print_level(mode, level):
+    lat = level['latency']
+    heap = f" heap {level['peak_heap_mb']:.1f} MB" if level['peak_heap_mb'] is not None else ''
+    print(f"{mode:>8} c={level['concurrency']:<3} {level['jobs']:>3} jobs {level['wall_seconds']:8.2f}s "
+          f"{level['jobs_per_second']:7.2f} jobs/s | latency p50 {lat['p50']:.2f}s p95 {lat['p95']:.2f}s | "
+          f"rss {level['peak_rss_mb']:.0f} MB{heap} | embed reqs {level['stub_calls']['embed_requests']}, "
+          f"texts {level['stub_calls']['texts_embedded']}")
+    for label, s in sorted(level['stages'].items(), key=lambda item: -item[1]['total']):
+        print(f"{'':>14}{label:<18} n={s['count']:<4} mean {s['mean']:7.3f}s p50 {s['p50']:7.3f}s "
+              f"p95 {s['p95']:7.3f}s total {s['total']:8.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=['analyze', 'process', 'both'], default='both')
+    parser.add_argument('--concurrency', default='1,2,4,8')
+    parser.add_argument('--corpus', help='directory of saved .html pages (default: synthetic 1 KB - 5 MB)')
+    parser.add_argument('--latency-ms', type=float, default=150.0)
+    parser.add_argument('--jitter-ms', type=float, default=50.0)
+    parser.add_argument('--chunker', choices=['fallback', 'chonkie'], default='fallback',
+                        help="'chonkie' needs the model2vec model available locally")
+    parser.add_argument('--rounds', type=int, default=1, help='times each page is analyzed per level')
+    parser.add_argument('--warm', action='store_true', help='keep caches between levels')
+    parser.add_argument('--tracemalloc', action='store_true', help='also trace the Python heap peak (slower)')
+    parser.add_argument('--json', help='write all results to this file')
+    parser.add_argument('--verbose', action='store_true', help='keep pipeline logging')
+    args = parser.parse_args()
+
+    levels = [int(c) for c in args.concurrency.split(',') if c.strip()]
+    stub = GeminiStub(args.latency_ms, args.jitter_ms)
+    pages = build_corpus(args.corpus)
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, 'w'))
+
+    print(f"Corpus: {', '.join(f'{label} ({len(c) / 1e3:.0f} KB)' for label, _, c in pages)}")
+    print(f"Stub latency {args.latency_ms:.0f}±{args.jitter_ms:.0f} ms, chunker {args.chunker}, "
+          f"{'warm' if args.warm else 'cold'} caches, workdir {_workdir}")
+
+    results = {'config': vars(args), 'levels': []}
+    timer = StageTimer()
+    with quiet:
+        analyzer = install(stub, args.chunker)
+        instrument(timer)
+        server, base_url = serve_corpus(pages)
+
+    modes = ['analyze', 'process'] if args.mode == 'both' else [args.mode]
+    try:
+        for mode in modes:
+            with quiet:
+                tasks = analyze_tasks(analyzer, pages) if mode == 'analyze' else process_tasks(pages, base_url)
+            for concurrency in levels:
+                if not args.warm:
+                    reset_caches()
+                with quiet:
+                    level = run_level(tasks, concurrency, args.rounds, timer, stub, args.tracemalloc)
+                level['mode'] = mode
+                results['levels'].append(level)
+                print_level(mode, level)
+    finally:
+        server.shutdown()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'Results written to {args.json}')
+
+
+if __name__ == '__main__':
+    main()
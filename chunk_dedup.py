@@ -0,0 +1,258 @@
+"""
+Cross-page chunk fingerprint index
+Per-domain exact and near-duplicate (64-bit SimHash) fingerprints of content chunks, so
+header/footer paragraphs repeated on every page of a site can be recognized as boilerplate,
+and near-duplicate chunks (SimHash within SIMHASH_MAX_DISTANCE of 64 bits) can reuse the
+embedding of the chunk first seen. Only fingerprints, the pages they were seen on and the
+embedding-cache digest of that first chunk are kept, never chunk text. Hashes are blake2b,
+so fingerprints agree across workers and restarts.
+"""
+
+import os
+import hashlib
+import threading
+from itertools import chain
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+from urllib.parse import urlsplit
+import numpy as np
+from page_cache import canonicalize_url
+from embedding_cache import text_digest
+
+# Constants
+CHUNK_DEDUP_ENABLED = os.getenv('CHUNK_DEDUP_ENABLED', 'true').lower() == 'true'
+CHUNK_DEDUP_EXCLUDE = os.getenv('CHUNK_DEDUP_EXCLUDE', 'false').lower() == 'true'  # Drop boilerplate from scoring
+CHUNK_DEDUP_MIN_PAGES = int(os.getenv('CHUNK_DEDUP_MIN_PAGES', '3'))  # Pages a chunk must appear on to be boilerplate
+CHUNK_DEDUP_MAX_DOMAINS = int(os.getenv('CHUNK_DEDUP_MAX_DOMAINS', '100'))
+CHUNK_DEDUP_MAX_CHUNKS = int(os.getenv('CHUNK_DEDUP_MAX_CHUNKS', '5000'))  # Fingerprints kept per domain (~200 bytes each)
+SIMHASH_MAX_DISTANCE = 6  # Max differing bits (of 64) for near duplicates
+SIMHASH_MIN_WORDS = 8  # Shorter chunks are matched exactly only
+INITIAL_CAPACITY = 256  # Fingerprint arrays grow by doubling up to CHUNK_DEDUP_MAX_CHUNKS
+MATCH_BLOCK = 1 << 16  # Chunk x fingerprint distances computed per numpy pass
+SIMHASH_TOKEN_BLOCK = 1 << 14  # Tokens hashed per numpy pass
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def simhashes(token_lists: List[List[str]]) -> np.ndarray:
+    """64-bit SimHash over word tokens of each (normalized) text, computed for many texts at once"""
+    result = np.zeros(len(token_lists), dtype=np.uint64)
+    start = 0
+    while start < len(token_lists):  # Blocks of about SIMHASH_TOKEN_BLOCK tokens bound the 64x bit expansion
+        end, tokens = start, 0
+        while end < len(token_lists) and (end == start or tokens + len(token_lists[end]) <= SIMHASH_TOKEN_BLOCK):
+            tokens += len(token_lists[end])
+            end += 1
+        result[start:end] = _simhash_block(token_lists[start:end], tokens)
+        start = end
+    return result
+
+
+def _simhash_block(token_lists, total):
+    counts = np.array([len(tokens) for tokens in token_lists], dtype=np.int64)
+    result = np.zeros(len(token_lists), dtype=np.uint64)
+    present = counts > 0
+    if not total:
+        return result
+    vocab = {}  # Each distinct token is hashed once per block
+    ids = np.fromiter((vocab.setdefault(t, len(vocab)) for t in chain.from_iterable(token_lists)),
+                      dtype=np.int64, count=total)
+    hashes = np.fromiter(map(_hash64, vocab), dtype=np.uint64, count=len(vocab))[ids]
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder='little')
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[present]
+    weights = np.add.reduceat(bits, starts, axis=0, dtype=np.int32) * 2 - counts[present, None]
+    packed = np.packbits(weights > 0, axis=1, bitorder='little')
+    result[present] = packed.view(np.uint64).ravel()
+    return result
+
+
+def popcount(values: np.ndarray) -> np.ndarray:
+    """Set bits of each uint64 (SWAR), computed in place"""
+    scratch = values >> np.uint64(1)
+    scratch &= np.uint64(0x5555555555555555)
+    values -= scratch
+    np.right_shift(values, np.uint64(2), out=scratch)
+    scratch &= np.uint64(0x3333333333333333)
+    values &= np.uint64(0x3333333333333333)
+    values += scratch
+    np.right_shift(values, np.uint64(4), out=scratch)
+    values += scratch
+    values &= np.uint64(0x0F0F0F0F0F0F0F0F)
+    values *= np.uint64(0x0101010101010101)
+    values >>= np.uint64(56)
+    return values
+
+
+def nearest(values: np.ndarray, stored: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    """ids of the first stored SimHash within SIMHASH_MAX_DISTANCE of each value, -1 for none"""
+    found = np.full(len(values), -1, dtype=np.int64)
+    if not len(stored) or not len(values):
+        return found
+    step = max(1, MATCH_BLOCK // len(stored))
+    for start in range(0, len(values), step):
+        block = popcount(values[start:start + step, None] ^ stored[None, :]) <= SIMHASH_MAX_DISTANCE
+        hit = block.any(axis=1)
+        found[start:start + step][hit] = ids[block.argmax(axis=1)[hit]]
+    return found
+
+
+def domain_of(url: str) -> str:
+    host = urlsplit(canonicalize_url(url)).netloc
+    return host[4:] if host.startswith('www.') else host
+
+
+class _DomainIndex:
+    """Fingerprints of one domain in fixed-width arrays; the oldest slot is reused once full"""
+
+    def __init__(self, min_pages):
+        capacity = min(INITIAL_CAPACITY, CHUNK_DEDUP_MAX_CHUNKS)
+        self.slots = {}  # exact hash -> slot
+        self.keys = np.zeros(capacity, dtype=np.uint64)  # slot -> exact hash
+        self.simhashes = np.zeros(capacity, dtype=np.uint64)
+        self.near = np.zeros(capacity, dtype=bool)  # Slot has a SimHash (chunk long enough)
+        self.pages = np.zeros((capacity, min_pages), dtype=np.uint64)  # Distinct page hashes, 0 = free
+        self.sources = np.zeros((capacity, 32), dtype=np.uint8)  # text_digest of the first chunk seen
+        self.size = 0
+        self.next = 0
+
+    def find_near(self, values: np.ndarray) -> np.ndarray:
+        """First stored slot within SIMHASH_MAX_DISTANCE of each value, -1 for none"""
+        candidates = np.flatnonzero(self.near[:self.size])
+        return nearest(values, self.simhashes[candidates], candidates)
+
+    def _grow(self):
+        capacity = min(len(self.keys) * 2, CHUNK_DEDUP_MAX_CHUNKS)
+        for name in ('keys', 'simhashes', 'near', 'pages', 'sources'):
+            old = getattr(self, name)
+            grown = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            grown[:len(old)] = old
+            setattr(self, name, grown)
+
+    def add(self, key, value, source):
+        if self.next >= len(self.keys) and len(self.keys) < CHUNK_DEDUP_MAX_CHUNKS:
+            self._grow()
+        slot = self.next % len(self.keys)
+        if self.size == len(self.keys):  # Full: evict the oldest fingerprint
+            self.slots.pop(int(self.keys[slot]), None)
+        self.slots[key] = slot
+        self.keys[slot] = key
+        self.simhashes[slot] = value or 0
+        self.near[slot] = value is not None
+        self.pages[slot] = 0
+        self.sources[slot] = np.frombuffer(bytes.fromhex(source), dtype=np.uint8)
+        self.size = min(self.size + 1, len(self.keys))
+        self.next = slot + 1
+        return slot
+
+    def seen_on(self, slot, page) -> int:
+        """Record page for the fingerprint in slot; returns its distinct page count (capped at min_pages)"""
+        row = self.pages[slot]
+        seen = int(np.count_nonzero(row))
+        if seen < len(row) and page not in row[:seen]:
+            row[seen] = page
+            seen += 1
+        return seen
+
+
+class ChunkIndex:
+    """Per-domain chunk fingerprints shared by all jobs in this process"""
+
+    def __init__(self, max_domains=CHUNK_DEDUP_MAX_DOMAINS, min_pages=CHUNK_DEDUP_MIN_PAGES):
+        self.max_domains = max_domains
+        self.min_pages = max(2, min_pages)
+        self._domains = OrderedDict()
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    def observe(self, url: str, chunks: List[str]) -> Tuple[List[bool], List[bool], List[Optional[str]]]:
+        """Record a page's chunks; returns (repeated, is_boilerplate, sources) aligned with chunks
+
+        repeated[i] is true when chunk i matches an exact or near-duplicate fingerprint already
+        seen on the domain. is_boilerplate[i] is true once that fingerprint has appeared on
+        min_pages distinct pages of the domain (this one included). sources[i] is the
+        embedding_cache.text_digest of the matched fingerprint's first chunk when that text
+        differs from chunk i (a near duplicate whose embedding can be reused), else None.
+        """
+        domain = domain_of(url)
+        page = np.uint64(_hash64(canonicalize_url(url)) or 1)
+        tokens = [chunk.casefold().split() for chunk in chunks]
+        keys = [_hash64(' '.join(t)) for t in tokens]
+        digests = [text_digest(chunk) for chunk in chunks]
+        values = simhashes([t if len(t) >= SIMHASH_MIN_WORDS else [] for t in tokens])
+
+        hashed = np.array([len(t) >= SIMHASH_MIN_WORDS for t in tokens], dtype=bool)
+        repeated, boilerplate, sources = [], [], []
+        with self._lock:
+            index = self._domains.get(domain)
+            if index is None:
+                index = self._domains[domain] = _DomainIndex(self.min_pages)
+                while len(self._domains) > self.max_domains:
+                    self._domains.popitem(last=False)
+            self._domains.move_to_end(domain)
+
+            # Near matches against stored fingerprints and earlier chunks of this page, in one pass each
+            lookup = np.flatnonzero(hashed)
+            near = np.full(len(chunks), -1, dtype=np.int64)
+            near[lookup] = index.find_near(values[lookup])
+            near_keys = index.keys[np.maximum(near, 0)].copy()  # To notice slots reused while adding this page
+            earlier = np.full(len(chunks), -1, dtype=np.int64)
+            if len(lookup) > 1:
+                pairs = popcount(values[lookup, None] ^ values[None, lookup]) <= SIMHASH_MAX_DISTANCE
+                pairs &= np.tri(len(lookup), k=-1, dtype=bool)
+                hit = pairs.any(axis=1)
+                earlier[lookup[hit]] = lookup[pairs.argmax(axis=1)[hit]]
+            slots = [None] * len(chunks)
+
+            for i, key in enumerate(keys):
+                slot = index.slots.get(key)
+                seen = True
+                if slot is not None:
+                    self.exact_hits += 1
+                elif near[i] >= 0 and index.keys[near[i]] == near_keys[i]:
+                    slot = int(near[i])
+                    self.near_hits += 1
+                elif earlier[i] >= 0 and slots[earlier[i]] is not None:
+                    slot = slots[earlier[i]]
+                    self.near_hits += 1
+                else:
+                    self.misses += 1
+                    slot = index.add(key, int(values[i]) if hashed[i] else None, digests[i])
+                    seen = False
+                slots[i] = slot
+                source = index.sources[slot].tobytes().hex()
+                repeated.append(seen)
+                sources.append(source if source != digests[i] else None)
+                boilerplate.append(index.seen_on(slot, page) >= self.min_pages)
+        return repeated, boilerplate, sources
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.exact_hits + self.near_hits + self.misses
+            return {
+                'domains': len(self._domains),
+                'fingerprints': sum(d.size for d in self._domains.values()),
+                'exact_hits': self.exact_hits,
+                'near_hits': self.near_hits,
+                'misses': self.misses,
+                'reuse_rate': round((self.exact_hits + self.near_hits) / lookups, 4) if lookups else 0.0
+            }
+
+
+_shared_index = None
+_shared_index_lock = threading.Lock()
+
+
+def get_chunk_index() -> Optional[ChunkIndex]:
+    """Process-wide chunk index, or None when CHUNK_DEDUP_ENABLED is off"""
+    global _shared_index
+    if not CHUNK_DEDUP_ENABLED:
+        return None
+    if _shared_index is None:
+        with _shared_index_lock:
+            if _shared_index is None:
+                _shared_index = ChunkIndex()
+    return _shared_index
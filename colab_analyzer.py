@@ -6,12 +6,24 @@ LLM generates query strings only, deterministic post-processing adds metadata
 import os
 import re
 import json
+import time
 import datetime
-from typing import List, Dict, Tuple
+import threading
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, List, Dict, Optional, Tuple
 import numpy as np
 import dspy
 import google.generativeai as genai
 from chonkie import SemanticChunker
+from chonkie.embeddings import AutoEmbeddings
+from embedding_cache import get_embedding_cache
+from fanout_cache import get_fanout_cache
+from chunk_dedup import get_chunk_index, CHUNK_DEDUP_EXCLUDE
+from progress_events import NULL_PROGRESS
+from metrics import StageSpans
+from usage import api_call
 
 # Constants
 MIN_QUERIES_SIMPLE = 10
@@ -19,116 +31,204 @@ MIN_QUERIES_COMPLEX = 20
 CHUNK_SIZE = 512
 CHUNK_OVERLAP = 50
 SIMILARITY_THRESHOLD = 0.75
+TOP_K_CHUNKS = 3
 GEMINI_MODEL = 'gemini-2.0-flash-exp'
 GEMINI_EMBEDDING_MODEL = 'models/text-embedding-004'
+CHUNKER_EMBEDDING_MODEL = 'minishlab/potion-base-32M'  # Default supported Chonkie model
+CHUNKER_THRESHOLD = 0.5
+CHUNK_BATCH_MAX_DOCS = int(os.getenv('CHUNK_BATCH_MAX_DOCS', '16'))  # Documents per chunk_batch pass
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', '100'))  # API max per batch request
+EMBED_CONCURRENCY = int(os.getenv('EMBED_CONCURRENCY', '4'))
 
 
 # ============================================================================
 # DETERMINISTIC POST-PROCESSING (NEW APPROACH)
 # ============================================================================
 
+# Keyword rules, in priority order: the first rule with a matching keyword wins
+INTENT_RULES = [
+    (['how to', 'tutorial', 'guide', 'steps', 'methods', 'process'], 'informational'),
+    (['buy', 'price', 'cost', 'pricing', 'services', 'hire', 'purchase'], 'commercial'),
+    (['vs', 'versus', 'compare', 'comparison', 'difference', 'better'], 'commercial'),
+    (['download', 'login', 'sign up', 'register', 'subscribe'], 'transactional'),
+    (['navigate', 'find', 'where is', 'locate', 'contact'], 'navigational'),
+]
+DEFAULT_INTENT = 'informational'
+
+ROUTING_RULES = [
+    (['checklist', 'list of', 'steps to', 'items to'], ('checklist', 'Structured actionable items needed')),
+    (['how to', 'tutorial', 'guide to', 'step by step'], ('how_to_steps', 'Step-by-step instructions required')),
+    (['vs', 'versus', 'compare', 'comparison', 'difference between'], ('comparison_table', 'Side-by-side comparison format')),
+    (['best tools', 'top tools', 'software for', 'tools for'], ('comparison_table', 'Tool evaluation matrix needed')),
+    (['script', 'code', 'automate', 'python', 'javascript', 'api'], ('code_samples/docs', 'Executable code examples required')),
+    (['example', 'case study', 'real-world', 'success story'], ('case_study', 'Concrete implementation examples')),
+    (['faq', 'questions', 'q&a', 'frequently asked'], ('faq_page', 'Question-answer format optimal')),
+    (['template', 'worksheet', 'form', 'spreadsheet'], ('checklist', 'Actionable template resource')),
+    (['pricing', 'cost', 'services', 'packages'], ('pricing_page', 'Pricing comparison needed')),
+]
+DEFAULT_ROUTING = ('web_article', 'General informational content format')
+
+REASONING_RULES = [
+    (['what is', 'definition', 'meaning', 'explain', 'introduction'], "Users need foundational understanding of core concepts and terminology"),
+    (['how to', 'steps', 'guide', 'tutorial', 'method', 'process'], "Users seek practical guidance for implementation and execution"),
+    (['vs', 'compare', 'difference', 'alternative', 'versus'], "Users need to evaluate different approaches and make informed decisions"),
+    (['best', 'top', 'optimize', 'improve', 'enhance', 'advanced'], "Advanced users want to maximize effectiveness and performance"),
+    (['roi', 'pricing', 'cost', 'budget', 'investment', 'services'], "Decision-makers evaluating business value, ROI, and investment"),
+    (['automate', 'script', 'code', 'api', 'python', 'javascript'], "Technical users seeking efficiency through automation solutions"),
+    (['troubleshoot', 'fix', 'error', 'problem', 'issue', 'debug'], "Users need problem-solving guidance for specific issues"),
+    (['tools', 'software', 'platform', 'app', 'service'], "Users evaluating and selecting appropriate tools for their needs"),
+]
+DEFAULT_REASONING = "Users require comprehensive information on this topic"
+
+QUESTION_PREFIXES = ('how', 'what', 'why', 'when', 'where', 'who', 'which', 'can', 'should')
+CONVERSATIONAL_WORDS = ['explain', 'tell me', 'i want to', 'help me', 'show me']
+LONG_TAIL_MIN_WORDS = 7
+
+
+def _first_rule(q, rules, default):
+    for keywords, value in rules:
+        if any(kw in q for kw in keywords):
+            return value
+    return default
+
+
 def classify_query_intent(query: str) -> str:
     """Deterministic intent classification"""
-    q = query.lower()
-    
-    if any(word in q for word in ['how to', 'tutorial', 'guide', 'steps', 'methods', 'process']):
-        return 'informational'
-    elif any(word in q for word in ['buy', 'price', 'cost', 'pricing', 'services', 'hire', 'purchase']):
-        return 'commercial'
-    elif any(word in q for word in ['vs', 'versus', 'compare', 'comparison', 'difference', 'better']):
-        return 'commercial'
-    elif any(word in q for word in ['download', 'login', 'sign up', 'register', 'subscribe']):
-        return 'transactional'
-    elif any(word in q for word in ['navigate', 'find', 'where is', 'locate', 'contact']):
-        return 'navigational'
-    else:
-        return 'informational'
+    return _first_rule(query.lower(), INTENT_RULES, DEFAULT_INTENT)
 
 
 def determine_routing_format(query: str) -> Tuple[str, str]:
     """Deterministic routing format with reasoning"""
-    q = query.lower()
-    
-    patterns = [
-        (['checklist', 'list of', 'steps to', 'items to'], 'checklist', 'Structured actionable items needed'),
-        (['how to', 'tutorial', 'guide to', 'step by step'], 'how_to_steps', 'Step-by-step instructions required'),
-        (['vs', 'versus', 'compare', 'comparison', 'difference between'], 'comparison_table', 'Side-by-side comparison format'),
-        (['best tools', 'top tools', 'software for', 'tools for'], 'comparison_table', 'Tool evaluation matrix needed'),
-        (['script', 'code', 'automate', 'python', 'javascript', 'api'], 'code_samples/docs', 'Executable code examples required'),
-        (['example', 'case study', 'real-world', 'success story'], 'case_study', 'Concrete implementation examples'),
-        (['faq', 'questions', 'q&a', 'frequently asked'], 'faq_page', 'Question-answer format optimal'),
-        (['template', 'worksheet', 'form', 'spreadsheet'], 'checklist', 'Actionable template resource'),
-        (['pricing', 'cost', 'services', 'packages'], 'pricing_page', 'Pricing comparison needed'),
-    ]
-    
-    for keywords, format_type, reason in patterns:
-        if any(kw in q for kw in keywords):
-            return format_type, reason
-    
-    return 'web_article', 'General informational content format'
+    return _first_rule(query.lower(), ROUTING_RULES, DEFAULT_ROUTING)
 
 
 def get_reasoning_by_category(query: str) -> str:
     """Template-based reasoning"""
-    q = query.lower()
-    
-    reasoning_map = {
-        'definition': "Users need foundational understanding of core concepts and terminology",
-        'implementation': "Users seek practical guidance for implementation and execution",
-        'comparison': "Users need to evaluate different approaches and make informed decisions",
-        'optimization': "Advanced users want to maximize effectiveness and performance",
-        'business': "Decision-makers evaluating business value, ROI, and investment",
-        'automation': "Technical users seeking efficiency through automation solutions",
-        'troubleshooting': "Users need problem-solving guidance for specific issues",
-        'tools': "Users evaluating and selecting appropriate tools for their needs",
-    }
-    
-    if any(w in q for w in ['what is', 'definition', 'meaning', 'explain', 'introduction']):
-        return reasoning_map['definition']
-    elif any(w in q for w in ['how to', 'steps', 'guide', 'tutorial', 'method', 'process']):
-        return reasoning_map['implementation']
-    elif any(w in q for w in ['vs', 'compare', 'difference', 'alternative', 'versus']):
-        return reasoning_map['comparison']
-    elif any(w in q for w in ['best', 'top', 'optimize', 'improve', 'enhance', 'advanced']):
-        return reasoning_map['optimization']
-    elif any(w in q for w in ['roi', 'pricing', 'cost', 'budget', 'investment', 'services']):
-        return reasoning_map['business']
-    elif any(w in q for w in ['automate', 'script', 'code', 'api', 'python', 'javascript']):
-        return reasoning_map['automation']
-    elif any(w in q for w in ['troubleshoot', 'fix', 'error', 'problem', 'issue', 'debug']):
-        return reasoning_map['troubleshooting']
-    elif any(w in q for w in ['tools', 'software', 'platform', 'app', 'service']):
-        return reasoning_map['tools']
-    else:
-        return "Users require comprehensive information on this topic"
+    return _first_rule(query.lower(), REASONING_RULES, DEFAULT_REASONING)
 
 
 def classify_query_type(query: str) -> str:
     """Determine query structural type"""
     q = query.lower()
     
-    if q.endswith('?') or q.startswith(('how', 'what', 'why', 'when', 'where', 'who', 'which', 'can', 'should')):
+    if q.endswith('?') or q.startswith(QUESTION_PREFIXES):
         return 'question'
-    elif len(q.split()) > 6:
+    elif len(q.split()) >= LONG_TAIL_MIN_WORDS:
         return 'long-tail'
-    elif any(w in q for w in ['explain', 'tell me', 'i want to', 'help me', 'show me']):
+    elif any(w in q for w in CONVERSATIONAL_WORDS):
         return 'conversational'
     else:
         return 'keyword'
 
 
+def _trie_regex(words: List[str]) -> str:
+    """Regex alternation factored by common prefixes; greedy, so the longest word wins at each position"""
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[''] = {}  # End of word
+    
+    def build(node):
+        ends = '' in node
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if ends:
+            return '(?:' + body + ')?'
+        return body
+    
+    return build(trie)
+
+
+class QueryEnricher:
+    """Single-pass enrichment: one compiled regex finds every rule keyword in a query
+    
+    Produces the same fields as the per-field functions above. The pattern is a
+    prefix-trie alternation inside a lookahead tried at every position, so
+    overlapping keywords are all found; shorter keywords that are prefixes of
+    the longest match at a position are implied by it.
+    """
+    
+    FIELDS = ('intent', 'routing', 'reasoning', 'conversational')
+    
+    def __init__(self):
+        tables = {
+            'intent': INTENT_RULES,
+            'routing': ROUTING_RULES,
+            'reasoning': REASONING_RULES,
+            'conversational': [(CONVERSATIONAL_WORDS, True)],
+        }
+        self.values = {field: [value for _, value in rules] for field, rules in tables.items()}
+        
+        # keyword -> [(field, rule_index), ...]
+        hits = {}
+        for field, rules in tables.items():
+            for rule_idx, (keywords, _) in enumerate(rules):
+                for kw in keywords:
+                    hits.setdefault(kw, []).append((field, rule_idx))
+        
+        keywords = sorted(hits, key=len, reverse=True)
+        self.pattern = re.compile('(?=(' + _trie_regex(keywords) + '))')
+        
+        # Longest match at a position -> every (field, rule) implied by it and its keyword prefixes
+        self.implied = {
+            kw: [hit for other in keywords if kw.startswith(other) for hit in hits[other]]
+            for kw in keywords
+        }
+    
+    def enrich(self, query_text: str) -> Dict:
+        q = query_text.lower()
+        best = {}
+        for match in self.pattern.finditer(q):
+            for field, rule_idx in self.implied[match.group(1)]:
+                if rule_idx < best.get(field, len(self.values[field])):
+                    best[field] = rule_idx
+        
+        if q.endswith('?') or q.startswith(QUESTION_PREFIXES):
+            query_type = 'question'
+        elif len(q.split()) >= LONG_TAIL_MIN_WORDS:
+            query_type = 'long-tail'
+        elif 'conversational' in best:
+            query_type = 'conversational'
+        else:
+            query_type = 'keyword'
+        
+        routing, format_reason = self.values['routing'][best['routing']] if 'routing' in best else DEFAULT_ROUTING
+        
+        return {
+            'query': query_text.strip(),
+            'type': query_type,
+            'user_intent': self.values['intent'][best['intent']] if 'intent' in best else DEFAULT_INTENT,
+            'routing_format': routing,
+            'format_reason': format_reason,
+            'reasoning': self.values['reasoning'][best['reasoning']] if 'reasoning' in best else DEFAULT_REASONING
+        }
+    
+    def enrich_many(self, query_texts: List[str]) -> List[Dict]:
+        """Batch API; repeated query strings are classified once"""
+        memo = {}
+        results = []
+        for text in query_texts:
+            if text not in memo:
+                memo[text] = self.enrich(text)
+            results.append(dict(memo[text]))
+        return results
+
+
+_query_enricher = QueryEnricher()
+
+
 def enrich_query(query_text: str) -> Dict:
     """Post-processing: add metadata to query string"""
-    routing, format_reason = determine_routing_format(query_text)
-    
-    return {
-        'query': query_text.strip(),
-        'type': classify_query_type(query_text),
-        'user_intent': classify_query_intent(query_text),
-        'routing_format': routing,
-        'format_reason': format_reason,
-        'reasoning': get_reasoning_by_category(query_text)
-    }
+    return _query_enricher.enrich(query_text)
+
+
+def enrich_queries(query_texts: List[str]) -> List[Dict]:
+    """Post-processing for a batch of query strings"""
+    return _query_enricher.enrich_many(query_texts)
 
 
 # ============================================================================
@@ -200,36 +300,65 @@ def chunk_text(text, size=512, overlap=50):
     return chunks
 
 
-def semantic_chunk_text_chonkie(text, gemini_key):
-    """Semantic chunking using Chonkie - per documentation"""
-    print(f'[RankSimulator] Using Chonkie semantic chunker...')
+_chunker_embeddings = None
+_chunker_embeddings_lock = threading.Lock()
+_chunker_pool = []  # Idle SemanticChunkers, reused by every job in this process
+_chunker_pool_lock = threading.Lock()
+
+
+def get_chunker_embeddings():
+    """Chonkie embedding model, loaded once per process and shared by all threads"""
+    global _chunker_embeddings
+    if _chunker_embeddings is None:
+        with _chunker_embeddings_lock:
+            if _chunker_embeddings is None:
+                print(f'[RankSimulator] Loading chunker model {CHUNKER_EMBEDDING_MODEL}...')
+                _chunker_embeddings = AutoEmbeddings.get_embeddings(CHUNKER_EMBEDDING_MODEL)
+    return _chunker_embeddings
+
+
+@contextmanager
+def semantic_chunker():
+    """Borrow a SemanticChunker from the process-wide pool
     
-    try:
-        # Per Chonkie documentation - use supported embedding model
+    A chunker is used by one thread at a time; the pool grows to the number of jobs chunking
+    at once and its chunkers, which all wrap the shared embedding model, outlive each job.
+    """
+    with _chunker_pool_lock:
+        chunker = _chunker_pool.pop() if _chunker_pool else None
+    if chunker is None:
         chunker = SemanticChunker(
-            embedding_model="minishlab/potion-base-32M",  # Default supported model
-            threshold=0.5,  # Similarity threshold
-            chunk_size=512  # Max tokens per chunk
+            embedding_model=get_chunker_embeddings(),
+            threshold=CHUNKER_THRESHOLD,  # Similarity threshold
+            chunk_size=CHUNK_SIZE  # Max tokens per chunk
         )
-        chunks = chunker.chunk(text)
-        
-        # Extract text from Chunk objects - handle both object and string types
-        chunk_texts = []
-        for chunk in chunks:
-            if hasattr(chunk, 'text'):
-                chunk_texts.append(chunk.text.strip())
-            else:
-                chunk_texts.append(str(chunk).strip())
+    try:
+        yield chunker
+    finally:
+        with _chunker_pool_lock:
+            _chunker_pool.append(chunker)
+
+
+def _chunk_texts(chunks):
+    """Extract text from Chunk objects - handle both object and string types"""
+    chunk_texts = []
+    for chunk in chunks:
+        if hasattr(chunk, 'text'):
+            chunk_texts.append(chunk.text.strip())
+        else:
+            chunk_texts.append(str(chunk).strip())
+    return [ct for ct in chunk_texts if ct]
+
+
+def _chunk_document(text):
+    """Semantic chunking of one document with a pooled chunker, fixed-size chunks on failure"""
+    try:
+        with semantic_chunker() as chunker:
+            chunk_texts = _chunk_texts(chunker.chunk(text))
         
         if not chunk_texts:
             print('[RankSimulator] ⚠️ Chonkie returned empty chunks, using fallback')
             return chunk_text(text, CHUNK_SIZE, CHUNK_OVERLAP)
-        
-        print(f'[RankSimulator] ✅ Created {len(chunk_texts)} semantic chunks with Chonkie')
-        for i, ct in enumerate(chunk_texts, 1):
-            word_count = len(ct.split())
-            print(f'[RankSimulator]   Chunk {i}: {word_count} words')
-        
         return chunk_texts
         
     except Exception as e:
@@ -240,39 +369,292 @@ def semantic_chunk_text_chonkie(text, gemini_key):
         return chunk_text(text, CHUNK_SIZE, CHUNK_OVERLAP)
 
 
+def semantic_chunk_texts_chonkie(texts):
+    """Batch semantic chunking: many documents in one chunk_batch pass, one chunk list per document"""
+    if not texts:
+        return []
+    
+    print(f'[RankSimulator] Chonkie batch chunking {len(texts)} documents...')
+    
+    try:
+        with semantic_chunker() as chunker:
+            batches = chunker.chunk_batch(list(texts), show_progress=False)
+    except Exception as e:
+        print(f'[RankSimulator] Chonkie batch failed, chunking documents one by one: {e}')
+        return [_chunk_document(t) for t in texts]
+    
+    results = []
+    for text, chunks in zip(texts, batches):
+        chunk_texts = _chunk_texts(chunks)
+        results.append(chunk_texts or chunk_text(text, CHUNK_SIZE, CHUNK_OVERLAP))
+    
+    print(f'[RankSimulator] ✅ Created {sum(len(r) for r in results)} semantic chunks across {len(texts)} documents')
+    return results
+
+
+class _ChunkRequest:
+    __slots__ = ('text', 'chunks', 'error', 'done')
+    
+    def __init__(self, text):
+        self.text = text
+        self.chunks = None
+        self.error = None
+        self.done = False
+
+
+class ChunkBatcher:
+    """Chunks documents of concurrent jobs together (group commit)
+    
+    The first caller runs a batch with every document waiting at that moment; documents that
+    arrive while a batch runs wait and go into the next one. A lone job is chunked at once,
+    concurrent bulk pages share chunk_batch passes of up to max_docs documents.
+    """
+    
+    def __init__(self, chunk_many=None, max_docs=CHUNK_BATCH_MAX_DOCS):
+        self.chunk_many = chunk_many or (lambda texts: semantic_chunk_texts_chonkie(texts))
+        self.max_docs = max(1, max_docs)
+        self._cond = threading.Condition()
+        self._pending = []
+        self._running = False
+        self.batches = 0
+        self.documents = 0
+    
+    def chunk(self, text):
+        request = _ChunkRequest(text)
+        with self._cond:
+            self._pending.append(request)
+        while True:
+            with self._cond:
+                while self._running and not request.done:
+                    self._cond.wait()
+                if request.done:
+                    break
+                self._running = True
+                batch = self._pending[:self.max_docs]
+                del self._pending[:self.max_docs]
+            try:
+                results, error = self.chunk_many([r.text for r in batch]), None
+            except Exception as e:
+                results, error = [None] * len(batch), e
+            with self._cond:
+                for r, chunks in zip(batch, results):
+                    r.chunks, r.error, r.done = chunks, error, True
+                self.batches += 1
+                self.documents += len(batch)
+                self._running = False
+                self._cond.notify_all()
+        if request.error is not None:
+            raise request.error
+        return request.chunks
+
+
+_chunk_batcher = ChunkBatcher()
+
+
+def semantic_chunk_text_chonkie(text, gemini_key=None):
+    """Semantic chunking using Chonkie; concurrent jobs are chunked together in one batch"""
+    chunk_texts = _chunk_batcher.chunk(text)
+    print(f'[RankSimulator] ✅ Created {len(chunk_texts)} semantic chunks with Chonkie')
+    return chunk_texts
+
+
+# ============================================================================
+# EMBEDDINGS
+# ============================================================================
+
+def embed_texts(texts: List[str], task_type: str = "retrieval_document",
+                batch_size: int = EMBED_BATCH_SIZE, concurrency: int = EMBED_CONCURRENCY,
+                use_cache: bool = True, on_progress: Optional[Callable[[int, int], None]] = None) -> np.ndarray:
+    """Embed texts in size-bounded batches, returns one (len(texts), dim) matrix
+    
+    Cached vectors are reused; only cache misses are sent to Gemini.
+    on_progress(done, total) is called as batches finish (cached texts count as done).
+    """
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+    
+    cache = get_embedding_cache() if use_cache else None
+    vectors = cache.get_many(GEMINI_EMBEDDING_MODEL, task_type, texts) if cache else [None] * len(texts)
+    
+    cached_count = sum(v is not None for v in vectors)
+    
+    # Deduplicate misses so repeated texts are embedded once
+    missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+    done = [len(texts) - len(missing)]
+    done_lock = threading.Lock()
+    if on_progress:
+        on_progress(done[0], len(texts))
+    
+    if missing:
+        batch_size = max(1, batch_size)
+        batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+        
+        def _embed_batch(batch):
+            with api_call('embed', input_chars=sum(len(t) for t in batch), texts=len(batch)):
+                result = genai.embed_content(
+                    model=GEMINI_EMBEDDING_MODEL,
+                    content=batch,
+                    task_type=task_type
+                )
+            if on_progress:
+                with done_lock:
+                    done[0] += len(batch)
+                    on_progress(done[0], len(texts))
+            return result['embedding']
+        
+        if len(batches) == 1 or concurrency <= 1:
+            results = [_embed_batch(b) for b in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=min(concurrency, len(batches))) as pool:
+                # Each batch runs in a copy of the caller's context so its API usage reaches the job's meter
+                futures = [pool.submit(contextvars.copy_context().run, _embed_batch, b) for b in batches]
+                results = [f.result() for f in futures]  # Batch order is kept
+        
+        fresh = [np.asarray(vec, dtype=np.float32) for batch in results for vec in batch]
+        if cache:
+            cache.put_many(GEMINI_EMBEDDING_MODEL, task_type, missing, fresh)
+        by_text = dict(zip(missing, fresh))
+        vectors = [v if v is not None else by_text[t] for t, v in zip(texts, vectors)]
+    
+    print(f'[RankSimulator] Embeddings: {cached_count} cached, {len(missing)} requested')
+    return np.vstack(vectors).astype(np.float32, copy=False)
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalize each row; all-zero rows stay zero"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class SimilarityEngine:
+    """Cosine scoring of many queries against one chunk matrix
+    
+    The chunk matrix is normalized once per job; all queries are then scored
+    with a single matrix multiply.
+    """
+    
+    def __init__(self, chunk_emb: np.ndarray):
+        self.chunk_emb = normalize_rows(chunk_emb) if len(chunk_emb) else np.zeros((0, 0), dtype=np.float32)
+    
+    @property
+    def num_chunks(self) -> int:
+        return self.chunk_emb.shape[0]
+    
+    def scores(self, query_emb: np.ndarray) -> np.ndarray:
+        """Full (num_queries, num_chunks) cosine similarity matrix"""
+        if not len(query_emb) or not self.num_chunks:
+            return np.zeros((len(query_emb), self.num_chunks), dtype=np.float32)
+        return normalize_rows(query_emb) @ self.chunk_emb.T
+    
+    def top_k(self, query_emb: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """Best k chunks per query as (indices, scores), each (num_queries, k), best first"""
+        sim = self.scores(query_emb)
+        k = max(1, min(k, self.num_chunks))
+        if not self.num_chunks:
+            empty = np.zeros((len(query_emb), 0))
+            return empty.astype(int), empty
+        
+        if k < self.num_chunks:
+            idx = np.argpartition(-sim, k - 1, axis=1)[:, :k]
+        else:
+            idx = np.tile(np.arange(self.num_chunks), (sim.shape[0], 1))
+        top = np.take_along_axis(sim, idx, axis=1)
+        order = np.argsort(-top, axis=1, kind='stable')
+        return np.take_along_axis(idx, order, axis=1), np.take_along_axis(top, order, axis=1)
+
+
 # ============================================================================
 # GEMINI ANALYZER
 # ============================================================================
 
+class StageGraph:
+    """Minimal dependency graph runner
+    
+    Each stage is a callable receiving its dependencies' results as positional
+    arguments; a stage starts as soon as all of its dependencies have finished.
+    """
+    
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self.stages = {}  # name -> (fn, deps)
+    
+    def add(self, name, fn, deps=()):
+        self.stages[name] = (fn, tuple(deps))
+        return self
+    
+    def run(self) -> Dict:
+        """Run all stages, returns {name: result}; the first stage error is re-raised"""
+        results = {}
+        pending = dict(self.stages)
+        running = {}
+        
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or running:
+                ready = [name for name, (_, deps) in pending.items() if all(d in results for d in deps)]
+                for name in ready:
+                    fn, deps = pending.pop(name)
+                    ctx = contextvars.copy_context()  # Stages inherit the caller's context (usage meter)
+                    running[pool.submit(ctx.run, fn, *[results[d] for d in deps])] = name
+                
+                if not running:
+                    raise ValueError(f'Unresolvable stage dependencies: {sorted(pending)}')
+                
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+        
+        return results
+
+
+_dspy_configure_lock = threading.Lock()
+_generative_models = {}
+_generative_models_lock = threading.Lock()
+
+
+def get_generative_model(model_name):
+    """Shared GenerativeModel handle per model name"""
+    model = _generative_models.get(model_name)
+    if model is None:
+        with _generative_models_lock:
+            model = _generative_models.setdefault(model_name, genai.GenerativeModel(model_name))
+    return model
+
+
 class RankSimulatorAnalyzer:
-    def __init__(self, gemini_key):
+    def __init__(self, gemini_key, embed_batch_size=EMBED_BATCH_SIZE, embed_concurrency=EMBED_CONCURRENCY):
         print('[RankSimulator] Initializing AI Visibility Analyzer...')
         genai.configure(api_key=gemini_key)
         self.model = GEMINI_MODEL
         self.gemini_key = gemini_key  # Store for Chonkie
+        self.embed_batch_size = embed_batch_size
+        self.embed_concurrency = embed_concurrency
+        self.generative_model = get_generative_model(self.model)  # Reused for every LLM call
         
-        # Setup DSPy
+        # Setup DSPy - settings are process-global, so only one thread may configure them
         os.environ['GOOGLE_API_KEY'] = gemini_key
-        try:
-            # Try new DSPy API first
+        with _dspy_configure_lock:
             try:
-                from dspy import Google
-                dspy_lm = Google(model=GEMINI_MODEL, api_key=gemini_key)
-                dspy.settings.configure(lm=dspy_lm)
-            except:
-                # Fallback to configure
-                dspy.configure(lm=f'google/{GEMINI_MODEL}')
-            
-            self.query_generator = dspy.ChainOfThought(QueryFanOutWithFacets)
-            print('[RankSimulator] DSPy configured successfully')
-        except Exception as e:
-            print(f'[RankSimulator] DSPy setup failed: {e}')
-            self.query_generator = None
+                # Try new DSPy API first
+                try:
+                    from dspy import Google
+                    dspy_lm = Google(model=GEMINI_MODEL, api_key=gemini_key)
+                    dspy.settings.configure(lm=dspy_lm, track_usage=True)
+                except:
+                    # Fallback to configure
+                    dspy.configure(lm=f'google/{GEMINI_MODEL}', track_usage=True)
+                
+                self.query_generator = dspy.ChainOfThought(QueryFanOutWithFacets)
+                print('[RankSimulator] DSPy configured successfully')
+            except Exception as e:
+                print(f'[RankSimulator] DSPy setup failed: {e}')
+                self.query_generator = None
         
         print(f'[RankSimulator] Ready | LLM: {self.model} | Embeddings: {GEMINI_EMBEDDING_MODEL}')
     
-    def _generate_queries_fallback(self, entity_name, num_queries):
-        """Fallback: Direct Gemini call if DSPy fails"""
+    def _generate_queries_fallback(self, entity_name, num_queries, retry=False):
+        """Fallback: Direct Gemini call if DSPy fails (retry=True when DSPy already made a call)"""
         print(f'[RankSimulator] ⚠️ Using direct Gemini fallback for {entity_name}...')
         
         prompt = f"""Generate {num_queries} specific search queries about: {entity_name}
@@ -290,8 +672,9 @@ Return ONLY the JSON array."""
 
         try:
             print(f'[RankSimulator] Calling Gemini API for fallback...')
-            model = genai.GenerativeModel(self.model)
-            response = model.generate_content(prompt)
+            with api_call('generate', input_chars=len(prompt), retry=retry) as call:
+                response = self.generative_model.generate_content(prompt)
+                call.generated(response)
             raw = response.text.strip()
             print(f'[RankSimulator] Gemini response received: {len(raw)} chars')
             
@@ -312,7 +695,7 @@ Return ONLY the JSON array."""
                     print(f'[RankSimulator] Fallback generated {len(query_strings)} queries')
                     
                     # Enrich
-                    enriched = [enrich_query(q) for q in query_strings]
+                    enriched = enrich_queries(query_strings)
                     print(f'[RankSimulator] Queries enriched successfully')
                     return enriched, "Direct Gemini generation (fallback)"
                 else:
@@ -338,11 +721,17 @@ Return ONLY the JSON array."""
         print(f'[RankSimulator] Date: {current_date}, Count: {num_queries}')
         
         try:
-            result = self.query_generator(
-                entity_name=entity_name,
-                current_date=current_date,
-                num_queries=str(num_queries)
-            )
+            with api_call('fanout', input_chars=len(entity_name) + len(current_date)) as call:
+                lm = dspy.settings.lm
+                history_start = len(lm.history) if isinstance(getattr(lm, 'history', None), list) else None
+                result = self.query_generator(
+                    entity_name=entity_name,
+                    current_date=current_date,
+                    num_queries=str(num_queries)
+                )
+                call.output_chars = len(str(getattr(result, 'synthetic_queries', ''))) + \
+                    len(str(getattr(result, 'reasoning_about_facets', '')))
+                call.predicted(result, lm, history_start)
             
             reasoning = result.reasoning_about_facets if hasattr(result, 'reasoning_about_facets') else "N/A"
             raw = result.synthetic_queries.strip()
@@ -396,16 +785,12 @@ Return ONLY the JSON array."""
                 print('[RankSimulator] No queries parsed from DSPy output')
                 print(f'[RankSimulator] Raw output was: {raw[:200]}...')
                 print('[RankSimulator] Trying fallback method...')
-                return self._generate_queries_fallback(entity_name, num_queries)
+                return self._generate_queries_fallback(entity_name, num_queries, retry=True)
             
             # POST-PROCESSING: Enrich each query with metadata
             print(f'[RankSimulator] Enriching {len(query_strings)} queries...')
             print(f'[RankSimulator] Sample queries: {query_strings[:3]}')
-            enriched_queries = []
-            
-            for q_text in query_strings[:num_queries]:
-                enriched = enrich_query(q_text)
-                enriched_queries.append(enriched)
+            enriched_queries = enrich_queries(query_strings[:num_queries])
             
             print(f'[RankSimulator] {len(enriched_queries)} queries enriched with routing/reasoning/intent')
             print(f'[RankSimulator] ✅ All queries generated for entity: "{entity_name}"')
@@ -445,11 +830,12 @@ Return ONLY the main topic/entity name. Examples:
 MAIN TOPIC:"""
         
         try:
-            model = genai.GenerativeModel(self.model)
-            response = model.generate_content(
-                prompt,
-                generation_config=genai.types.GenerationConfig(temperature=0.2)
-            )
+            with api_call('generate', input_chars=len(prompt)) as call:
+                response = self.generative_model.generate_content(
+                    prompt,
+                    generation_config=genai.types.GenerationConfig(temperature=0.2)
+                )
+                call.generated(response)
             
             entity_text = response.text.strip()
             
@@ -472,63 +858,170 @@ MAIN TOPIC:"""
                 'reasoning': 'Fallback to title'
             }
     
-    def _embed(self, texts):
-        """Embeddings with Gemini"""
-        embeddings = []
-        for text in texts:
-            result = genai.embed_content(
-                model=GEMINI_EMBEDDING_MODEL,
-                content=text,
-                task_type="retrieval_document"
-            )
-            embeddings.append(result['embedding'])
-        return np.array(embeddings)
-    
-    def analyze(self, url, content_data, threshold=0.65):
-        """Full analysis with enriched queries"""
+    def _embed(self, texts, on_progress=None):
+        """Batched embeddings with Gemini"""
+        return embed_texts(
+            texts,
+            batch_size=self.embed_batch_size,
+            concurrency=self.embed_concurrency,
+            on_progress=on_progress
+        )
+    
+    def _generate_queries_cached(self, entity_name, num_queries, language='en', mode='complex'):
+        """Fan-out through the shared cache; returns (enriched_queries, reasoning, cache_hit)
+        
+        The cache holds the raw query strings, so enrichment always reflects the current rules.
+        """
+        def compute():
+            queries, reasoning = self._generate_queries(entity_name, num_queries)
+            if not queries:
+                return None  # Never cache failures
+            return {'query_strings': [q['query'] for q in queries], 'reasoning': reasoning}
+        
+        cached, hit = get_fanout_cache().get_or_compute(entity_name, language, mode, compute)
+        if not cached:
+            return [], "Fallback failed", False
+        if hit:
+            print(f'[RankSimulator] ♻️ Reusing cached fan-out for "{entity_name}" ({language}, {mode})')
+        queries = enrich_queries(cached['query_strings'][:num_queries])
+        return queries, cached['reasoning'], hit
+    
+    def _stage_queries(self, ed, language='en', mode='complex'):
+        """Stage: generate synthetic queries for the extracted entity"""
+        print(f'[RankSimulator] 🎯 MAIN ENTITY: "{ed["entity_name"]}"')
+        print(f'[RankSimulator] Generating synthetic queries for: {ed["entity_name"]}...')
+        num_queries = MIN_QUERIES_COMPLEX if mode == 'complex' else MIN_QUERIES_SIMPLE
+        queries, reasoning, hit = self._generate_queries_cached(ed["entity_name"], num_queries, language, mode)
+        print(f'[RankSimulator] {len(queries)} queries generated')
+        return queries, reasoning, hit
+    
+    def _stage_query_embeddings(self, generated, progress=NULL_PROGRESS):
+        """Stage: embed all non-empty query strings in one batched pass"""
+        query_texts = [q['query'] for q in generated[0] if q.get('query', '')]
+        if not query_texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        query_emb = self._embed(query_texts, lambda done, total: progress.advance('query_emb', done, total))
+        print(f'[RankSimulator] {len(query_texts)} queries encoded')
+        return query_emb
+    
+    def _stage_chunk_dedup(self, url, chunks):
+        """Stage: match chunks against the domain's fingerprints; returns (repeated, is_boilerplate, sources)"""
+        index = get_chunk_index()
+        if index is None or not chunks:
+            return [False] * len(chunks), [False] * len(chunks), [None] * len(chunks)
+        repeated, boilerplate, sources = index.observe(url, chunks)
+        if any(repeated):
+            print(f'[RankSimulator] ♻️ {sum(repeated)} chunks seen before on this domain, {sum(boilerplate)} boilerplate')
+        return repeated, boilerplate, sources
+    
+    def _stage_chunk_embeddings(self, texts, sources, progress=NULL_PROGRESS):
+        """Stage: embed all content chunks in one batched pass; returns (chunk_emb, reused)
+        
+        Near-duplicate chunks (sources[i] set by the dedup stage) take the cached embedding of
+        the chunk first seen with that fingerprint; the rest, and any whose source vector has
+        left the cache, are embedded.
+        """
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32), 0
+        reused = {}
+        wanted = [i for i, source in enumerate(sources) if source]
+        if wanted:
+            vectors = get_embedding_cache().get_by_digests(GEMINI_EMBEDDING_MODEL, 'retrieval_document',
+                                                           [sources[i] for i in wanted])
+            reused = {i: v for i, v in zip(wanted, vectors) if v is not None}
+        embed = [i for i in range(len(texts)) if i not in reused]
+        rows = dict(reused)
+        if embed:
+            fresh = self._embed([texts[i] for i in embed],
+                                lambda done, total: progress.advance('chunk_emb', done, total))
+            rows.update(zip(embed, fresh))
+        chunk_emb = np.vstack([rows[i] for i in range(len(texts))]).astype(np.float32, copy=False)
+        print(f'[RankSimulator] {len(texts)} chunks encoded ({len(reused)} near-duplicate embeddings reused)')
+        return chunk_emb, len(reused)
+    
+    def analyze(self, url, content_data, threshold=0.65, top_k=TOP_K_CHUNKS, language='en', mode='complex',
+                progress=NULL_PROGRESS, spans=None):
+        """Full analysis with enriched queries
+        
+        progress receives stage(name, label) / advance(name, done, total) / finish(name) calls
+        from the stage threads (see progress_events.ProgressReporter). Stage durations are
+        recorded on spans (metrics.StageSpans) when given.
+        """
+        spans = spans or StageSpans()
         print(f'[RankSimulator] Starting analysis for: {url}')
         print(f'[RankSimulator] Title: {content_data["title"]}')
         print(f'[RankSimulator] Content length: {len(content_data["content"])} chars')
         
-        # STEP 1: Extract entity from title and content
-        ed = self._extract_entity(content_data['title'], content_data['content'])
-        print(f'[RankSimulator] 🎯 MAIN ENTITY: "{ed["entity_name"]}"')
+        # Stage graph: the entity -> queries branch and the chunking branch are
+        # independent, so they run concurrently and join at scoring
+        def tracked(name, label, fn):
+            def run(*deps):
+                if label:
+                    progress.stage(name, label)
+                try:
+                    with spans.span(name):
+                        return fn(*deps)
+                finally:
+                    if label:
+                        progress.finish(name)
+            return run
         
-        # STEP 2: Generate synthetic queries based on entity
-        print(f'[RankSimulator] Generating synthetic queries for: {ed["entity_name"]}...')
-        queries, reasoning = self._generate_queries(ed["entity_name"], MIN_QUERIES_COMPLEX)
+        graph = StageGraph()
+        graph.add('entity', tracked('entity', 'Extracting main entity',
+                                    lambda: self._extract_entity(content_data['title'], content_data['content'])))
+        graph.add('queries', tracked('queries', 'Generating synthetic queries',
+                                     lambda ed: self._stage_queries(ed, language, mode)), deps=('entity',))
+        graph.add('query_emb', tracked('query_emb', 'Embedding queries',
+                                       lambda generated: self._stage_query_embeddings(generated, progress)),
+                  deps=('queries',))
+        graph.add('chunks', tracked('chunks', 'Chunking content',
+                                    lambda: semantic_chunk_text_chonkie(content_data['content'])))
+        graph.add('chunk_dedup', tracked('chunk_dedup', None, lambda chunks: self._stage_chunk_dedup(url, chunks)),
+                  deps=('chunks',))
+        graph.add('chunk_emb', tracked('chunk_emb', 'Embedding content chunks',
+                                       lambda chunks, dedup: self._stage_chunk_embeddings(chunks, dedup[2], progress)),
+                  deps=('chunks', 'chunk_dedup'))
+        stages = graph.run()
+        
+        ed = stages['entity']
+        queries, reasoning, fanout_cache_hit = stages['queries']
+        chunks = stages['chunks']
+        chunk_emb, reused_embeddings = stages['chunk_emb']
+        repeated, boilerplate, _ = stages['chunk_dedup']
+        
+        # Optionally score only chunks that are not repeated across the site
+        excluded = 0
+        if CHUNK_DEDUP_EXCLUDE and any(boilerplate) and not all(boilerplate):
+            keep = [i for i, b in enumerate(boilerplate) if not b]
+            excluded = len(chunks) - len(keep)
+            chunks = [chunks[i] for i in keep]
+            chunk_emb = chunk_emb[keep]
+            print(f'[RankSimulator] Excluded {excluded} boilerplate chunks from scoring')
         
         if not queries:
             print('[RankSimulator] No queries generated')
             return {'success': False, 'error': 'No queries generated', 'url': url}
         
-        print(f'[RankSimulator] {len(queries)} queries generated')
-        
-        # STEP 3: Chunk the content with Chonkie semantic chunking
-        print('[RankSimulator] Chunking content with Chonkie...')
-        chunks = semantic_chunk_text_chonkie(content_data['content'], self.gemini_key)
-        print(f'[RankSimulator] Created {len(chunks)} semantic chunks')
+        if not chunks:
+            print('[RankSimulator] No content chunks to score')
+            return {'success': False, 'error': 'No content chunks extracted', 'url': url}
         
-        # Embeddings
-        print('[RankSimulator] Generating embeddings...')
-        chunk_emb = self._embed(chunks)
-        print('[RankSimulator] Chunks encoded')
+        queries = [q for q in queries if q.get('query', '')]
+        query_emb = stages['query_emb']
         
-        # Similarity scoring
+        # Similarity scoring - one matrix multiply for all queries
         print('[RankSimulator] Calculating similarity...')
+        progress.stage('scoring', 'Scoring query coverage')
+        scoring_started = time.perf_counter()
+        top_idx, top_scores = SimilarityEngine(chunk_emb).top_k(query_emb, top_k)
         results = []
         covered = 0
         chunk_usage = {}
         
         for i, query_obj in enumerate(queries, 1):
-            qt = query_obj.get('query', '')
-            if not qt:
-                continue
-            
-            qe = self._embed([qt])[0]
-            sim = np.dot(chunk_emb, qe) / (np.linalg.norm(chunk_emb, axis=1) * np.linalg.norm(qe))
-            ms = float(np.max(sim))
-            bi = int(np.argmax(sim))
+            qt = query_obj['query']
+            ms = float(top_scores[i - 1, 0])
+            bi = int(top_idx[i - 1, 0])
             cov = ms >= threshold
             
             if cov:
@@ -551,6 +1044,7 @@ MAIN TOPIC:"""
                 'max_similarity': round(ms, 4),
                 'best_chunk_idx': bi,
                 'best_chunk': best_chunk_text,  # Always show, even if not covered
+                'top_chunk_idxs': [int(c) for c in top_idx[i - 1]],
                 'covered': cov
             })
             
@@ -565,6 +1059,8 @@ MAIN TOPIC:"""
         unused_chunks = set(range(len(chunks))) - set(chunk_usage.keys())
         
         print(f'[RankSimulator] Score: {score:.2f}% ({covered}/{total})')
+        spans.add('scoring', time.perf_counter() - scoring_started)
+        progress.finish('scoring')
         
         return {
             'success': True,
@@ -574,11 +1070,16 @@ MAIN TOPIC:"""
             'content': {
                 'title': content_data['title'],
                 'word_count': content_data['word_count'],
-                'chunks_count': len(chunks)
+                'chunks_count': len(chunks),
+                'boilerplate_chunks': sum(boilerplate),
+                'repeated_chunks': sum(repeated),
+                'reused_chunk_embeddings': reused_embeddings,
+                'excluded_chunks': excluded
             },
             'query_fanout': {
                 'generated_count': total,
-                'facets_reasoning': reasoning
+                'facets_reasoning': reasoning,
+                'cache_hit': fanout_cache_hit
             },
             'ai_visibility_score': round(score, 2),
             'covered_queries_count': covered,
@@ -593,3 +1094,40 @@ MAIN TOPIC:"""
 def create_colab_analyzer(gemini_key):
     """Factory function to create analyzer"""
     return RankSimulatorAnalyzer(gemini_key)
+
+
+# ============================================================================
+# PROCESS-WIDE REGISTRY
+# ============================================================================
+
+_analyzers = {}
+_registry_lock = threading.Lock()
+
+
+def get_analyzer(gemini_key):
+    """Shared analyzer for this process, built once and reused across jobs"""
+    analyzer = _analyzers.get(gemini_key)
+    if analyzer is None:
+        with _registry_lock:
+            analyzer = _analyzers.get(gemini_key)
+            if analyzer is None:
+                analyzer = create_colab_analyzer(gemini_key)
+                _analyzers[gemini_key] = analyzer
+    return analyzer
+
+
+def warm_up(gemini_key):
+    """Boot hook: build the shared analyzer and models before the first request
+    
+    The SQLite-backed caches are left alone: this may run in the gunicorn master (--preload),
+    and their connections must be opened by each worker after the fork.
+    """
+    print('[RankSimulator] Warming up...')
+    get_analyzer(gemini_key)
+    get_chunk_index()
+    try:
+        with semantic_chunker():
+            pass
+    except Exception as e:
+        print(f'[RankSimulator] Chunker model not loaded at boot: {e}')
+    print('[RankSimulator] Warm-up complete')
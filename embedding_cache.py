@@ -0,0 +1,218 @@
+"""
+Content-addressed embedding cache
+In-process LRU tier in front of a durable SQLite tier, keyed by model, task type and text hash
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import tempfile
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import List, Optional
+import numpy as np
+
+# Constants
+EMBED_CACHE_PATH = os.getenv('EMBED_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'ranksimulator_embeddings.sqlite3'))
+EMBED_CACHE_MEMORY_ITEMS = int(os.getenv('EMBED_CACHE_MEMORY_ITEMS', '20000'))
+EMBED_CACHE_DISK_ITEMS = int(os.getenv('EMBED_CACHE_DISK_ITEMS', '500000'))
+EMBED_CACHE_TTL_SECONDS = int(os.getenv('EMBED_CACHE_TTL_SECONDS', str(30 * 24 * 3600)))
+EVICTION_CHECK_EVERY = 1000  # Disk eviction runs after this many writes
+
+
+def normalize_text(text: str) -> str:
+    """Unicode-normalize and collapse whitespace so trivial differences share a key"""
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+
+def text_digest(text: str) -> str:
+    """sha256 hex digest of the normalized text, the text part of a cache key"""
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+
+def cache_key(model: str, task_type: str, text: str) -> str:
+    """Stable key for (model, task type, normalized text)"""
+    return f'{model}|{task_type}|{text_digest(text)}'
+
+
+class EmbeddingCache:
+    """Two-tier embedding cache with LRU/TTL eviction and hit-rate counters"""
+
+    def __init__(self, path=EMBED_CACHE_PATH, max_memory_items=EMBED_CACHE_MEMORY_ITEMS,
+                 max_disk_items=EMBED_CACHE_DISK_ITEMS, ttl_seconds=EMBED_CACHE_TTL_SECONDS):
+        self.path = path
+        self.max_memory_items = max_memory_items
+        self.max_disk_items = max_disk_items
+        self.ttl_seconds = ttl_seconds
+        self._memory = OrderedDict()  # key -> (created_at, vector)
+        self._lock = threading.Lock()
+        self._writes_since_eviction = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._conn = None
+
+        if path:
+            try:
+                self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+                self._conn.execute('PRAGMA journal_mode=WAL')
+                self._conn.execute('PRAGMA synchronous=NORMAL')
+                self._conn.execute(
+                    'CREATE TABLE IF NOT EXISTS embeddings ('
+                    ' key TEXT PRIMARY KEY,'
+                    ' vector BLOB NOT NULL,'
+                    ' created_at REAL NOT NULL,'
+                    ' accessed_at REAL NOT NULL)'
+                )
+                self._conn.execute('CREATE INDEX IF NOT EXISTS idx_embeddings_accessed ON embeddings (accessed_at)')
+                print(f'[EmbeddingCache] Durable tier at {path}')
+            except Exception as e:
+                print(f'[EmbeddingCache] SQLite tier disabled: {e}')
+                self._conn = None
+
+    def _expired(self, created_at, now):
+        return self.ttl_seconds > 0 and now - created_at > self.ttl_seconds
+
+    def _remember(self, key, created_at, vector):
+        """Insert into the LRU tier, evicting the least recently used entries"""
+        self._memory[key] = (created_at, vector)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def get_many(self, model: str, task_type: str, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Look up texts; returns a vector or None per text, in input order"""
+        return self._get_keys([cache_key(model, task_type, t) for t in texts])
+
+    def get_by_digests(self, model: str, task_type: str, digests: List[str]) -> List[Optional[np.ndarray]]:
+        """Look up by text_digest() when only the digest of a text is known"""
+        return self._get_keys([f'{model}|{task_type}|{d}' for d in digests])
+
+    def _get_keys(self, keys):
+        now = time.time()
+        found = {}
+
+        with self._lock:
+            disk_lookup = []
+            for key in keys:
+                entry = self._memory.get(key)
+                if entry is not None and not self._expired(entry[0], now):
+                    self._memory.move_to_end(key)
+                    found[key] = entry[1]
+                elif entry is not None:
+                    del self._memory[key]
+                    disk_lookup.append(key)
+                else:
+                    disk_lookup.append(key)
+
+            if disk_lookup and self._conn is not None:
+                unique = list(dict.fromkeys(disk_lookup))
+                try:
+                    for i in range(0, len(unique), 500):  # Stay under SQLite's variable limit
+                        batch = unique[i:i + 500]
+                        rows = self._conn.execute(
+                            f'SELECT key, vector, created_at FROM embeddings WHERE key IN ({",".join("?" * len(batch))})',
+                            batch
+                        ).fetchall()
+                        for key, blob, created_at in rows:
+                            if self._expired(created_at, now):
+                                continue
+                            vector = np.frombuffer(blob, dtype=np.float32)
+                            found[key] = vector
+                            self._remember(key, created_at, vector)
+                    hit_keys = [k for k in unique if k in found]
+                    if hit_keys:
+                        self._conn.executemany(
+                            'UPDATE embeddings SET accessed_at = ? WHERE key = ?',
+                            [(now, k) for k in hit_keys]
+                        )
+                except Exception as e:
+                    print(f'[EmbeddingCache] Disk lookup failed: {e}')
+
+            disk_keys = set(disk_lookup)
+            results = []
+            for key in keys:
+                vector = found.get(key)
+                if vector is None:
+                    self.misses += 1
+                elif key in disk_keys:
+                    self.disk_hits += 1
+                else:
+                    self.memory_hits += 1
+                results.append(vector)
+
+        return results
+
+    def put_many(self, model: str, task_type: str, texts: List[str], vectors) -> None:
+        """Store vectors for texts in both tiers"""
+        now = time.time()
+        rows = []
+
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                key = cache_key(model, task_type, text)
+                vector = np.asarray(vector, dtype=np.float32)
+                self._remember(key, now, vector)
+                rows.append((key, vector.tobytes(), now, now))
+
+            if self._conn is None or not rows:
+                return
+
+            try:
+                self._conn.executemany(
+                    'INSERT OR REPLACE INTO embeddings (key, vector, created_at, accessed_at) VALUES (?, ?, ?, ?)',
+                    rows
+                )
+                self._writes_since_eviction += len(rows)
+                if self._writes_since_eviction >= EVICTION_CHECK_EVERY:
+                    self._writes_since_eviction = 0
+                    self._evict_disk(now)
+            except Exception as e:
+                print(f'[EmbeddingCache] Disk write failed: {e}')
+
+    def _evict_disk(self, now):
+        """Drop expired rows, then least recently used rows above the size cap (lock held)"""
+        if self.ttl_seconds > 0:
+            self._conn.execute('DELETE FROM embeddings WHERE created_at < ?', (now - self.ttl_seconds,))
+        count = self._conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+        overflow = count - self.max_disk_items
+        if overflow > 0:
+            self._conn.execute(
+                'DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY accessed_at LIMIT ?)',
+                (overflow,)
+            )
+            print(f'[EmbeddingCache] Evicted {overflow} entries from disk tier')
+
+    def stats(self) -> dict:
+        """Hit-rate counters and tier sizes"""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                'memory_items': len(self._memory),
+                'durable': self._conn is not None
+            }
+
+
+_shared_cache = None
+_shared_cache_pid = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Process-wide cache instance, created on first use in each process
+    
+    The SQLite connection must not cross fork(), so each process (gunicorn worker) opens its own.
+    """
+    global _shared_cache, _shared_cache_pid
+    if _shared_cache is None or _shared_cache_pid != os.getpid():
+        with _shared_cache_lock:
+            if _shared_cache is None or _shared_cache_pid != os.getpid():
+                _shared_cache = EmbeddingCache()
+                _shared_cache_pid = os.getpid()
+    return _shared_cache
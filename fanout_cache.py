@@ -0,0 +1,173 @@
+"""
+Query fan-out result cache
+Keyed by normalized entity, language, mode and a date bucket; stores the pre-enrichment
+query strings and the facets reasoning so enrichment rules can change without invalidation
+"""
+
+import os
+import json
+import time
+import sqlite3
+import datetime
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+
+# Constants
+FANOUT_CACHE_PATH = os.getenv('FANOUT_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'ranksimulator_fanout.sqlite3'))
+FANOUT_CACHE_BUCKET_DAYS = int(os.getenv('FANOUT_CACHE_BUCKET_DAYS', '7'))
+FANOUT_CACHE_MEMORY_ITEMS = int(os.getenv('FANOUT_CACHE_MEMORY_ITEMS', '2000'))
+
+
+def date_bucket(today: Optional[datetime.date] = None, days: int = FANOUT_CACHE_BUCKET_DAYS) -> str:
+    """First day of the bucket containing today; results are only reused within one bucket"""
+    today = today or datetime.date.today()
+    days = max(1, days)
+    start = datetime.date.fromordinal(today.toordinal() - (today.toordinal() % days))
+    return start.isoformat()
+
+
+def fanout_key(entity: str, language: str, mode: str, bucket: str) -> str:
+    entity = ' '.join(entity.split()).casefold()
+    return f'{entity}|{language.lower()}|{mode}|{bucket}'
+
+
+class FanoutCache:
+    """LRU + SQLite cache of fan-out results with per-key single-flight"""
+
+    def __init__(self, path=FANOUT_CACHE_PATH, max_memory_items=FANOUT_CACHE_MEMORY_ITEMS,
+                 bucket_days=FANOUT_CACHE_BUCKET_DAYS):
+        self.bucket_days = bucket_days
+        self.max_memory_items = max_memory_items
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight = {}  # key -> Lock held while one thread generates
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+
+        if path:
+            try:
+                self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+                self._conn.execute('PRAGMA journal_mode=WAL')
+                self._conn.execute(
+                    'CREATE TABLE IF NOT EXISTS fanout ('
+                    ' key TEXT PRIMARY KEY,'
+                    ' bucket TEXT NOT NULL,'
+                    ' value TEXT NOT NULL,'
+                    ' created_at REAL NOT NULL)'
+                )
+                self._conn.execute('CREATE INDEX IF NOT EXISTS idx_fanout_bucket ON fanout (bucket)')
+            except Exception as e:
+                print(f'[FanoutCache] SQLite tier disabled: {e}')
+                self._conn = None
+
+    def _key(self, entity, language, mode):
+        bucket = date_bucket(days=self.bucket_days)
+        return fanout_key(entity, language, mode, bucket), bucket
+
+    def _get(self, key):
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                return value
+            if self._conn is None:
+                return None
+            try:
+                row = self._conn.execute('SELECT value FROM fanout WHERE key = ?', (key,)).fetchone()
+            except Exception as e:
+                print(f'[FanoutCache] Lookup failed: {e}')
+                return None
+            if row is None:
+                return None
+            value = json.loads(row[0])
+            self._remember(key, value)
+            return value
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _put(self, key, bucket, value):
+        with self._lock:
+            self._remember(key, value)
+            if self._conn is None:
+                return
+            try:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO fanout (key, bucket, value, created_at) VALUES (?, ?, ?, ?)',
+                    (key, bucket, json.dumps(value), time.time())
+                )
+                # Older buckets can never be hit again
+                self._conn.execute('DELETE FROM fanout WHERE bucket < ?', (bucket,))
+            except Exception as e:
+                print(f'[FanoutCache] Write failed: {e}')
+
+    def get_or_compute(self, entity: str, language: str, mode: str,
+                       compute: Callable[[], Optional[dict]]) -> Tuple[Optional[dict], bool]:
+        """Cached value or compute(); concurrent callers for the same key wait for one computation
+
+        compute() returns {'query_strings': [...], 'reasoning': str} or None (not cached).
+        Returns (value, was_cache_hit).
+        """
+        key, bucket = self._key(entity, language, mode)
+        value = self._get(key)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+            return value, True
+
+        with self._lock:
+            gate = self._inflight.setdefault(key, threading.Lock())
+
+        with gate:
+            value = self._get(key)  # Another thread may have filled it meanwhile
+            if value is not None:
+                with self._lock:
+                    self.hits += 1
+                return value, True
+
+            with self._lock:
+                self.misses += 1
+            try:
+                value = compute()
+                if value is not None:
+                    self._put(key, bucket, value)
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+            return value, False
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'memory_items': len(self._memory),
+                'durable': self._conn is not None
+            }
+
+
+_shared_cache = None
+_shared_cache_pid = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_fanout_cache() -> FanoutCache:
+    """Process-wide fan-out cache, created on first use in each process
+    
+    The SQLite connection must not cross fork(), so each process (gunicorn worker) opens its own.
+    """
+    global _shared_cache, _shared_cache_pid
+    if _shared_cache is None or _shared_cache_pid != os.getpid():
+        with _shared_cache_lock:
+            if _shared_cache is None or _shared_cache_pid != os.getpid():
+                _shared_cache = FanoutCache()
+                _shared_cache_pid = os.getpid()
+    return _shared_cache
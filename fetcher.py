@@ -0,0 +1,186 @@
+"""
+Pooled page fetcher
+One shared keep-alive session for all worker threads, with global/per-host concurrency limits
+and a single overall deadline per URL instead of stacked per-attempt timeouts
+"""
+
+import os
+import time
+import threading
+from typing import Callable, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+
+# Constants
+FETCH_DEADLINE_SECONDS = float(os.getenv('FETCH_DEADLINE_SECONDS', '45'))
+FETCH_CONNECT_TIMEOUT = float(os.getenv('FETCH_CONNECT_TIMEOUT', '10'))
+FETCH_MAX_ATTEMPTS = int(os.getenv('FETCH_MAX_ATTEMPTS', '3'))
+FETCH_MAX_CONCURRENCY = int(os.getenv('FETCH_MAX_CONCURRENCY', '16'))
+FETCH_PER_HOST_CONCURRENCY = int(os.getenv('FETCH_PER_HOST_CONCURRENCY', '4'))
+FETCH_MAX_BYTES = int(os.getenv('FETCH_MAX_BYTES', str(10 * 1024 * 1024)))
+FETCH_POOL_HOSTS = 100  # Number of per-host connection pools kept alive
+READ_CHUNK_BYTES = 64 * 1024
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+
+class FetchError(Exception):
+    """Fetch failure; kind is 'timeout', 'connection', 'http', 'content_type' or 'other'"""
+
+    def __init__(self, kind, message, attempts=1, status_code=None):
+        super().__init__(message)
+        self.kind = kind
+        self.attempts = attempts
+        self.status_code = status_code
+
+
+class PageFetcher:
+    """Thread-safe fetcher sharing one pooled session across jobs"""
+
+    def __init__(self, max_concurrency=FETCH_MAX_CONCURRENCY, per_host_concurrency=FETCH_PER_HOST_CONCURRENCY,
+                 deadline_seconds=FETCH_DEADLINE_SECONDS, max_attempts=FETCH_MAX_ATTEMPTS):
+        self.deadline_seconds = deadline_seconds
+        self.max_attempts = max(1, max_attempts)
+        self.per_host_concurrency = max(1, per_host_concurrency)
+
+        # Keep-alive pools, one per host, sized to the per-host limit
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=FETCH_POOL_HOSTS, pool_maxsize=self.per_host_concurrency,
+                              max_retries=0, pool_block=False)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'User-Agent': USER_AGENT, 'Connection': 'keep-alive'})
+
+        self._global_slots = threading.BoundedSemaphore(max(1, max_concurrency))
+        self._host_slots = {}
+        self._host_lock = threading.Lock()
+
+    def _slots_for(self, host):
+        with self._host_lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.per_host_concurrency)
+            return self._host_slots[host]
+
+    @staticmethod
+    def _acquire(slot, deadline):
+        if not slot.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            raise FetchError('timeout', 'Timed out waiting for a free connection slot')
+
+    def fetch(self, url: str, deadline_seconds: Optional[float] = None, headers: Optional[Dict] = None,
+              max_bytes: Optional[int] = FETCH_MAX_BYTES, allowed_types: Optional[Tuple[str, ...]] = None,
+              sink_factory: Optional[Callable] = None) -> Dict:
+        """GET url within one overall deadline, retrying timeouts/connection errors while time remains
+
+        The body is streamed and cut off after max_bytes (truncated=True). If allowed_types is
+        given, other Content-Types are rejected before the body is read. With sink_factory, each
+        attempt calls sink_factory(response_headers) and feeds body chunks to the returned object's
+        feed() instead of buffering them; its close() result is returned as 'sink_result', and a
+        sink whose 'full' attribute turns true stops the download early.
+
+        Returns a dict with url, final_url, status_code, headers, content, truncated, bytes_read
+        and elapsed (a 304 response has empty content); raises FetchError on failure.
+        """
+        started = time.monotonic()
+        deadline = started + (deadline_seconds or self.deadline_seconds)
+        host = urlsplit(url).netloc.lower()
+        host_slot = self._slots_for(host)
+        attempt = 0
+        last_error = None
+
+        while attempt < self.max_attempts:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            attempt += 1
+            print(f"[Fetcher] Attempt {attempt}/{self.max_attempts} for {url} ({remaining:.0f}s left)")
+
+            self._acquire(self._global_slots, deadline)
+            try:
+                self._acquire(host_slot, deadline)
+                try:
+                    return self._get(url, deadline, started, headers, max_bytes, allowed_types, sink_factory)
+                finally:
+                    host_slot.release()
+            except requests.exceptions.Timeout as e:
+                last_error = FetchError('timeout', str(e), attempt)
+            except requests.exceptions.ConnectionError as e:
+                last_error = FetchError('connection', str(e), attempt)
+            except requests.exceptions.HTTPError as e:
+                # Don't retry on HTTP errors (404, 500, etc.)
+                raise FetchError('http', str(e), attempt, e.response.status_code)
+            except FetchError as e:
+                e.attempts = attempt
+                if e.kind == 'content_type':
+                    raise
+                last_error = e
+            except Exception as e:
+                raise FetchError('other', str(e), attempt)
+            finally:
+                self._global_slots.release()
+
+            # Short backoff, never past the deadline
+            time.sleep(min(0.5 * attempt, max(0.0, deadline - time.monotonic())))
+
+        if last_error is None:
+            last_error = FetchError('timeout', 'Deadline exceeded before first attempt', attempt)
+        raise last_error
+
+    def _get(self, url, deadline, started, headers=None, max_bytes=None, allowed_types=None, sink_factory=None):
+        """Single attempt; every socket wait is capped by the remaining deadline"""
+        remaining = max(0.1, deadline - time.monotonic())
+        r = self.session.get(url, timeout=(min(FETCH_CONNECT_TIMEOUT, remaining), remaining),
+                             allow_redirects=True, stream=True, headers=headers)
+        try:
+            r.raise_for_status()
+            content_type = r.headers.get('Content-Type', '')
+            media_type = content_type.split(';')[0].strip().lower()
+            if allowed_types and media_type and r.status_code != 304 and media_type not in allowed_types:
+                raise FetchError('content_type', f'Unsupported content type {media_type}')
+            
+            sink = sink_factory(r.headers) if sink_factory else None
+            body = bytearray()
+            bytes_read = 0
+            truncated = False
+            for block in r.iter_content(READ_CHUNK_BYTES):
+                if max_bytes and bytes_read + len(block) > max_bytes:
+                    block = block[:max_bytes - bytes_read]
+                    truncated = True
+                bytes_read += len(block)
+                if sink is not None:
+                    sink.feed(block)
+                    truncated = truncated or getattr(sink, 'full', False)
+                else:
+                    body.extend(block)
+                if truncated:
+                    print(f"[Fetcher] Truncated {url} after {bytes_read} bytes")
+                    break
+                if time.monotonic() > deadline:
+                    raise FetchError('timeout', 'Deadline exceeded while reading body')
+            return {
+                'url': url,
+                'final_url': r.url,
+                'status_code': r.status_code,
+                'headers': dict(r.headers),
+                'encoding': r.encoding,
+                'content': bytes(body),
+                'sink_result': sink.close() if sink is not None else None,
+                'truncated': truncated,
+                'bytes_read': bytes_read,
+                'elapsed': round(time.monotonic() - started, 3)
+            }
+        finally:
+            r.close()  # Returns the connection to the pool (or drops it if the body was cut short)
+
+
+_shared_fetcher = None
+_shared_fetcher_lock = threading.Lock()
+
+
+def get_fetcher() -> PageFetcher:
+    """Process-wide fetcher, created on first use"""
+    global _shared_fetcher
+    if _shared_fetcher is None:
+        with _shared_fetcher_lock:
+            if _shared_fetcher is None:
+                _shared_fetcher = PageFetcher()
+    return _shared_fetcher
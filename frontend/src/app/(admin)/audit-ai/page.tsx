@@ -36,6 +36,25 @@ export default function AuditAIPage() {
       // Start analysis
       const { job_id } = await api.startAnalysis(url);
       
+      // Follow the progress stream; fall back to polling if it is unavailable or ends early
+      let finished = false;
+      const handleEvent = (event: string, data: any) => {
+        if (event === 'status' && data.progress) {
+          setProgress(data.progress);
+        } else if (event === 'partial' && data.stage === 'analysis') {
+          setProgress(`Score ${data.ai_visibility_score}% - generating recommendations...`);
+        } else if (event === 'completed') {
+          finished = true;
+          setResult(data.result);
+          setProgress("Analysis completed!");
+          setLoading(false);
+        } else if (event === 'error' || event === 'deleted') {
+          finished = true;
+          setError(data.error || 'Analysis failed');
+          setLoading(false);
+        }
+      };
+
       // Poll for results
       const pollStatus = async () => {
         try {
@@ -50,7 +69,7 @@ export default function AuditAIPage() {
             setResult(data.result);
             setProgress("Analysis completed!");
             setLoading(false);
-          } else if (data.status === 'error') {
+          } else if (data.status === 'error' || data.status === 'deleted') {
             setError(data.error || 'Analysis failed');
             setLoading(false);
           } else {
@@ -64,7 +83,11 @@ export default function AuditAIPage() {
         }
       };
       
-      pollStatus();
+      api.streamStatus(job_id, handleEvent)
+        .catch(() => undefined)
+        .then(() => {
+          if (!finished) pollStatus();
+        });
     } catch (err) {
       setError(err instanceof Error ? err.message : 'Failed to start analysis');
       setLoading(false);
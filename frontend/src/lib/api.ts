@@ -110,6 +110,48 @@ class APIService {
     return this.request(`/api/status/${jobId}`);
   }
 
+  // Server-sent progress events for a job; resolves when the stream ends.
+  // Uses fetch instead of EventSource so the Authorization header can be sent.
+  async streamStatus(
+    jobId: string,
+    onEvent: (event: string, data: Record<string, unknown>) => void,
+    signal?: AbortSignal
+  ) {
+    const token = this.getToken();
+    const response = await fetch(`${API_URL}/api/status/${jobId}/stream`, {
+      headers: token ? { Authorization: `Bearer ${token}` } : {},
+      signal,
+    });
+
+    if (!response.ok || !response.body) {
+      throw new Error(`HTTP ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      let boundary;
+      while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+        const frame = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+
+        let event = 'message';
+        let data = '';
+        for (const line of frame.split('\n')) {
+          if (line.startsWith('event: ')) event = line.slice(7);
+          else if (line.startsWith('data: ')) data += line.slice(6);
+        }
+        if (data) onEvent(event, JSON.parse(data));
+      }
+    }
+  }
+
   async getHistory(page = 1, perPage = 10) {
     return this.request(`/api/history?page=${page}&per_page=${perPage}`);
   }
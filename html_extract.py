@@ -0,0 +1,379 @@
+"""
+Streaming HTML text extraction
+Feeds bytes into lxml's parser-target (SAX-style) API: no document tree is built, unwanted
+subtrees are skipped as they stream past and normalized words are collected incrementally
+
+In 'main' mode text is grouped into blocks and only the main content is kept: blocks are
+scored on length, link density and position (inside <article>/<main>, or under a
+cookie/menu/sidebar-like class or id), similar to jusText/Readability heuristics
+"""
+
+import os
+import re
+import time
+from typing import Iterable, Optional, Tuple
+from lxml import etree
+from bs4 import BeautifulSoup
+
+# Constants
+SKIP_TAGS = frozenset(['script', 'style', 'noscript', 'iframe', 'svg', 'nav', 'footer', 'aside'])
+FEED_CHUNK_BYTES = 64 * 1024
+MAX_TEXT_CHARS = int(os.getenv('MAX_TEXT_CHARS', '1000000'))  # Bound on extracted text passed to chunking
+HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
+BLOCK_TAGS = frozenset([
+    'p', 'div', 'section', 'article', 'main', 'header', 'li', 'ul', 'ol', 'dl', 'dt', 'dd',
+    'table', 'tr', 'td', 'th', 'blockquote', 'pre', 'figure', 'figcaption', 'form', 'br',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6'
+])
+HEADING_TAGS = frozenset(['h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
+LIST_ITEM_TAGS = frozenset(['li', 'dt', 'dd'])
+MAIN_TAGS = frozenset(['article', 'main'])
+BOILERPLATE_TAGS = frozenset(['header', 'form', 'button', 'select'])
+BOILERPLATE_ROLES = frozenset(['navigation', 'banner', 'contentinfo', 'complementary', 'search', 'dialog', 'menu'])
+BOILERPLATE_RE = re.compile(
+    r'cookie|consent|gdpr|banner|menu|navbar|breadcrumb|sidebar|widget|related|recommend|'
+    r'share|social|newsletter|subscribe|signup|promo|advert|sponsor|popup|modal|comment|footer|masthead',
+    re.IGNORECASE
+)
+MAIN_HINT_RE = re.compile(r'article|post-?(body|content)|entry-?content|main-?content|story', re.IGNORECASE)
+GOOD_BLOCK_CHARS = 80  # Blocks at least this long (with low link density) are content
+MAX_LINK_DENSITY = 0.33
+BAD_LINK_DENSITY = 0.5  # Above this a block is navigation whatever its length
+MIN_MAIN_CHARS = 200  # Below this the page is treated as having no detectable main content
+MIN_RUN_ITEMS = 2  # List items / headings in a run of short blocks for the run to count as content (lists, FAQs)
+MIN_RUN_CHARS = 30
+META_CHARSET_RE = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([a-zA-Z0-9_\-]+)', re.IGNORECASE)
+HEADER_CHARSET_RE = re.compile(r'charset\s*=\s*["\']?([a-zA-Z0-9_\-]+)', re.IGNORECASE)
+
+
+class _TextCollector:
+    """lxml parser target: receives start/end/data events in document order"""
+
+    def __init__(self, max_chars=None):
+        self.max_chars = max_chars
+        self.chars = 0  # Length of ' '.join(words)
+        self.full = False
+        self.words = []
+        self.title = None
+        self._buffer = []  # Text of the current text node, possibly split across data() calls
+        self._skip_depth = 0
+        self._in_title = False
+        self._title_parts = []
+
+    def _flush(self):
+        if self._buffer:
+            text = ''.join(self._buffer)
+            self._buffer = []
+            if self._in_title:
+                self._title_parts.append(text)
+            if self.full:
+                return
+            for word in text.split():
+                added = len(word) + (1 if self.words else 0)
+                if self.max_chars and self.chars + added > self.max_chars:
+                    self.full = True
+                    return
+                self.words.append(word)
+                self.chars += added
+
+    def start(self, tag, attrib):
+        self._flush()
+        tag = tag.lower() if isinstance(tag, str) else ''
+        if self._skip_depth or tag in SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag == 'title' and self.title is None:
+            self._in_title = True
+
+    def end(self, tag):
+        if self._skip_depth:
+            self._buffer = []
+            self._skip_depth -= 1
+            return
+        self._flush()
+        if self._in_title:
+            self._in_title = False
+            self.title = ''.join(self._title_parts).strip()
+
+    def data(self, text):
+        if not self._skip_depth and (not self.full or self._in_title):
+            self._buffer.append(text)
+
+    def comment(self, text):
+        pass
+
+    def close(self):
+        self._flush()
+        return self
+
+
+class _Block:
+    __slots__ = ('words', 'chars', 'link_chars', 'heading', 'list_item', 'in_main', 'boilerplate', 'good')
+
+    def __init__(self, heading, list_item, in_main, boilerplate):
+        self.words = []
+        self.chars = 0
+        self.link_chars = 0
+        self.heading = heading
+        self.list_item = list_item
+        self.in_main = in_main
+        self.boilerplate = boilerplate
+        self.good = False
+
+
+class _BlockCollector(_TextCollector):
+    """Parser target for main-content mode: words are grouped into blocks with link and position features"""
+
+    def __init__(self, max_chars=None):
+        super().__init__(max_chars)
+        self.blocks = []
+        self._stack = []  # (tag, is_main, is_boilerplate) per open non-skipped element
+        self._main_depth = 0
+        self._boilerplate_depth = 0
+        self._heading_depth = 0
+        self._list_depth = 0
+        self._link_depth = 0
+        self._block = None
+        self._title_chars = 0
+
+    def _open_block(self):
+        self._flush()
+        self._block = None
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        text = ''.join(self._buffer)
+        self._buffer = []
+        if self._in_title:
+            self._title_parts.append(text)
+        if self.full:
+            return
+        for word in text.split():
+            added = len(word) + (1 if self.words else 0)
+            if self.max_chars and self.chars + added > self.max_chars:
+                self.full = True
+                return
+            self.words.append(word)
+            self.chars += added
+            if self._in_title:
+                self._title_chars += added
+                continue  # Kept for the full-text fallback, never part of a block
+            if self._block is None:
+                self._block = _Block(self._heading_depth > 0, self._list_depth > 0,
+                                     self._main_depth > 0, self._boilerplate_depth > 0)
+                self.blocks.append(self._block)
+            self._block.words.append(word)
+            self._block.chars += len(word)
+            if self._link_depth:
+                self._block.link_chars += len(word)
+
+    def start(self, tag, attrib):
+        self._flush()
+        tag = tag.lower() if isinstance(tag, str) else ''
+        if self._skip_depth or tag in SKIP_TAGS:
+            self._skip_depth += 1
+            return
+        if tag == 'title' and self.title is None:
+            self._in_title = True
+            return
+
+        hints = f"{attrib.get('class', '')} {attrib.get('id', '')}"
+        is_main = tag in MAIN_TAGS or bool(MAIN_HINT_RE.search(hints))
+        is_boilerplate = (
+            tag in BOILERPLATE_TAGS
+            or attrib.get('role', '').lower() in BOILERPLATE_ROLES
+            or (not is_main and bool(BOILERPLATE_RE.search(hints)))
+        )
+        self._stack.append((tag, is_main, is_boilerplate))
+        self._main_depth += is_main
+        self._boilerplate_depth += is_boilerplate
+        if tag in HEADING_TAGS:
+            self._heading_depth += 1
+        elif tag in LIST_ITEM_TAGS:
+            self._list_depth += 1
+        elif tag == 'a':
+            self._link_depth += 1
+        if tag in BLOCK_TAGS:
+            self._open_block()
+
+    def end(self, tag):
+        if self._skip_depth:
+            self._buffer = []
+            self._skip_depth -= 1
+            return
+        self._flush()
+        if self._in_title:
+            self._in_title = False
+            self.title = ''.join(self._title_parts).strip()
+            return
+        if not self._stack:
+            return
+        tag, is_main, is_boilerplate = self._stack.pop()
+        self._main_depth -= is_main
+        self._boilerplate_depth -= is_boilerplate
+        if tag in HEADING_TAGS:
+            self._heading_depth -= 1
+        elif tag in LIST_ITEM_TAGS:
+            self._list_depth -= 1
+        elif tag == 'a':
+            self._link_depth -= 1
+        if tag in BLOCK_TAGS:
+            self._block = None
+
+    @staticmethod
+    def _mark_runs(blocks):
+        """Mark runs of short list items and headings as content when they add up (lists, FAQs)
+
+        A run is a sequence of short non-boilerplate blocks with low link density (menus fail the
+        density test); it is content when it has MIN_RUN_ITEMS list items or headings and
+        MIN_RUN_CHARS in total.
+        """
+        run = []
+        for block in blocks + [None]:
+            if block is not None and not block.chars:
+                continue
+            if (block is not None and not block.good and not block.boilerplate
+                    and block.link_chars <= block.chars * MAX_LINK_DENSITY):
+                run.append(block)
+                continue
+            items = sum(1 for b in run if b.list_item or b.heading)
+            if items >= MIN_RUN_ITEMS and sum(b.chars for b in run) >= MIN_RUN_CHARS:
+                for b in run:
+                    b.good = True
+            run = []
+
+    def main_content(self) -> Tuple[str, dict]:
+        """Classify blocks and join the kept ones; returns (text, stats)"""
+        blocks = self.blocks
+        for block in blocks:
+            density = block.link_chars / block.chars if block.chars else 1.0
+            block.good = (not block.boilerplate and density <= MAX_LINK_DENSITY
+                          and block.chars >= GOOD_BLOCK_CHARS)
+        self._mark_runs(blocks)
+
+        # Prefer <article>/<main> when it holds most of the good text
+        good_chars = sum(b.chars for b in blocks if b.good)
+        main_chars = sum(b.chars for b in blocks if b.good and b.in_main)
+        restrict = main_chars >= MIN_MAIN_CHARS and main_chars * 2 >= good_chars
+
+        # Short blocks and headings survive when they sit between content blocks (jusText context rule)
+        candidates = [b for b in blocks if b.in_main] if restrict else blocks
+        kept = []
+        for i, block in enumerate(candidates):
+            keep = block.good
+            if not keep and not block.boilerplate:
+                density = block.link_chars / block.chars if block.chars else 1.0
+                if density <= BAD_LINK_DENSITY:
+                    after = next((b.good for b in candidates[i + 1:] if b.chars), False)
+                    before = next((b.good for b in reversed(candidates[:i]) if b.chars), False)
+                    keep = after and (before or block.heading)
+            if keep:
+                kept.append(block)
+
+        total = max(0, self.chars - self._title_chars)  # Body text only; the title is not content to keep or remove
+        text = ' '.join(word for block in kept for word in block.words)
+        fallback = len(text) < MIN_MAIN_CHARS
+        if fallback:
+            text = ' '.join(self.words)
+        chars_kept = total if fallback else len(text)
+        return text, {
+            'chars_total': total,
+            'chars_kept': chars_kept,
+            'chars_removed': total - chars_kept,
+            'removed_ratio': round((total - chars_kept) / total, 4) if total else 0.0,
+            'blocks_total': len(blocks),
+            'blocks_kept': len(blocks) if fallback else len(kept),
+            'fallback': fallback
+        }
+
+
+def detect_encoding(content_type: Optional[str], head: bytes) -> str:
+    """Charset from the Content-Type header, else a <meta> charset in the first bytes, else UTF-8"""
+    if content_type:
+        match = HEADER_CHARSET_RE.search(content_type)
+        if match:
+            return match.group(1)
+    match = META_CHARSET_RE.search(head[:4096])
+    if match:
+        return match.group(1).decode('ascii')
+    return 'utf-8'
+
+
+class StreamingExtractor:
+    """Incremental extractor: feed() raw HTML bytes as they arrive, close() -> (title, text)
+    
+    The encoding is resolved on the first chunk. Once max_chars of text have been
+    collected, full turns true and the caller can stop reading the body.
+    With main_content=True only the main-content blocks are returned and close()
+    fills in main_content_stats. parse_seconds is the time spent inside feed()/close().
+    """
+    
+    def __init__(self, content_type: Optional[str] = None, encoding: Optional[str] = None,
+                 max_chars: Optional[int] = MAX_TEXT_CHARS, main_content: bool = False):
+        self.content_type = content_type
+        self.encoding = encoding
+        self.main_content = main_content
+        self.main_content_stats = None
+        self.parse_seconds = 0.0
+        self.collector = _BlockCollector(max_chars) if main_content else _TextCollector(max_chars)
+        self._parser = None
+    
+    @property
+    def full(self):
+        return self.collector.full
+    
+    def feed(self, chunk: bytes):
+        if not chunk:
+            return
+        started = time.perf_counter()
+        if self._parser is None:
+            encoding = self.encoding or detect_encoding(self.content_type, chunk)
+            try:
+                self._parser = etree.HTMLParser(target=self.collector, encoding=encoding, remove_comments=True)
+            except LookupError:
+                self._parser = etree.HTMLParser(target=self.collector, encoding='utf-8', remove_comments=True)
+        self._parser.feed(chunk)
+        self.parse_seconds += time.perf_counter() - started
+    
+    def close(self) -> Tuple[str, str]:
+        started = time.perf_counter()
+        if self._parser is not None:
+            self._parser.close()
+        else:
+            self.collector.close()
+        title = self.collector.title or 'Untitled'
+        if self.main_content:
+            text, self.main_content_stats = self.collector.main_content()
+        else:
+            text = ' '.join(self.collector.words)
+        self.parse_seconds += time.perf_counter() - started
+        return title, text
+
+
+def extract_text_streaming(chunks: Iterable[bytes], encoding: Optional[str] = None,
+                           max_chars: Optional[int] = None, main_content: bool = False) -> Tuple[str, str]:
+    """Stream HTML bytes through lxml; returns (title, normalized_text)"""
+    extractor = StreamingExtractor(encoding=encoding, max_chars=max_chars, main_content=main_content)
+    for chunk in chunks:
+        extractor.feed(chunk)
+        if extractor.full:
+            break
+    return extractor.close()
+
+
+def iter_chunks(content: bytes, size: int = FEED_CHUNK_BYTES):
+    """Slice an in-memory body into feed-sized chunks without copying it"""
+    view = memoryview(content)
+    for i in range(0, len(view), size):
+        yield view[i:i + size].tobytes()
+
+
+def extract_text_soup(content: bytes) -> Tuple[str, str]:
+    """Reference BeautifulSoup path (full tree + decompose + get_text); returns (title, normalized_text)"""
+    s = BeautifulSoup(content, 'lxml')
+    for t in s(list(SKIP_TAGS)):
+        t.decompose()
+    title = s.find('title')
+    title_text = title.get_text(strip=True) if title else 'Untitled'
+    text = s.get_text(separator=' ', strip=True)
+    return title_text, re.sub(r'\s+', ' ', text).strip()
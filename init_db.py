@@ -4,13 +4,14 @@ Database initialization script for Railway deployment
 """
 import os
 from app import app, db
-from models import User
+from models import User, ensure_schema
 
 def init_database():
     """Initialize database and create admin user"""
     with app.app_context():
         print("Creating database tables...")
         db.create_all()
+        ensure_schema()
         print("✅ Database tables created!")
         
         # Check if admin exists
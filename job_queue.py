@@ -0,0 +1,115 @@
+"""
+Bounded job queue with a fixed worker pool
+Replaces one-thread-per-request so bursts queue up (or get rejected) instead of piling up sessions
+"""
+
+import os
+import queue
+import threading
+import time
+
+
+class JobQueue:
+    """Fixed-size thread pool fed by a bounded FIFO queue"""
+
+    def __init__(self, workers=2, max_size=20, name='jobs'):
+        self.workers = max(1, workers)
+        self.max_size = max(1, max_size)
+        self.name = name
+        self._queue = queue.Queue(maxsize=self.max_size)
+        self._lock = threading.Lock()
+        self._room = threading.Condition(self._lock)  # Notified whenever a worker takes a job off the queue
+        self._threads = []
+        self._pid = None
+        self.active = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self._total_wait_seconds = 0.0
+
+    def _ensure_workers(self):
+        """Start workers lazily in the serving process (threads don't survive gunicorn's fork)"""
+        if self._pid == os.getpid() and all(t.is_alive() for t in self._threads):
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._threads = []
+                self._pid = os.getpid()
+            self._threads = [t for t in self._threads if t.is_alive()]
+            for i in range(len(self._threads), self.workers):
+                t = threading.Thread(target=self._worker, name=f'{self.name}-worker-{i}', daemon=True)
+                t.start()
+                self._threads.append(t)
+            print(f'[JobQueue] {self.name}: {len(self._threads)} workers running, capacity {self.max_size}')
+
+    def _worker(self):
+        while True:
+            enqueued_at, fn, args, kwargs = self._queue.get()
+            with self._lock:
+                self.active += 1
+                self._total_wait_seconds += time.time() - enqueued_at
+                self._room.notify_all()
+            try:
+                fn(*args, **kwargs)
+                with self._lock:
+                    self.completed += 1
+            except Exception as e:
+                print(f'[JobQueue] {self.name}: job failed: {e}')
+                with self._lock:
+                    self.failed += 1
+            finally:
+                with self._lock:
+                    self.active -= 1
+                self._queue.task_done()
+
+    def full(self):
+        return self._queue.full()
+
+    def submit(self, fn, *args, **kwargs):
+        """Enqueue fn(*args, **kwargs); returns False when the queue is full"""
+        self._ensure_workers()
+        try:
+            self._queue.put_nowait((time.time(), fn, args, kwargs))
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            return False
+        with self._lock:
+            self.submitted += 1
+        return True
+
+    def submit_when_room(self, fn, *args, reserve=0, **kwargs):
+        """Enqueue fn(*args, **kwargs), blocking until fewer than max_size - reserve jobs wait
+
+        reserve keeps slots free for submit() callers that must not block.
+        """
+        self._ensure_workers()
+        limit = max(1, self.max_size - reserve)
+        with self._room:
+            while True:
+                while self._queue.qsize() >= limit:
+                    self._room.wait()
+                try:
+                    self._queue.put_nowait((time.time(), fn, args, kwargs))
+                except queue.Full:  # Filled by submit() meanwhile
+                    self._room.wait()
+                    continue
+                self.submitted += 1
+                return
+
+    def stats(self):
+        """Queue-depth and throughput counters"""
+        with self._lock:
+            started = self.completed + self.failed + self.active
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_size': self.max_size,
+                'workers': self.workers,
+                'active': self.active,
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+                'completed': self.completed,
+                'failed': self.failed,
+                'avg_wait_seconds': round(self._total_wait_seconds / started, 3) if started else 0.0
+            }
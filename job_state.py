@@ -0,0 +1,76 @@
+"""
+In-memory job status cache
+Written through by the job runner after every AnalysisJob commit, so status reads for jobs
+running in this process never touch the database
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+# Constants
+JOB_STATE_CACHE_ITEMS = int(os.getenv('JOB_STATE_CACHE_ITEMS', '1000'))
+JOB_STATE_REMOTE_TTL = float(os.getenv('JOB_STATE_REMOTE_TTL', '2'))  # Seconds to trust a DB read of a running job
+FINAL_STATUSES = ('completed', 'error')
+
+
+class JobStateCache:
+    """LRU of job status snapshots
+
+    Snapshots written by this process's runner are authoritative until replaced. Snapshots
+    loaded from the database for jobs still running elsewhere (another worker) expire after
+    remote_ttl; finished jobs never change, so those are kept until evicted.
+    """
+
+    def __init__(self, max_items=JOB_STATE_CACHE_ITEMS, remote_ttl=JOB_STATE_REMOTE_TTL):
+        self.max_items = max_items
+        self.remote_ttl = remote_ttl
+        self._items = OrderedDict()  # job_id -> (snapshot, expires_at or None)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def put(self, job_id: str, snapshot: Dict, owned: bool = True):
+        final = snapshot.get('status') in FINAL_STATUSES
+        expires_at = None if owned or final else time.monotonic() + self.remote_ttl
+        with self._lock:
+            self._items[job_id] = (snapshot, expires_at)
+            self._items.move_to_end(job_id)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._items.get(job_id)
+            if entry is not None and (entry[1] is None or entry[1] > time.monotonic()):
+                self._items.move_to_end(job_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            return None
+
+    def update_progress(self, job_id: str, progress: str):
+        """Replace the progress text of a cached snapshot (no-op if the job isn't cached)"""
+        with self._lock:
+            entry = self._items.get(job_id)
+            if entry is not None:
+                self._items[job_id] = ({**entry[0], 'progress': progress}, entry[1])
+
+    def discard(self, job_id: str):
+        with self._lock:
+            self._items.pop(job_id, None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'items': len(self._items),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+job_states = JobStateCache()
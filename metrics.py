@@ -0,0 +1,294 @@
+"""
+Metrics in the Prometheus text exposition format, shared across gunicorn workers
+Counters and histograms are updated where things happen (job runner, Gemini call sites);
+callback metrics read queue and cache stats. Every worker writes a snapshot of its metrics
+to METRICS_DIR every few seconds and /metrics sums the snapshots of all live workers, so a
+scrape sees the whole dyno whichever worker answers it. StageSpans times the stages of one
+job so their durations can also be stored on the job row.
+"""
+
+import os
+import json
+import time
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Sequence
+
+# Constants
+METRICS_DIR = os.getenv('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'ranksimulator_metrics'))
+METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', '5'))
+METRICS_STALE_SECONDS = 60  # Snapshots older than this belong to exited workers and are removed
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+CALL_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60)
+TIMING_DECIMALS = 4
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _label_text(pairs) -> str:
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{n}="{_escape(v)}"' for n, v in pairs) + '}'
+
+
+def _number(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}  # label values tuple -> count
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(n, '') for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List:
+        with self._lock:
+            values = dict(self._values)
+        return [[f'{self.name}_total', list(zip(self.labels, key)), value] for key, value in sorted(values.items())]
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = STAGE_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._series = {}  # label values tuple -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(n, '') for n in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self) -> List:
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        out = []
+        for key, (counts, total, count) in sorted(series.items()):
+            pairs = list(zip(self.labels, key))
+            for bound, bucket_count in zip(self.buckets, counts):
+                out.append([f'{self.name}_bucket', pairs + [('le', _number(bound))], bucket_count])
+            out.append([f'{self.name}_sum', pairs, round(total, 6)])
+            out.append([f'{self.name}_count', pairs, count])
+        return out
+
+
+class Callback:
+    """Metric whose samples are read from fn() when a snapshot is taken
+
+    fn returns a number (unlabelled) or {label values tuple: number}. Values are summed across
+    workers, so callbacks report amounts (depths, counts), never ratios.
+    """
+
+    def __init__(self, name: str, help_text: str, fn: Callable, labels: Sequence[str] = (), kind: str = 'gauge'):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.labels = tuple(labels)
+        self.kind = kind
+
+    def samples(self) -> List:
+        values = self.fn()
+        if not isinstance(values, dict):
+            values = {(): values}
+        sample = f'{self.name}_total' if self.kind == 'counter' else self.name
+        return [[sample, list(zip(self.labels, key)), value] for key, value in sorted(values.items()) if value is not None]
+
+
+class MetricsRegistry:
+    """Named metrics of this process, exported to METRICS_DIR and merged with other workers' for /metrics"""
+
+    def __init__(self, directory=METRICS_DIR, flush_seconds=METRICS_FLUSH_SECONDS):
+        self.directory = directory
+        self.flush_seconds = flush_seconds
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help_text, labels=()) -> Counter:
+        return self._register(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=STAGE_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def callback(self, name, help_text, fn, labels=(), kind='gauge') -> Callback:
+        return self._register(Callback(name, help_text, fn, labels, kind))
+
+    def snapshot(self) -> Dict:
+        """{metric name: {help, kind, samples}} of this process, JSON-serializable"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        snapshot = {}
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                print(f'[Metrics] Collecting {metric.name} failed: {e}')
+                continue
+            snapshot[metric.name] = {'help': metric.help, 'kind': metric.kind, 'samples': samples}
+        return snapshot
+
+    def ensure_exporting(self):
+        """Start the snapshot writer lazily in the serving process (threads don't survive gunicorn's fork)"""
+        if not self.directory or (self._pid == os.getpid() and self._thread is not None and self._thread.is_alive()):
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._export_loop, name='metrics-export', daemon=True)
+            self._thread.start()
+
+    def _export_loop(self):
+        while True:
+            try:
+                self.export()
+            except Exception as e:
+                print(f'[Metrics] Export failed: {e}')
+            time.sleep(self.flush_seconds)
+
+    def export(self):
+        """Write this process's snapshot atomically to <directory>/<pid>.json"""
+        path = os.path.join(self.directory, f'{os.getpid()}.json')
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(f'{path}.tmp', path)
+
+    def _worker_snapshots(self) -> List[Dict]:
+        """This process's live snapshot plus the latest snapshot of every other live worker"""
+        snapshots = [self.snapshot()]
+        if not self.directory or not os.path.isdir(self.directory):
+            return snapshots
+        now = time.time()
+        own = f'{os.getpid()}.json'
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json') or name == own:
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) > METRICS_STALE_SECONDS:
+                    os.remove(path)
+                    continue
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # Being replaced or already removed by another worker
+        return snapshots
+
+    def render(self) -> str:
+        """Text exposition with every sample summed over the live workers"""
+        families = {}
+        for snapshot in self._worker_snapshots():
+            for name, family in snapshot.items():
+                merged = families.setdefault(name, {'help': family['help'], 'kind': family['kind'], 'samples': {}})
+                for sample, pairs, value in family['samples']:
+                    key = (sample, tuple(tuple(p) for p in pairs))
+                    merged['samples'][key] = merged['samples'].get(key, 0) + value
+        out = []
+        for name, family in families.items():
+            out.append(f'# HELP {name} {family["help"]}')
+            out.append(f'# TYPE {name} {family["kind"]}')
+            out.extend(f'{sample}{_label_text(pairs)} {_number(value)}'
+                       for (sample, pairs), value in family['samples'].items())
+        return '\n'.join(out) + '\n'
+
+
+metrics = MetricsRegistry()
+
+STAGE_SECONDS = metrics.histogram('ranksimulator_stage_duration_seconds',
+                                  'Duration of analysis pipeline stages', ('stage',), STAGE_BUCKETS)
+JOB_SECONDS = metrics.histogram('ranksimulator_job_duration_seconds',
+                                'Wall time of analysis jobs from start to finish', ('outcome',), STAGE_BUCKETS)
+JOBS = metrics.counter('ranksimulator_jobs', 'Analysis jobs finished', ('outcome',))
+API_CALL_SECONDS = metrics.histogram('ranksimulator_api_call_duration_seconds',
+                                     'Latency of Gemini LLM and embedding calls', ('kind', 'outcome'), CALL_BUCKETS)
+API_CALLS = metrics.counter('ranksimulator_api_calls', 'Gemini LLM and embedding calls', ('kind', 'outcome'))
+API_TOKENS = metrics.counter('ranksimulator_api_tokens', 'Tokens reported by Gemini', ('kind', 'direction'))
+API_CHARS = metrics.counter('ranksimulator_api_chars', 'Characters sent to and received from Gemini',
+                            ('kind', 'direction'))
+
+
+@contextmanager
+def timed_call(kind: str):
+    """Time one Gemini call: kind is generate, fanout or embed"""
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        API_CALL_SECONDS.observe(time.perf_counter() - started, kind=kind, outcome=outcome)
+
+
+class StageSpans:
+    """Stage durations of one job, recorded from any stage thread"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._durations = {}  # stage -> seconds, summed when a stage runs more than once
+        self.outcome = None
+
+    @contextmanager
+    def span(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started)
+
+    def add(self, stage: str, seconds: float):
+        """Record a duration measured elsewhere (e.g. parse time inside the fetch)"""
+        with self._lock:
+            self._durations[stage] = self._durations.get(stage, 0.0) + seconds
+        STAGE_SECONDS.observe(seconds, stage=stage)
+
+    def as_dict(self) -> Dict[str, float]:
+        with self._lock:
+            timings = {stage: round(s, TIMING_DECIMALS) for stage, s in self._durations.items()}
+        timings['total'] = round(time.perf_counter() - self.started, TIMING_DECIMALS)
+        return timings
+
+    def finish(self, outcome: str) -> Dict[str, float]:
+        """End of the job: count it, observe its total and return {stage: seconds} for storage"""
+        timings = self.as_dict()
+        if self.outcome is None:  # A job that fails after finishing is only counted once
+            JOB_SECONDS.observe(timings['total'], outcome=outcome)
+            JOBS.inc(outcome=outcome)
+        self.outcome = outcome
+        return timings
+
@@ -1,10 +1,30 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
+from sqlalchemy import inspect, text
+from sqlalchemy.types import TypeDecorator
 from datetime import datetime
+from result_store import pack_result, unpack_result
 
 db = SQLAlchemy()
 bcrypt = Bcrypt()
 
+
+class CompactResult(TypeDecorator):
+    """JSON column holding an analysis result in the compact storage format
+    
+    Values are packed on write and rebuilt on read, so callers always see the API shape;
+    rows written before the format existed are read unchanged.
+    """
+    impl = db.JSON
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        return pack_result(value)
+    
+    def process_result_value(self, value, dialect):
+        return unpack_result(value)
+
+
 class User(db.Model):
     """User model for authentication"""
     __tablename__ = 'users'
@@ -39,9 +59,39 @@ class User(db.Model):
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
+class BulkJob(db.Model):
+    """Bulk (URL list or sitemap) analysis job; each page is an AnalysisJob with this bulk_id"""
+    __tablename__ = 'bulk_jobs'
+    
+    bulk_id = db.Column(db.String(36), primary_key=True)  # UUID
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    source_type = db.Column(db.String(20), nullable=False)  # urls, sitemap
+    source = db.Column(db.String(500))  # Sitemap URL for sitemap jobs
+    urls = db.Column(db.JSON)  # Submitted URL list for urls jobs
+    status = db.Column(db.String(20), default='queued')  # queued, dispatching, processing, completed, error
+    total_urls = db.Column(db.Integer, default=0)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        """Convert bulk job to dictionary"""
+        return {
+            'bulk_id': self.bulk_id,
+            'source_type': self.source_type,
+            'source': self.source,
+            'status': self.status,
+            'total_urls': self.total_urls,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
 class AnalysisJob(db.Model):
     """Analysis job tracking model"""
     __tablename__ = 'analysis_jobs'
+    __table_args__ = (
+        db.Index('ix_analysis_jobs_status_updated', 'status', 'updated_at'),  # Retention scans
+    )
     
     job_id = db.Column(db.String(36), primary_key=True)  # UUID
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -49,7 +99,13 @@ class AnalysisJob(db.Model):
     status = db.Column(db.String(20), default='queued')  # queued, processing, completed, error
     progress = db.Column(db.String(200))
     error = db.Column(db.Text)
-    result_data = db.Column(db.JSON)
+    result_data = db.deferred(db.Column(CompactResult))  # Full result (bulk pages), loaded only when accessed
+    ai_visibility_score = db.Column(db.Float)  # Summary of the completed result, for bulk listings
+    entity = db.Column(db.String(200))
+    from_cache = db.Column(db.Boolean)  # Result reused from the page cache
+    content_gaps = db.Column(db.JSON)  # Uncovered queries per routing
+    stage_timings = db.Column(db.JSON)  # Seconds per pipeline stage (fetch, parse, entity, ...) plus total
+    bulk_id = db.Column(db.String(36), db.ForeignKey('bulk_jobs.bulk_id'), index=True)  # Set for pages of a bulk job
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -61,14 +117,20 @@ class AnalysisJob(db.Model):
             'progress': self.progress,
             'error': self.error,
             'result': self.result_data,
+            'stage_timings': self.stage_timings,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
 class Analysis(db.Model):
     """Analysis history model"""
     __tablename__ = 'analyses'
+    __table_args__ = (
+        # Serves the history listing: newest first per user, id breaks created_at ties
+        db.Index('ix_analyses_user_created', 'user_id', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.String(36), unique=True, index=True)  # Job that produced this entry; one row per job
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     url = db.Column(db.String(500), nullable=False)
     entity = db.Column(db.String(200))
@@ -76,7 +138,7 @@ class Analysis(db.Model):
     ai_visibility_score = db.Column(db.Float)
     total_queries = db.Column(db.Integer)
     covered_queries = db.Column(db.Integer)
-    result_data = db.Column(db.JSON)  # Store full analysis result
+    result_data = db.deferred(db.Column(CompactResult))  # Full analysis result, loaded only when accessed
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     def to_dict(self):
@@ -98,3 +160,126 @@ class Analysis(db.Model):
         data = self.to_dict()
         data['result_data'] = self.result_data
         return data
+
+
+class PageCache(db.Model):
+    """Last analysis of a canonical URL with its HTTP validators and content hash"""
+    __tablename__ = 'page_cache'
+    
+    url_hash = db.Column(db.String(64), primary_key=True)  # SHA-256 of the canonical URL
+    canonical_url = db.Column(db.String(500), nullable=False)
+    etag = db.Column(db.String(255))
+    last_modified = db.Column(db.String(64))
+    content_hash = db.Column(db.String(64))
+    job_id = db.Column(db.String(36))  # Job of the last completed analysis; its result is loaded through it
+    content_extraction = db.Column(db.String(10))  # CONTENT_EXTRACTION mode that result was scored with
+    analyzed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    checked_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        """Convert cache entry to dictionary"""
+        return {
+            'canonical_url': self.canonical_url,
+            'etag': self.etag,
+            'last_modified': self.last_modified,
+            'content_hash': self.content_hash,
+            'job_id': self.job_id,
+            'content_extraction': self.content_extraction,
+            'analyzed_at': self.analyzed_at.isoformat() if self.analyzed_at else None,
+            'checked_at': self.checked_at.isoformat() if self.checked_at else None
+        }
+
+
+class ApiUsage(db.Model):
+    """Gemini API usage of one analysis job; kept when the job row is purged"""
+    __tablename__ = 'api_usage'
+    __table_args__ = (
+        db.Index('ix_api_usage_user_created', 'user_id', 'created_at'),  # Per-user aggregates over a period
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.String(36), unique=True, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    bulk_id = db.Column(db.String(36), index=True)
+    url = db.Column(db.String(500))
+    outcome = db.Column(db.String(20))  # completed, reused, error
+    calls = db.Column(db.Integer, default=0)
+    errors = db.Column(db.Integer, default=0)
+    retries = db.Column(db.Integer, default=0)
+    embedded_texts = db.Column(db.Integer, default=0)
+    input_chars = db.Column(db.BigInteger, default=0)
+    output_chars = db.Column(db.BigInteger, default=0)
+    input_tokens = db.Column(db.BigInteger, default=0)  # NULL when some call's token counts are unknown
+    output_tokens = db.Column(db.BigInteger, default=0)
+    api_seconds = db.Column(db.Float, default=0.0)
+    word_count = db.Column(db.Integer)  # Page size and settings, to relate cost to its drivers
+    chunks = db.Column(db.Integer)
+    queries = db.Column(db.Integer)
+    settings = db.Column(db.JSON)
+    by_kind = db.Column(db.JSON)  # Same counters per call kind (generate, fanout, embed)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        """Convert usage record to dictionary"""
+        return {
+            'job_id': self.job_id,
+            'bulk_id': self.bulk_id,
+            'url': self.url,
+            'outcome': self.outcome,
+            'calls': self.calls,
+            'errors': self.errors,
+            'retries': self.retries,
+            'embedded_texts': self.embedded_texts,
+            'input_chars': self.input_chars,
+            'output_chars': self.output_chars,
+            'input_tokens': self.input_tokens,
+            'output_tokens': self.output_tokens,
+            'api_seconds': self.api_seconds,
+            'word_count': self.word_count,
+            'chunks': self.chunks,
+            'queries': self.queries,
+            'settings': self.settings,
+            'by_kind': self.by_kind,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+
+class MaintenanceLock(db.Model):
+    """Lease on a periodic maintenance task, so one process runs it at a time across workers"""
+    __tablename__ = 'maintenance_locks'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    holder = db.Column(db.String(100))  # host:pid of the process holding the lease
+    expires_at = db.Column(db.DateTime)  # NULL when released
+    last_run_at = db.Column(db.DateTime)  # End of the last completed run
+
+
+# Columns removed from the models, dropped from existing tables by ensure_schema()
+RETIRED_COLUMNS = {
+    'page_cache': ('result_data',)  # The page cache now references the job holding the result
+}
+
+
+def ensure_schema():
+    """Add columns and indexes introduced after a table was first created, drop retired columns
+    
+    db.create_all() only creates missing tables, so existing deployments would
+    otherwise never receive new columns.
+    """
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c['name'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                db.session.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                print(f'[Schema] Added column {table.name}.{column.name}')
+        for name in RETIRED_COLUMNS.get(table.name, ()):
+            if name in existing:
+                db.session.execute(text(f'ALTER TABLE {table.name} DROP COLUMN {name}'))
+                print(f'[Schema] Dropped column {table.name}.{name}')
+        db.session.commit()
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
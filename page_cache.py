@@ -0,0 +1,92 @@
+"""
+Page cache for skip-if-unchanged re-analysis
+Canonical URL -> HTTP validators + hash of the extracted content + job of the last analysis
+The result itself is not copied here; it is loaded from where the job stored it.
+"""
+
+import os
+import hashlib
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from models import db, PageCache
+
+# Constants
+PAGE_CACHE_MAX_AGE_SECONDS = int(os.getenv('PAGE_CACHE_MAX_AGE_SECONDS', str(7 * 24 * 3600)))
+TRACKING_PARAMS = {
+    'gclid', 'dclid', 'fbclid', 'msclkid', 'yclid', 'twclid', 'igshid',
+    'mc_cid', 'mc_eid', '_ga', '_gl', '_hsenc', '_hsmi', 'ref', 'ref_src'
+}
+TRACKING_PREFIXES = ('utm_', 'pk_', 'mtm_')
+
+
+def canonicalize_url(url: str) -> str:
+    """Lowercase scheme/host, drop default ports, fragments, tracking params and trailing slashes"""
+    parts = urlsplit(url.strip())
+    scheme = (parts.scheme or 'http').lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and not ((scheme == 'http' and parts.port == 80) or (scheme == 'https' and parts.port == 443)):
+        host = f'{host}:{parts.port}'
+
+    path = parts.path.rstrip('/') or '/'
+    params = [
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k.lower() not in TRACKING_PARAMS and not k.lower().startswith(TRACKING_PREFIXES)
+    ]
+    query = urlencode(sorted(params))
+    return urlunsplit((scheme, host, path, query, ''))
+
+
+def url_hash(url: str) -> str:
+    return hashlib.sha256(canonicalize_url(url).encode('utf-8')).hexdigest()
+
+
+def content_hash(title: str, content: str) -> str:
+    """Hash of the normalized extracted text, independent of markup changes"""
+    normalized = ' '.join(f'{title}\n{content}'.split()).lower()
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+def lookup(url: str):
+    """Cache entry for url, or None if missing or older than the max age"""
+    entry = PageCache.query.get(url_hash(url))
+    if entry is None or not entry.job_id:
+        return None
+    if entry.analyzed_at and datetime.utcnow() - entry.analyzed_at > timedelta(seconds=PAGE_CACHE_MAX_AGE_SECONDS):
+        return None
+    return entry
+
+
+def conditional_headers(entry) -> dict:
+    """If-None-Match / If-Modified-Since headers for a cached entry"""
+    headers = {}
+    if entry is not None:
+        if entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+    return headers
+
+
+def touch(entry, etag=None, last_modified=None):
+    """Record a successful revalidation without re-analysis"""
+    entry.checked_at = datetime.utcnow()
+    if etag:
+        entry.etag = etag
+    if last_modified:
+        entry.last_modified = last_modified
+    db.session.commit()
+
+
+def store(url: str, content_data: dict, job_id: str, extraction_mode: str):
+    """Save validators, content hash and the completed job after an analysis"""
+    key = url_hash(url)
+    entry = PageCache.query.get(key) or PageCache(url_hash=key)
+    entry.canonical_url = canonicalize_url(url)[:500]
+    entry.etag = content_data.get('etag')
+    entry.last_modified = content_data.get('last_modified')
+    entry.content_hash = content_hash(content_data['title'], content_data['content'])
+    entry.job_id = job_id
+    entry.content_extraction = extraction_mode
+    entry.analyzed_at = entry.checked_at = datetime.utcnow()
+    db.session.add(entry)
+    db.session.commit()
@@ -0,0 +1,216 @@
+"""
+In-process progress pub/sub for analysis jobs
+The job runner publishes stage transitions and results; SSE streams subscribe per job_id.
+ProgressReporter coalesces fine-grained stage progress before it reaches the database.
+"""
+
+import os
+import json
+import time
+import queue
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+from job_state import job_states
+
+# Constants
+PROGRESS_RETAIN_SECONDS = int(os.getenv('PROGRESS_RETAIN_SECONDS', '600'))  # Keep finished jobs' last event
+PROGRESS_FLUSH_SECONDS = float(os.getenv('PROGRESS_FLUSH_SECONDS', '10'))  # Min interval between progress writes
+SUBSCRIBER_QUEUE_SIZE = 100
+PROGRESS_MAX_CHARS = 200  # AnalysisJob.progress column size
+TERMINAL_EVENTS = ('completed', 'error', 'deleted')  # deleted: completed, but the result was deleted since
+
+
+def format_sse(event: str, data: Dict) -> str:
+    """One server-sent event frame"""
+    return f'event: {event}\ndata: {json.dumps(data, default=str)}\n\n'
+
+
+class ProgressBroker:
+    """Fan-out of job events to subscriber queues; remembers the latest state of each job"""
+
+    def __init__(self, retain_seconds=PROGRESS_RETAIN_SECONDS):
+        self.retain_seconds = retain_seconds
+        self._lock = threading.Lock()
+        self._subscribers = {}  # job_id -> set of Queue
+        self._last = {}  # job_id -> (event, data, published_at)
+        self.published = 0
+
+    def publish(self, job_id: str, event: str, data: Dict):
+        """Deliver an event to all current subscribers of job_id (never blocks the job runner)"""
+        now = time.time()
+        with self._lock:
+            self.published += 1
+            if event != 'partial':
+                self._last[job_id] = (event, data, now)
+            subscribers = list(self._subscribers.get(job_id, ()))
+            if event in TERMINAL_EVENTS:
+                self._prune(now)
+
+        for q in subscribers:
+            try:
+                q.put_nowait((event, data))
+            except queue.Full:
+                # Slow client: drop its oldest event rather than stall the job
+                try:
+                    q.get_nowait()
+                    q.put_nowait((event, data))
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def subscribe(self, job_id: str, replay: bool = False) -> queue.Queue:
+        """Queue of job_id's events; with replay it starts with the latest event already published
+
+        Registering and replaying happen under one lock, so a late subscriber cannot miss an
+        event published between reading the job's state and subscribing.
+        """
+        q = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(job_id, set()).add(q)
+            entry = self._last.get(job_id) if replay else None
+            if entry is not None:
+                q.put_nowait((entry[0], entry[1]))
+        return q
+
+    def unsubscribe(self, job_id: str, q: queue.Queue):
+        with self._lock:
+            subscribers = self._subscribers.get(job_id)
+            if subscribers is not None:
+                subscribers.discard(q)
+                if not subscribers:
+                    del self._subscribers[job_id]
+
+    def _prune(self, now):
+        cutoff = now - self.retain_seconds
+        for job_id in [j for j, (event, _, at) in self._last.items() if event in TERMINAL_EVENTS and at < cutoff]:
+            del self._last[job_id]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'jobs_tracked': len(self._last),
+                'streams': sum(len(s) for s in self._subscribers.values()),
+                'published': self.published
+            }
+
+
+progress_broker = ProgressBroker()
+
+
+class ProgressReporter:
+    """Fine-grained progress for one job, callable from any stage thread
+    
+    Every change is published to streams and the status cache immediately; the database
+    copy is written through persist(text) at most once per flush_seconds, whenever a stage
+    finishes, or on flush(force=True). close() writes the last message and ignores later
+    changes, so it must be called before the job's final status write.
+    """
+    
+    def __init__(self, job_id: str, persist: Optional[Callable[[str], None]] = None,
+                 flush_seconds: float = PROGRESS_FLUSH_SECONDS, broker: ProgressBroker = progress_broker):
+        self.job_id = job_id
+        self.persist = persist
+        self.flush_seconds = flush_seconds
+        self.broker = broker
+        self._lock = threading.Lock()
+        self._stages = OrderedDict()  # name -> [label, done, total], in start order
+        self._message = None
+        self._persisted = None
+        self._last_flush = time.monotonic()
+        self._persist_lock = threading.Lock()  # One persist at a time; forced flushes wait for it
+        self._closed = False
+        self.updates = 0
+        self.flushes = 0
+    
+    def stage(self, name: str, label: str):
+        with self._lock:
+            self._stages[name] = [label, 0, 0]
+        self._changed()
+    
+    def advance(self, name: str, done: int, total: int):
+        with self._lock:
+            entry = self._stages.setdefault(name, [name, 0, 0])
+            entry[1], entry[2] = done, total
+        self._changed()
+    
+    def finish(self, name: str):
+        with self._lock:
+            if self._stages.pop(name, None) is None:
+                return
+        self._changed()
+        self.flush(force=True)
+    
+    def close(self):
+        """Persist the latest message now; later changes (late stage threads) are dropped"""
+        self.flush(force=True)
+        with self._persist_lock, self._lock:
+            self._closed = True
+    
+    def _changed(self):
+        with self._lock:
+            if self._closed:
+                return
+            parts = [f'{label} {done}/{total}' if total else label for label, done, total in self._stages.values()]
+            if not parts:
+                return
+            message = ('; '.join(parts) + '...')[:PROGRESS_MAX_CHARS]
+            if message == self._message:
+                return
+            self._message = message
+            self.updates += 1
+            stages = {name: {'done': done, 'total': total} for name, (_, done, total) in self._stages.items()}
+            # Published under the lock so concurrent stages can't deliver updates out of order
+            job_states.update_progress(self.job_id, message)
+            self.broker.publish(self.job_id, 'status', {
+                'job_id': self.job_id,
+                'status': 'processing',
+                'progress': message,
+                'stages': stages
+            })
+        self.flush()
+    
+    def flush(self, force: bool = False):
+        """Persist the latest message if it changed and the flush interval has passed
+        
+        force=True skips the interval and waits for a flush in progress on another thread,
+        so the newest message is the one left in the database.
+        """
+        if self.persist is None:
+            return
+        if not self._persist_lock.acquire(blocking=force):
+            return  # Another thread is persisting; it or the next flush writes the newest message
+        try:
+            with self._lock:
+                message = self._message
+                due = force or time.monotonic() - self._last_flush >= self.flush_seconds
+                closed = self._closed
+            if closed or not due or message is None or message == self._persisted:
+                return
+            try:
+                self.persist(message)
+                with self._lock:
+                    self._persisted = message
+                    self.flushes += 1
+            except Exception as e:
+                print(f'[Progress] Flush failed for {self.job_id}: {e}')
+            finally:
+                with self._lock:
+                    self._last_flush = time.monotonic()
+        finally:
+            self._persist_lock.release()
+
+
+class _NullProgress:
+    """Progress sink for analyses run without a job"""
+    
+    def stage(self, name, label):
+        pass
+    
+    def advance(self, name, done, total):
+        pass
+    
+    def finish(self, name):
+        pass
+
+
+NULL_PROGRESS = _NullProgress()
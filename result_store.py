@@ -0,0 +1,68 @@
+"""
+Compact storage format for analysis results
+Each distinct chunk text is stored once and query_details reference it by index; large
+payloads are gzip-compressed. unpack_result() rebuilds the exact API JSON shape.
+"""
+
+import os
+import json
+import gzip
+import base64
+from typing import Optional
+
+# Constants
+RESULT_FORMAT = 'compact-v1'
+RESULT_GZIP_MIN_BYTES = int(os.getenv('RESULT_GZIP_MIN_BYTES', '2048'))  # Smaller payloads stay plain JSON
+RESULT_GZIP_LEVEL = 6
+
+
+def pack_result(result: Optional[dict]) -> Optional[dict]:
+    """API result -> compact storage dict (already-packed and non-dict values pass through)"""
+    if not isinstance(result, dict) or '_format' in result:
+        return result
+
+    chunks = []
+    chunk_index = {}
+    data = dict(result)
+    details = result.get('query_details')
+    if isinstance(details, list):
+        compact_details = []
+        for detail in details:
+            if isinstance(detail, dict) and isinstance(detail.get('best_chunk'), str):
+                text = detail['best_chunk']
+                if text not in chunk_index:
+                    chunk_index[text] = len(chunks)
+                    chunks.append(text)
+                detail = dict(detail)
+                detail['best_chunk'] = chunk_index[text]
+            compact_details.append(detail)
+        data['query_details'] = compact_details
+
+    packed = {'_format': RESULT_FORMAT, 'chunks': chunks, 'data': data}
+    raw = json.dumps(packed, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    if len(raw) < RESULT_GZIP_MIN_BYTES:
+        return packed
+    return {
+        '_format': f'{RESULT_FORMAT}+gzip',
+        'payload': base64.b64encode(gzip.compress(raw, compresslevel=RESULT_GZIP_LEVEL)).decode('ascii')
+    }
+
+
+def unpack_result(stored: Optional[dict]) -> Optional[dict]:
+    """Stored value -> API result; rows written before the compact format are returned as-is"""
+    if not isinstance(stored, dict) or '_format' not in stored:
+        return stored
+
+    if stored['_format'].endswith('+gzip'):
+        stored = json.loads(gzip.decompress(base64.b64decode(stored['payload'])))
+
+    chunks = stored['chunks']
+    data = stored['data']
+    details = data.get('query_details')
+    if isinstance(details, list):
+        data['query_details'] = [
+            {**detail, 'best_chunk': chunks[detail['best_chunk']]}
+            if isinstance(detail, dict) and isinstance(detail.get('best_chunk'), int) else detail
+            for detail in details
+        ]
+    return data
@@ -0,0 +1,252 @@
+"""
+Retention janitor for analysis jobs
+Deletes old analysis_jobs rows in small batches, per-status TTLs, optionally archiving each
+batch to a gzip JSON-lines file first; finished bulk jobs without pages left are removed too.
+Every worker runs the loop, but a lease row in maintenance_locks lets one process at a time
+purge, and scheduled runs happen once per interval across all workers.
+"""
+
+import os
+import json
+import gzip
+import time
+import socket
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List
+from sqlalchemy import or_
+from sqlalchemy.orm import undefer
+from sqlalchemy.exc import IntegrityError
+from models import db, AnalysisJob, BulkJob, MaintenanceLock
+
+# Constants
+RETENTION_ENABLED = os.getenv('RETENTION_ENABLED', 'true').lower() == 'true'
+RETENTION_INTERVAL_SECONDS = int(os.getenv('RETENTION_INTERVAL_SECONDS', '3600'))
+RETENTION_COMPLETED_DAYS = float(os.getenv('RETENTION_COMPLETED_DAYS', '30'))
+RETENTION_ERROR_DAYS = float(os.getenv('RETENTION_ERROR_DAYS', '7'))
+RETENTION_STALE_DAYS = float(os.getenv('RETENTION_STALE_DAYS', '2'))  # queued/processing jobs whose worker is gone
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', '500'))
+RETENTION_BATCH_PAUSE = 0.2  # Seconds between batches so other writers get the table
+RETENTION_ARCHIVE_DIR = os.getenv('RETENTION_ARCHIVE_DIR', '')  # Archive purged rows here; empty deletes without archiving
+RETENTION_LEASE_SECONDS = int(os.getenv('RETENTION_LEASE_SECONDS', '900'))  # Renewed per batch; a dead holder's lease expires
+LOCK_NAME = 'retention'
+
+
+def retention_policy() -> Dict[str, float]:
+    """Status -> age in days after which a job row is deleted"""
+    return {
+        'completed': RETENTION_COMPLETED_DAYS,
+        'error': RETENTION_ERROR_DAYS,
+        'queued': RETENTION_STALE_DAYS,
+        'processing': RETENTION_STALE_DAYS
+    }
+
+
+class RetentionJanitor:
+    """Periodic background purge of expired job rows"""
+
+    def __init__(self, app, interval_seconds=RETENTION_INTERVAL_SECONDS, batch_size=RETENTION_BATCH_SIZE,
+                 archive_dir=RETENTION_ARCHIVE_DIR, on_delete=None):
+        self.app = app
+        self.interval_seconds = interval_seconds
+        self.batch_size = max(1, batch_size)
+        self.archive_dir = archive_dir
+        self.on_delete = on_delete  # Called with each batch of deleted job_ids
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._holder = None
+        self.runs = 0
+        self.skipped = 0  # Another process held the lease or had just run
+        self.deleted = {}  # status -> rows deleted since start
+        self.bulk_deleted = 0
+        self.archived = 0
+        self.archive_bytes = 0
+        self.last_run_at = None
+        self.last_run_seconds = None
+        self.last_error = None
+
+    def ensure_running(self):
+        """Start the loop lazily in the serving process (threads don't survive gunicorn's fork)"""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._loop, name='retention-janitor', daemon=True)
+            self._thread.start()
+            print(f'[Retention] Janitor running every {self.interval_seconds}s')
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval_seconds)
+            try:
+                self.run_once(scheduled=True)
+            except Exception as e:
+                self.last_error = str(e)[:500]
+                print(f'[Retention] Run failed: {e}')
+
+    def run_once(self, scheduled=False) -> Dict[str, int]:
+        """One purge pass over all statuses; returns rows deleted per status
+
+        Skipped ({}) while another process holds the lease, and for scheduled runs also when
+        any process completed a run within the interval.
+        """
+        if not self._run_lock.acquire(blocking=False):
+            return {}
+        started = time.monotonic()
+        deleted = {}
+        claimed = False
+        try:
+            with self.app.app_context():
+                now = datetime.utcnow()
+                if not self._claim(now, scheduled):
+                    with self._lock:
+                        self.skipped += 1
+                    return {}
+                claimed = True
+                try:
+                    archive_path = self._archive_path(now) if self.archive_dir else None
+                    for status, days in retention_policy().items():
+                        if days <= 0:
+                            continue  # 0 disables retention for that status
+                        deleted[status] = self._purge_status(status, now - timedelta(days=days), archive_path)
+                    if RETENTION_COMPLETED_DAYS > 0:
+                        self.bulk_deleted += self._purge_bulk(now - timedelta(days=RETENTION_COMPLETED_DAYS))
+                finally:
+                    self._release()
+        finally:
+            if claimed:
+                with self._lock:
+                    self.runs += 1
+                    for status, count in deleted.items():
+                        self.deleted[status] = self.deleted.get(status, 0) + count
+                    self.last_run_at = datetime.utcnow().isoformat()
+                    self.last_run_seconds = round(time.monotonic() - started, 3)
+            self._run_lock.release()
+        if any(deleted.values()):
+            print(f'[Retention] Deleted {deleted} in {self.last_run_seconds}s')
+        return deleted
+
+    def _claim(self, now, scheduled) -> bool:
+        """Take the lease with one conditional UPDATE, which only one process can win"""
+        if MaintenanceLock.query.get(LOCK_NAME) is None:
+            try:
+                db.session.add(MaintenanceLock(name=LOCK_NAME))
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()  # Created by another process meanwhile
+        self._holder = f'{socket.gethostname()}:{os.getpid()}'
+        query = MaintenanceLock.query.filter(
+            MaintenanceLock.name == LOCK_NAME,
+            or_(MaintenanceLock.expires_at.is_(None), MaintenanceLock.expires_at < now)
+        )
+        if scheduled:
+            due = now - timedelta(seconds=self.interval_seconds * 0.9)  # Slack for timer drift between workers
+            query = query.filter(or_(MaintenanceLock.last_run_at.is_(None), MaintenanceLock.last_run_at < due))
+        claimed = query.update({
+            'holder': self._holder,
+            'expires_at': now + timedelta(seconds=RETENTION_LEASE_SECONDS)
+        }, synchronize_session=False)
+        db.session.commit()
+        return claimed == 1
+
+    def _renew(self) -> bool:
+        """Extend the lease between batches; False if it expired and was taken over"""
+        renewed = MaintenanceLock.query.filter_by(name=LOCK_NAME, holder=self._holder).update({
+            'expires_at': datetime.utcnow() + timedelta(seconds=RETENTION_LEASE_SECONDS)
+        }, synchronize_session=False)
+        db.session.commit()
+        return renewed == 1
+
+    def _release(self):
+        db.session.rollback()
+        MaintenanceLock.query.filter_by(name=LOCK_NAME, holder=self._holder).update({
+            'expires_at': None,
+            'last_run_at': datetime.utcnow()
+        }, synchronize_session=False)
+        db.session.commit()
+
+    def _purge_status(self, status, cutoff, archive_path) -> int:
+        total = 0
+        while True:
+            query = AnalysisJob.query.options(undefer(AnalysisJob.result_data)) if archive_path else AnalysisJob.query
+            jobs = (query
+                    .filter(AnalysisJob.status == status, AnalysisJob.updated_at < cutoff)
+                    .order_by(AnalysisJob.updated_at)
+                    .limit(self.batch_size)
+                    .all())
+            if not jobs:
+                return total
+            if archive_path:
+                self._archive(archive_path, jobs)
+            job_ids = [job.job_id for job in jobs]
+            db.session.expunge_all()
+            # Short transaction per batch; rows are addressed by primary key
+            AnalysisJob.query.filter(AnalysisJob.job_id.in_(job_ids)).delete(synchronize_session=False)
+            db.session.commit()
+            if self.on_delete:
+                self.on_delete(job_ids)
+            total += len(job_ids)
+            if len(job_ids) < self.batch_size or not self._renew():
+                return total
+            time.sleep(RETENTION_BATCH_PAUSE)
+
+    def _purge_bulk(self, cutoff) -> int:
+        """Finished bulk jobs older than cutoff whose pages are all gone"""
+        has_pages = db.session.query(AnalysisJob.job_id).filter(AnalysisJob.bulk_id == BulkJob.bulk_id).exists()
+        bulk_ids = [b for (b,) in db.session.query(BulkJob.bulk_id)
+                    .filter(BulkJob.status.in_(('completed', 'error')), BulkJob.updated_at < cutoff, ~has_pages)
+                    .limit(self.batch_size)
+                    .all()]
+        if bulk_ids:
+            BulkJob.query.filter(BulkJob.bulk_id.in_(bulk_ids)).delete(synchronize_session=False)
+            db.session.commit()
+        return len(bulk_ids)
+
+    def _archive_path(self, now) -> str:
+        os.makedirs(self.archive_dir, exist_ok=True)
+        return os.path.join(self.archive_dir, f'analysis_jobs-{now.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}.jsonl.gz')
+
+    def _archive(self, path, jobs: List[AnalysisJob]):
+        """Append one batch to the run's archive before it is deleted"""
+        lines = [
+            json.dumps({
+                'job_id': job.job_id,
+                'user_id': job.user_id,
+                'bulk_id': job.bulk_id,
+                'url': job.url,
+                'status': job.status,
+                'progress': job.progress,
+                'error': job.error,
+                'result_data': job.result_data,
+                'stage_timings': job.stage_timings,
+                'created_at': job.created_at.isoformat() if job.created_at else None,
+                'updated_at': job.updated_at.isoformat() if job.updated_at else None
+            }, default=str)
+            for job in jobs
+        ]
+        data = ('\n'.join(lines) + '\n').encode('utf-8')
+        with gzip.open(path, 'ab') as f:  # Each batch is its own gzip member; readers see one stream
+            f.write(data)
+        with self._lock:
+            self.archived += len(jobs)
+            self.archive_bytes += len(data)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'enabled': RETENTION_ENABLED,
+                'policy_days': retention_policy(),
+                'runs': self.runs,
+                'runs_skipped': self.skipped,
+                'rows_deleted': dict(self.deleted),
+                'bulk_jobs_deleted': self.bulk_deleted,
+                'rows_archived': self.archived,
+                'archived_bytes_uncompressed': self.archive_bytes,
+                'last_run_at': self.last_run_at,
+                'last_run_seconds': self.last_run_seconds,
+                'last_error': self.last_error
+            }
@@ -0,0 +1,81 @@
+"""
+Sitemap discovery for bulk analysis jobs
+Resolves sitemap.xml / sitemap index files (optionally gzipped) into a flat URL list
+"""
+
+import zlib
+import xml.etree.ElementTree as ET
+from typing import List
+from fetcher import get_fetcher
+
+# Constants
+MAX_SITEMAP_FILES = 50  # Nested sitemaps followed from an index
+SITEMAP_MAX_BYTES = 50 * 1024 * 1024  # Protocol limit for one uncompressed sitemap (also caps the download)
+
+
+class SitemapTooLarge(ValueError):
+    """A sitemap decompresses to more than SITEMAP_MAX_BYTES"""
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def gunzip_limited(content: bytes, limit: int = SITEMAP_MAX_BYTES) -> bytes:
+    """Decompress gzip data (all members), raising SitemapTooLarge past limit bytes of output
+    
+    Output is produced in max_length steps, so a small gzip bomb never expands in memory.
+    """
+    out = bytearray()
+    data = content
+    while data:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        out += decompressor.decompress(data, limit + 1 - len(out))
+        while decompressor.unconsumed_tail and len(out) <= limit:
+            out += decompressor.decompress(decompressor.unconsumed_tail, limit + 1 - len(out))
+        if len(out) > limit:
+            raise SitemapTooLarge(f'sitemap expands beyond {limit} bytes')
+        data = decompressor.unused_data
+    return bytes(out)
+
+
+def parse_sitemap(content: bytes):
+    """Parse one sitemap document; returns (page_urls, child_sitemap_urls)"""
+    if content[:2] == b'\x1f\x8b':
+        content = gunzip_limited(content)
+    root = ET.fromstring(content)
+
+    locs = [
+        el.text.strip() for el in root.iter()
+        if _local_name(el.tag) == 'loc' and el.text and el.text.strip()
+    ]
+    if _local_name(root.tag) == 'sitemapindex':
+        return [], locs
+    return locs, []
+
+
+def resolve_sitemap(sitemap_url: str, max_urls: int) -> List[str]:
+    """Breadth-first walk of a sitemap (index), returns up to max_urls page URLs in document order"""
+    fetcher = get_fetcher()
+    pending = [sitemap_url]
+    seen_sitemaps = set()
+    urls = []
+
+    while pending and len(urls) < max_urls and len(seen_sitemaps) < MAX_SITEMAP_FILES:
+        current = pending.pop(0)
+        if current in seen_sitemaps:
+            continue
+        seen_sitemaps.add(current)
+
+        page = fetcher.fetch(current, max_bytes=SITEMAP_MAX_BYTES)
+        try:
+            page_urls, child_sitemaps = parse_sitemap(page['content'])
+        except (SitemapTooLarge, zlib.error, ET.ParseError) as e:
+            # One oversized or broken sitemap is skipped; the rest of the index still counts
+            print(f"[Sitemap] Skipping {current}: {e}")
+            continue
+        print(f"[Sitemap] {current}: {len(page_urls)} URLs, {len(child_sitemaps)} nested sitemaps")
+        urls.extend(page_urls[:max_urls - len(urls)])
+        pending.extend(child_sitemaps)
+
+    return urls
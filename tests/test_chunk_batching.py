@@ -0,0 +1,92 @@
+"""
+Batch chunking: concurrent documents share chunk_batch passes and get their own chunks back
+
+Run: python -m pytest -q tests
+"""
+
+import os
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import colab_analyzer  # noqa: E402
+from colab_analyzer import ChunkBatcher  # noqa: E402
+
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeChunker:
+    """Stands in for SemanticChunker: one chunk per sentence, records each call"""
+
+    calls = []
+
+    def __init__(self, **kwargs):
+        pass
+
+    def chunk(self, text):
+        FakeChunker.calls.append(('chunk', 1))
+        return [FakeChunk(s) for s in text.split('.') if s.strip()]
+
+    def chunk_batch(self, texts, show_progress=True):
+        FakeChunker.calls.append(('chunk_batch', len(texts)))
+        return [self.chunk(t) for t in texts]
+
+
+def test_batch_entry_point_uses_one_chunk_batch_pass(monkeypatch):
+    monkeypatch.setattr(colab_analyzer, 'SemanticChunker', FakeChunker)
+    monkeypatch.setattr(colab_analyzer, 'get_chunker_embeddings', lambda: None)
+    monkeypatch.setattr(colab_analyzer, '_chunker_pool', [])
+    FakeChunker.calls = []
+    texts = [f'Doc {i} first. Doc {i} second.' for i in range(5)]
+
+    results = colab_analyzer.semantic_chunk_texts_chonkie(texts)
+
+    assert results == [[f'Doc {i} first', f'Doc {i} second'] for i in range(5)]
+    assert FakeChunker.calls[0] == ('chunk_batch', 5)
+
+
+def test_concurrent_documents_are_batched_and_answered_in_order():
+    release = threading.Event()
+    sizes = []
+
+    def chunk_many(texts):
+        sizes.append(len(texts))
+        if len(sizes) == 1:
+            release.wait(5)  # Hold the first batch so the other documents queue up behind it
+        return [[t.upper()] for t in texts]
+
+    batcher = ChunkBatcher(chunk_many, max_docs=16)
+    texts = [f'page {i}' for i in range(9)]
+    with ThreadPoolExecutor(max_workers=len(texts)) as pool:
+        first = pool.submit(batcher.chunk, texts[0])
+        while not sizes:
+            time.sleep(0.001)
+        rest = [pool.submit(batcher.chunk, t) for t in texts[1:]]
+        while len(batcher._pending) < len(rest):
+            time.sleep(0.001)
+        release.set()
+        results = [first.result()] + [f.result() for f in rest]
+
+    assert results == [[t.upper()] for t in texts]
+    assert sizes == [1, 8]
+    assert batcher.documents == 9
+
+
+def test_batch_errors_reach_every_caller_in_the_batch():
+    def chunk_many(texts):
+        raise RuntimeError('model failed')
+
+    batcher = ChunkBatcher(chunk_many)
+    try:
+        batcher.chunk('page')
+    except RuntimeError as e:
+        assert str(e) == 'model failed'
+    else:
+        raise AssertionError('expected the batch error')
+    assert not batcher._running
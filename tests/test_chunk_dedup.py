@@ -0,0 +1,60 @@
+"""
+Chunk dedup: stable fingerprints, and near-duplicate chunks reuse the first chunk's embedding
+
+Run: python -m pytest -q tests
+"""
+
+import os
+import sys
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+import colab_analyzer  # noqa: E402
+from chunk_dedup import ChunkIndex, simhashes, _hash64  # noqa: E402
+from embedding_cache import EmbeddingCache  # noqa: E402
+
+FOOTER = ('Acme Widgets ships worldwide from our warehouse in Rotterdam and every order over fifty euro '
+          'includes free returns within thirty days of delivery to your door')
+FOOTER_EDITED = FOOTER.replace('Rotterdam', 'Amsterdam')
+
+
+def test_fingerprints_do_not_depend_on_the_hash_seed():
+    script = ('import sys; sys.path.insert(0, %r); from chunk_dedup import simhashes, _hash64; '
+              'print(_hash64("footer"), simhashes([%r.split()])[0])' % (ROOT, FOOTER))
+    outputs = set()
+    for seed in ('1', '2'):
+        env = dict(os.environ, PYTHONHASHSEED=seed)
+        outputs.add(subprocess.run([sys.executable, '-c', script], env=env, capture_output=True,
+                                   text=True, check=True).stdout.split('\n')[-2])
+    assert outputs == {f'{_hash64("footer")} {simhashes([FOOTER.split()])[0]}'}
+
+
+def test_near_duplicate_chunks_reuse_the_cached_embedding(monkeypatch):
+    embedded = []
+
+    def embed_content(model, content, task_type):
+        embedded.extend(content)
+        return {'embedding': [[float(len(t)), 1.0] for t in content]}
+
+    index = ChunkIndex()
+    cache = EmbeddingCache(path='')
+    monkeypatch.setattr(colab_analyzer.genai, 'embed_content', embed_content)
+    monkeypatch.setattr(colab_analyzer, 'get_chunk_index', lambda: index)
+    monkeypatch.setattr(colab_analyzer, 'get_embedding_cache', lambda: cache)
+    analyzer = colab_analyzer.RankSimulatorAnalyzer.__new__(colab_analyzer.RankSimulatorAnalyzer)
+    analyzer.embed_batch_size, analyzer.embed_concurrency = 100, 1
+
+    def run(url, chunks):
+        _, _, sources = analyzer._stage_chunk_dedup(url, chunks)
+        return analyzer._stage_chunk_embeddings(chunks, sources)
+
+    first, reused = run('https://acme.example/a', ['Widgets for the garden.', FOOTER])
+    assert reused == 0 and len(embedded) == 2
+
+    second, reused = run('https://acme.example/b', ['Widgets for the kitchen.', FOOTER_EDITED])
+    assert reused == 1
+    assert embedded[2:] == ['Widgets for the kitchen.']  # The edited footer was not sent
+    assert np.array_equal(second[1], first[1])
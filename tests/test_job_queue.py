@@ -0,0 +1,41 @@
+"""
+JobQueue.submit_when_room: blocks while the queue is at its limit and wakes as soon as a worker takes a job
+
+Run: python -m pytest -q tests
+"""
+
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from job_queue import JobQueue  # noqa: E402
+
+
+def test_submit_when_room_waits_for_a_free_slot_and_keeps_the_reserve():
+    release = threading.Event()
+    started = threading.Event()
+    done = []
+
+    def hold():
+        started.set()
+        release.wait(5)
+
+    jobs = JobQueue(workers=1, max_size=3, name='test')
+    assert jobs.submit(hold)
+    started.wait(5)
+    jobs.submit_when_room(done.append, 'a', reserve=1)
+    jobs.submit_when_room(done.append, 'b', reserve=1)  # Queue now at max_size - reserve
+
+    submitter = threading.Thread(target=jobs.submit_when_room, args=(done.append, 'c'), kwargs={'reserve': 1})
+    submitter.start()
+    submitter.join(0.2)
+    assert submitter.is_alive()  # Blocked: only the reserved slot is free
+    assert jobs.submit(done.append, 'single')  # ... and it is still available to submit()
+
+    release.set()
+    submitter.join(5)
+    assert not submitter.is_alive()
+    jobs._queue.join()
+    assert done == ['a', 'b', 'single', 'c']
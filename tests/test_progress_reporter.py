@@ -0,0 +1,51 @@
+"""
+ProgressReporter: finished stages and close() write the newest message, late stage updates are dropped
+
+Run: python -m pytest -q tests
+"""
+
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from progress_events import ProgressReporter  # noqa: E402
+
+
+def test_finish_flushes_despite_the_interval():
+    persisted = []
+    reporter = ProgressReporter('job-1', persist=persisted.append, flush_seconds=3600)
+    reporter.stage('a', 'Stage A')
+    reporter.stage('b', 'Stage B')
+    reporter.advance('b', 1, 2)
+    assert persisted == []  # Throttled
+    reporter.finish('a')
+    assert persisted == ['Stage B 1/2...']
+
+
+def test_close_waits_for_a_running_flush_and_ignores_later_changes():
+    persisted = []
+    entered, release = threading.Event(), threading.Event()
+
+    def slow_persist(text):
+        entered.set()
+        release.wait(5)
+        persisted.append(text)
+
+    reporter = ProgressReporter('job-2', persist=slow_persist, flush_seconds=0)
+    stage_thread = threading.Thread(target=reporter.stage, args=('a', 'Stage A'))
+    stage_thread.start()
+    entered.wait(5)
+    reporter.advance('a', 5, 10)  # Changes while the first write is in flight
+
+    closer = threading.Thread(target=reporter.close)
+    closer.start()
+    closer.join(0.1)
+    assert closer.is_alive()  # Waits for the running flush
+    release.set()
+    closer.join(5)
+    stage_thread.join(5)
+
+    reporter.advance('a', 9, 10)  # A late stage thread after the final write
+    assert persisted == ['Stage A...', 'Stage A 5/10...']
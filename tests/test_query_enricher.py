@@ -0,0 +1,92 @@
+"""
+QueryEnricher must classify exactly like the rule-by-rule functions it replaced
+
+Run: python -m pytest -q tests
+"""
+
+import os
+import sys
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from colab_analyzer import (  # noqa: E402
+    QueryEnricher, enrich_queries, classify_query_intent, determine_routing_format,
+    get_reasoning_by_category, classify_query_type, INTENT_RULES, ROUTING_RULES, REASONING_RULES,
+    CONVERSATIONAL_WORDS, QUESTION_PREFIXES
+)
+
+FIXED_QUERIES = [
+    'what is seo audit',
+    'How to run an SEO audit step by step?',
+    'seo audit checklist template',
+    'best tools for seo audit vs manual review',
+    'seo audit pricing and services',
+    'automate seo audit with python script',
+    'seo audit case study examples',
+    'troubleshoot seo audit errors',
+    'download seo audit spreadsheet',
+    'where is the seo audit login',
+    'explain seo audit to me',
+    'tell me about seo audits for small business websites in 2024',
+    'seo',
+    '',
+    '   padded query   ',
+    'SEO AUDIT VERSUS SITE CRAWL',
+    'stepsto guide',  # Overlapping keywords without spaces
+    'faq: frequently asked questions about audits',
+    'compare top tools, software for api monitoring',
+    'real-world success story of a roi-focused budget',
+]
+
+
+def baseline(query_text):
+    """The enrichment as it was computed before QueryEnricher, one rule table at a time"""
+    routing, format_reason = determine_routing_format(query_text)
+    return {
+        'query': query_text.strip(),
+        'type': classify_query_type(query_text),
+        'user_intent': classify_query_intent(query_text),
+        'routing_format': routing,
+        'format_reason': format_reason,
+        'reasoning': get_reasoning_by_category(query_text)
+    }
+
+
+def random_queries(count, seed=1234):
+    """Queries stitched from rule keywords, question words and filler, so rules collide often"""
+    rng = random.Random(seed)
+    keywords = [kw for rules in (INTENT_RULES, ROUTING_RULES, REASONING_RULES) for words, _ in rules for kw in words]
+    vocabulary = keywords + list(CONVERSATIONAL_WORDS) + list(QUESTION_PREFIXES) + \
+        ['seo', 'audit', 'content', 'marketing', 'website', 'for', 'the', 'a', 'of', 'to', 'with']
+    queries = []
+    for _ in range(count):
+        words = [rng.choice(vocabulary) for _ in range(rng.randint(1, 10))]
+        joiner = rng.choice([' ', ' ', ' ', '', '-'])
+        text = joiner.join(words)
+        if rng.random() < 0.3:
+            text = text.upper() if rng.random() < 0.5 else text.title()
+        if rng.random() < 0.2:
+            text += '?'
+        queries.append(text)
+    return queries
+
+
+def test_fixed_corpus_matches_baseline():
+    enricher = QueryEnricher()
+    for query in FIXED_QUERIES:
+        assert enricher.enrich(query) == baseline(query), query
+
+
+def test_random_corpus_matches_baseline():
+    enricher = QueryEnricher()
+    for query in random_queries(20000):
+        assert enricher.enrich(query) == baseline(query), query
+
+
+def test_batch_matches_single_and_copies_repeats():
+    queries = FIXED_QUERIES + FIXED_QUERIES[:5]
+    results = enrich_queries(queries)
+    assert results == [baseline(q) for q in queries]
+    results[0]['type'] = 'changed'
+    assert results[len(FIXED_QUERIES)]['type'] == baseline(queries[0])['type']
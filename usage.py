@@ -0,0 +1,146 @@
+"""
+Gemini API accounting
+Every LLM and embedding call goes through api_call(), which times it and records call count,
+characters, tokens (when the API reports them; None = unknown), retries and errors on the
+UsageMeter of the job that made it. The meter is found through a context variable that StageGraph and
+embed_texts carry into their worker threads; one ApiUsage row per job stores the totals.
+"""
+
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Optional
+from metrics import timed_call, API_CALLS, API_TOKENS, API_CHARS
+
+# Constants
+USAGE_FIELDS = ('calls', 'errors', 'retries', 'texts', 'input_chars', 'output_chars',
+                'input_tokens', 'output_tokens', 'seconds')
+
+_current_meter = contextvars.ContextVar('usage_meter', default=None)
+
+
+class UsageMeter:
+    """API usage of one job, per call kind (generate, fanout, embed)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._kinds = {}  # kind -> {field: value}
+        self._untracked = set()  # Kinds with calls whose token counts are unknown
+
+    def record(self, kind: str, seconds: float, ok: bool, retry: bool = False, texts: int = 0,
+               input_chars: int = 0, output_chars: int = 0, input_tokens: Optional[int] = 0,
+               output_tokens: Optional[int] = 0):
+        with self._lock:
+            entry = self._kinds.setdefault(kind, dict.fromkeys(USAGE_FIELDS, 0))
+            entry['calls'] += 1
+            entry['errors'] += 0 if ok else 1
+            entry['retries'] += 1 if retry else 0
+            entry['texts'] += texts
+            entry['input_chars'] += input_chars
+            entry['output_chars'] += output_chars
+            if input_tokens is None or output_tokens is None:
+                self._untracked.add(kind)
+            else:
+                entry['input_tokens'] += input_tokens
+                entry['output_tokens'] += output_tokens
+            entry['seconds'] += seconds
+
+    def as_dict(self) -> Dict:
+        """Totals over all kinds plus a 'by_kind' breakdown; token counts are None where any call's are unknown"""
+        with self._lock:
+            by_kind = {kind: {**entry, 'seconds': round(entry['seconds'], 4)} for kind, entry in self._kinds.items()}
+            for kind in self._untracked:
+                by_kind[kind]['input_tokens'] = by_kind[kind]['output_tokens'] = None
+        totals = {}
+        for field in USAGE_FIELDS:
+            values = [entry[field] for entry in by_kind.values()]
+            totals[field] = None if None in values else sum(values)
+        totals['seconds'] = round(totals['seconds'], 4)
+        return {**totals, 'by_kind': by_kind}
+
+
+@contextmanager
+def metering(meter: UsageMeter):
+    """Attribute API calls made in this context (and stage threads started from it) to meter"""
+    token = _current_meter.set(meter)
+    try:
+        yield meter
+    finally:
+        _current_meter.reset(token)
+
+
+def current_meter() -> Optional[UsageMeter]:
+    return _current_meter.get()
+
+
+class _Call:
+    """Sizes of one API call, filled in by the call site"""
+
+    def __init__(self, input_chars, texts):
+        self.input_chars = input_chars
+        self.texts = texts
+        self.output_chars = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def generated(self, response):
+        """Read text length and token counts from a GenerateContentResponse"""
+        try:
+            self.output_chars = len(response.text or '')
+        except Exception:
+            pass  # Blocked or empty candidates have no text
+        usage = getattr(response, 'usage_metadata', None)
+        if usage is None:
+            self.input_tokens = self.output_tokens = None
+        else:
+            self.input_tokens = getattr(usage, 'prompt_token_count', 0) or 0
+            self.output_tokens = getattr(usage, 'candidates_token_count', 0) or 0
+
+    def predicted(self, prediction, lm=None, history_start=None):
+        """Read token counts of a DSPy call, or mark them unknown (None)
+
+        DSPy with track_usage reports them on the prediction. Older DSPy (the pinned 2.5) only
+        keeps them in the LM's history, so the entry this call appended is used when it is the
+        only one appended since len(lm.history) was history_start; concurrent calls make that
+        ambiguous, and cached or non-LiteLLM clients carry no usage.
+        """
+        try:
+            usage = prediction.get_lm_usage() or {}
+        except Exception:
+            usage = {}
+        history = getattr(lm, 'history', None)
+        if not usage and history_start is not None and isinstance(history, list) and len(history) == history_start + 1:
+            entry = history[-1] if isinstance(history[-1], dict) else {}
+            usage = {'lm': entry.get('usage')} if entry.get('usage') else {}
+        if not usage:
+            self.input_tokens = self.output_tokens = None
+            return
+        for model_usage in usage.values():
+            self.input_tokens += (model_usage or {}).get('prompt_tokens', 0) or 0
+            self.output_tokens += (model_usage or {}).get('completion_tokens', 0) or 0
+
+
+@contextmanager
+def api_call(kind: str, input_chars: int = 0, texts: int = 0, retry: bool = False):
+    """Account one Gemini call of kind generate, fanout or embed; retry marks a repeat attempt"""
+    call = _Call(input_chars, texts)
+    started = time.perf_counter()
+    ok = False
+    try:
+        with timed_call(kind):
+            yield call
+        ok = True
+    finally:
+        seconds = time.perf_counter() - started
+        API_CALLS.inc(kind=kind, outcome='ok' if ok else 'error')
+        API_CHARS.inc(call.input_chars, kind=kind, direction='input')
+        API_CHARS.inc(call.output_chars, kind=kind, direction='output')
+        if call.input_tokens or call.output_tokens:
+            API_TOKENS.inc(call.input_tokens, kind=kind, direction='input')
+            API_TOKENS.inc(call.output_tokens, kind=kind, direction='output')
+        meter = _current_meter.get()
+        if meter is not None:
+            meter.record(kind, seconds, ok, retry=retry, texts=call.texts, input_chars=call.input_chars,
+                         output_chars=call.output_chars, input_tokens=call.input_tokens,
+                         output_tokens=call.output_tokens)